@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class AppRunConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app_run"
+
+    def ready(self):
+        from app_run import signals  # noqa: F401
+        from app_run.middleware import install_query_recorder
+
+        # Обертка замера SQL (QueryInstrumentationMiddleware) ставится на каждое соединение при подключении,
+        # в том числе в потоках sync_to_async, где async-представления ходят в БД
+        connection_created.connect(install_query_recorder, dispatch_uid='app_run.sql_recorder')
@@ -0,0 +1,138 @@
+"""
+Асинхронные варианты горячих эндпоинтов трекинга для запуска под ASGI (см. project_run/asgi.py).
+
+DRF синхронный, поэтому здесь обычные async-представления Django: чтение забега идет через
+async ORM, а транзакционные сервисы (save_positions, переходы статуса) переиспользуются
+через sync_to_async, чтобы поведение совпадало с синхронными эндпоинтами.
+"""
+import asyncio
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_POST
+
+from rest_framework import status
+
+from app_run.ingest import ingest_points, save_positions
+from app_run.ingest_filters import filter_points, remember
+from app_run.metrics import RunNotActive
+from app_run.models import Run, Position
+from app_run.serializers import PositionBulkItemSerializer, PositionPointSerializer, PositionSerializer
+from app_run.views import RUN_NOT_ACTIVE_ERROR, RunStartAPIView, RunStopAPIView
+from app_run.write_behind import get_buffer
+
+
+_db_slots = weakref.WeakKeyDictionary()
+
+
+def _db_slot():
+    """
+    Ограничитель одновременных обращений к БД на event loop процесса. Каждое обращение через
+    sync_to_async занимает поток и соединение; лишние устройства ждут здесь, в корутине, а не в потоке.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _db_slots:
+        _db_slots[loop] = asyncio.Semaphore(settings.ASYNC_DB_CONCURRENCY)
+    return _db_slots[loop]
+
+
+def _read_json(request):
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        return None
+
+
+async def _get_active_run(run_id):
+    try:
+        async with _db_slot():
+            run = await Run.objects.defer('track').aget(pk=run_id)
+    except Run.DoesNotExist:
+        raise Http404
+    if run.status != 'in_progress':
+        return None
+    return run
+
+
+def _append_to_buffer(position):
+    get_buffer().append([position])
+
+
+def _run_not_active():
+    return JsonResponse({'error': RUN_NOT_ACTIVE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@require_POST
+async def position_create(request, run_id):
+    """Одна точка от устройства: тот же контракт, что у синхронного POST /api/positions/, забег из адреса."""
+    serializer = PositionPointSerializer(data=_read_json(request))
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    run = await _get_active_run(run_id)
+    if run is None:
+        return _run_not_active()
+    kept, dropped = filter_points(run, [serializer.validated_data])
+    if not kept:
+        # Как и у синхронного эндпоинта: точка не записана, accepted = 0
+        return JsonResponse({'run': run.id, 'accepted': 0, 'dropped': dropped}, status=status.HTTP_200_OK)
+    if settings.POSITIONS_WRITE_BEHIND:
+        # Запись в журнал без обращения к БД, см. app_run.write_behind. Это блокирующий файловый ввод-вывод
+        # под блокировкой буфера, поэтому он идет в потоке, а не в event loop
+        position = Position(run=run, **serializer.validated_data)
+        await sync_to_async(_append_to_buffer, thread_sensitive=False)(position)
+        remember(run, kept)
+        return JsonResponse(PositionSerializer(position).data, status=status.HTTP_202_ACCEPTED)
+    try:
+        async with _db_slot():
+            positions = await sync_to_async(save_positions)(run, kept)
+    except RunNotActive:
+        return _run_not_active()
+    remember(run, kept)
+    return JsonResponse(PositionSerializer(positions[0]).data, status=status.HTTP_201_CREATED)
+
+
+@require_POST
+async def positions_bulk_create(request, run_id):
+    serializer = PositionBulkItemSerializer(
+        data=_read_json(request),
+        many=True,
+        allow_empty=False,
+        max_length=settings.POSITIONS_BULK_MAX_SIZE
+    )
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST, safe=False)
+
+    run = await _get_active_run(run_id)
+    if run is None:
+        return _run_not_active()
+    try:
+        async with _db_slot():
+            positions, dropped = await sync_to_async(ingest_points)(run, serializer.validated_data)
+    except RunNotActive:
+        return _run_not_active()
+    return JsonResponse(
+        {'run_id': run.id, 'created': len(positions), 'dropped': dropped}, status=status.HTTP_201_CREATED
+    )
+
+
+async def _transition(view_class, run_id):
+    view = view_class()
+    async with _db_slot():
+        run = await sync_to_async(view.perform_transition)(run_id)
+    if run is None:
+        return JsonResponse({'error': view.error_message}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse({'status': view.success_message, 'run_id': run.id, 'current_status': run.status})
+
+
+@require_POST
+async def run_start(request, run_id):
+    return await _transition(RunStartAPIView, run_id)
+
+
+@require_POST
+async def run_stop(request, run_id):
+    return await _transition(RunStopAPIView, run_id)
@@ -0,0 +1,92 @@
+import gc
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from app_run.geo import haversine
+from app_run.metrics import segment_speed
+from app_run.models import Run, Position
+
+
+@contextmanager
+def isolated_database(verbosity=0):
+    """Временная тестовая БД: бенчмарки наполняют ее синтетикой и не трогают рабочие данные."""
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def timed(func, repeat):
+    # Как и timeit, отключаем сборщик мусора на время замера, чтобы снизить разброс
+    durations = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            durations.append(time.perf_counter() - started)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return durations, result
+
+
+def seed_athletes(count, prefix='bench'):
+    User.objects.bulk_create(
+        [User(username=f'{prefix}-{i}', first_name=f'Имя {i}', last_name=f'Фамилия {i}') for i in range(count)],
+        batch_size=5000,
+    )
+    return list(User.objects.filter(username__startswith=f'{prefix}-').order_by('pk'))
+
+
+def seed_athlete_ids(count, prefix='bench', batch_size=5000):
+    """Как seed_athletes, но без объектов в памяти: для миллионов спортсменов нужны только id."""
+    for start in range(0, count, batch_size):
+        User.objects.bulk_create(
+            [User(username=f'{prefix}-{i}') for i in range(start, min(count, start + batch_size))]
+        )
+    return list(User.objects.filter(username__startswith=f'{prefix}-').order_by('pk').values_list('pk', flat=True))
+
+
+def seed_runs(athletes, runs_per_athlete, status='finished'):
+    runs = [
+        Run(athlete=athlete, status=status, comment=f'Забег {i}', distance=5000 + i, moving_time=1500 + i)
+        for athlete in athletes
+        for i in range(runs_per_athlete)
+    ]
+    return Run.objects.bulk_create(runs, batch_size=5000)
+
+
+def seed_track(run, points, started_at=None):
+    started_at = started_at or timezone.now() - timedelta(seconds=points)
+    positions = (
+        Position(
+            run=run,
+            latitude=Decimal(55 + (i % 9000) / 10000).quantize(Decimal('0.0001')),
+            longitude=Decimal(37 + (i % 7000) / 10000).quantize(Decimal('0.0001')),
+            created_at=started_at + timedelta(seconds=i),
+        ).fill_geohash()
+        for i in range(points)
+    )
+    batch, previous, distance = [], None, 0.0
+    for position in positions:
+        # Скорость и дистанция точек как при обычной загрузке, иначе сплиты по синтетике пустые
+        if previous is not None:
+            segment = haversine(previous.latitude, previous.longitude, position.latitude, position.longitude)
+            distance += segment
+            position.speed = segment_speed(segment, (position.created_at - previous.created_at).total_seconds())
+        position.distance = distance
+        previous = position
+        batch.append(position)
+        if len(batch) == 5000:
+            Position.objects.bulk_create(batch)
+            batch = []
+    Position.objects.bulk_create(batch)
@@ -0,0 +1,77 @@
+from app_run.models import Challenge
+from app_run.response_cache import invalidate
+
+
+class ChallengeRule:
+    """Правило челленджа проверяется по накопленным показателям спортсмена (AthleteInfo)."""
+
+    def __init__(self, full_name):
+        self.full_name = full_name
+
+    def is_achieved(self, athlete_info):
+        raise NotImplementedError
+
+
+class FinishedRunsRule(ChallengeRule):
+    def __init__(self, full_name, runs):
+        super().__init__(full_name)
+        self.runs = runs
+
+    def is_achieved(self, athlete_info):
+        return athlete_info.runs_finished >= self.runs
+
+
+class TotalDistanceRule(ChallengeRule):
+    def __init__(self, full_name, meters):
+        super().__init__(full_name)
+        self.meters = meters
+
+    def is_achieved(self, athlete_info):
+        return athlete_info.total_distance >= self.meters
+
+
+class StreakRule(ChallengeRule):
+    def __init__(self, full_name, days):
+        super().__init__(full_name)
+        self.days = days
+
+    def is_achieved(self, athlete_info):
+        return athlete_info.best_streak_days >= self.days
+
+
+class Fastest5kRule(ChallengeRule):
+    def __init__(self, full_name, seconds):
+        super().__init__(full_name)
+        self.seconds = seconds
+
+    def is_achieved(self, athlete_info):
+        return athlete_info.best_5k_time is not None and athlete_info.best_5k_time <= self.seconds
+
+
+# Реестр челленджей: чтобы добавить челлендж, достаточно добавить правило сюда
+# и прогнать manage.py award_challenges для уже накопленных данных
+CHALLENGE_RULES = [
+    FinishedRunsRule("Сделай 10 Забегов!", runs=10),
+    FinishedRunsRule("Сделай 50 Забегов!", runs=50),
+    TotalDistanceRule("Пробеги 100 километров!", meters=100_000),
+    StreakRule("Бегай 7 дней подряд!", days=7),
+    Fastest5kRule("Пробеги 5 км быстрее 25 минут!", seconds=25 * 60),
+]
+
+
+def award_challenges(athlete_infos, rules=None):
+    """
+    Выдает все достигнутые челленджи одним INSERT. Повторная выдача игнорируется
+    за счет unique_together (full_name, athlete), поэтому вызов идемпотентен.
+    """
+    rules = CHALLENGE_RULES if rules is None else rules
+    challenges = [
+        Challenge(athlete_id=athlete_info.user_id, full_name=rule.full_name)
+        for athlete_info in athlete_infos
+        for rule in rules
+        if rule.is_achieved(athlete_info)
+    ]
+    Challenge.objects.bulk_create(challenges, ignore_conflicts=True)
+    if challenges:
+        invalidate('challenges', *(challenge.athlete_id for challenge in challenges))
+    return challenges
@@ -0,0 +1,128 @@
+from datetime import timedelta
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from app_run.models import Run, AthleteInfo
+from app_run.response_cache import invalidate
+from app_run.upserts import increment_or_create
+
+STATUS_COUNTERS = {
+    'in_progress': 'runs_in_progress',
+    'finished': 'runs_finished',
+}
+
+
+def count_runs(athlete_ids):
+    """Фактические значения счетчиков по таблице Run: {athlete_id: {поле: значение}}."""
+    rows = (
+        Run.objects
+        .filter(athlete_id__in=athlete_ids)
+        .values('athlete_id')
+        .annotate(
+            runs_total=Count('id'),
+            runs_in_progress=Count('id', filter=Q(status='in_progress')),
+            runs_finished=Count('id', filter=Q(status='finished')),
+        )
+    )
+    counts = {
+        athlete_id: {'runs_total': 0, 'runs_in_progress': 0, 'runs_finished': 0}
+        for athlete_id in athlete_ids
+    }
+    for row in rows:
+        counts[row.pop('athlete_id')] = row
+    return counts
+
+
+def status_deltas(status, sign=1):
+    deltas = {'runs_total': sign}
+    if status in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[status]] = sign
+    return deltas
+
+
+def transition_deltas(old_status, new_status):
+    deltas = {}
+    if old_status in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[old_status]] = -1
+    if new_status in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[new_status]] = deltas.get(STATUS_COUNTERS[new_status], 0) + 1
+    return deltas
+
+
+def adjust_run_counters(athlete_id, deltas):
+    """
+    Атомарно сдвигает счетчики забегов спортсмена через UPDATE ... SET x = x + delta.
+    Вызывается после изменения Run в той же транзакции: если AthleteInfo еще нет,
+    она создается сразу с фактическими значениями из таблицы Run.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if 'runs_finished' in deltas:
+        # Число завершенных забегов выводится в списке пользователей
+        invalidate('users')
+
+    values = {field: F(field) + delta for field, delta in deltas.items()}
+    # update() не трогает auto_now, время изменения для синхронизации ставим сами
+    values['updated_at'] = timezone.now()
+    increment_or_create(AthleteInfo, {'user_id': athlete_id}, values, lambda: count_runs([athlete_id])[athlete_id])
+
+
+AGGREGATE_FIELDS = ['total_distance', 'current_streak_days', 'best_streak_days', 'last_run_date', 'best_5k_time']
+
+
+def add_finished_run(athlete_info, distance, best_5k_time, run_date):
+    athlete_info.total_distance += distance
+
+    if athlete_info.last_run_date is None or run_date - athlete_info.last_run_date > timedelta(days=1):
+        athlete_info.current_streak_days = 1
+    elif run_date - athlete_info.last_run_date == timedelta(days=1):
+        athlete_info.current_streak_days += 1
+    athlete_info.best_streak_days = max(athlete_info.best_streak_days, athlete_info.current_streak_days)
+    if athlete_info.last_run_date is None or run_date > athlete_info.last_run_date:
+        athlete_info.last_run_date = run_date
+
+    # Самые быстрые 5 км подряд посчитаны по треку забега (app_run.metrics.fastest_window_time)
+    if best_5k_time is not None and (athlete_info.best_5k_time is None or best_5k_time < athlete_info.best_5k_time):
+        athlete_info.best_5k_time = best_5k_time
+
+
+def record_finished_run(run):
+    """
+    Добавляет завершенный забег к накопленным показателям спортсмена, не перечитывая историю.
+    День забега - дата его начала, как и в rebuild_aggregates: забег через полночь не разрывает серию.
+    """
+    athlete_info = AthleteInfo.objects.select_for_update().get(user_id=run.athlete_id)
+    add_finished_run(athlete_info, run.distance, run.best_5k_time, timezone.localdate(run.created_at))
+    athlete_info.save(update_fields=[*AGGREGATE_FIELDS, 'updated_at'])
+    return athlete_info
+
+
+def rebuild_aggregates(athlete_infos):
+    """Пересчитывает показатели с нуля по завершенным забегам, используется для истории."""
+    by_athlete = {athlete_info.user_id: athlete_info for athlete_info in athlete_infos}
+    updated_at = timezone.now()
+    for athlete_info in athlete_infos:
+        athlete_info.updated_at = updated_at
+        athlete_info.total_distance = 0
+        athlete_info.current_streak_days = athlete_info.best_streak_days = 0
+        athlete_info.last_run_date = athlete_info.best_5k_time = None
+
+    runs = (
+        Run.objects
+        .filter(athlete_id__in=by_athlete, status='finished')
+        .order_by('athlete_id', 'created_at')
+        .values_list('athlete_id', 'distance', 'best_5k_time', 'created_at')
+    )
+    for athlete_id, distance, best_5k_time, created_at in runs.iterator():
+        add_finished_run(by_athlete[athlete_id], distance, best_5k_time, timezone.localdate(created_at))
+    AthleteInfo.objects.bulk_update(athlete_infos, [*AGGREGATE_FIELDS, 'updated_at'])
+
+
+def rebuild_athlete_aggregates(athlete_ids):
+    """
+    Пересчитывает показатели спортсменов, у которых забрали завершенный забег (удаление, смена спортсмена):
+    дистанцию еще можно вычесть, а серии и лучшее время - только посчитать заново.
+    """
+    rebuild_aggregates(list(AthleteInfo.objects.select_for_update().filter(user_id__in=athlete_ids)))
@@ -0,0 +1,124 @@
+import json
+import zipfile
+from datetime import timezone as dt_timezone
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+from app_run.models import Run, Position
+from app_run.track import unpack_track
+
+EXPORT_FORMATS = {
+    'gpx': 'application/gpx+xml',
+    'csv': 'text/csv; charset=utf-8',
+    'geojson': 'application/geo+json',
+}
+
+
+def iter_points(run_id):
+    """Точки трека (latitude, longitude, created_at) по порядку, без загрузки всего трека в память."""
+    track = Run.objects.filter(pk=run_id, track__isnull=False).values_list('track', flat=True).first()
+    if track is not None:
+        for _, latitude, longitude, created_at in unpack_track(track):
+            yield latitude, longitude, created_at
+        return
+    positions = (
+        Position.objects
+        .filter(run_id=run_id)
+        .order_by('created_at', 'id')
+        .values_list('latitude', 'longitude', 'created_at')
+    )
+    yield from positions.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def _isoformat(moment):
+    return moment.astimezone(dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _chunked(parts):
+    # Отдаем клиенту пачки строк, а не по строке на точку: меньше накладных расходов на итерацию
+    buffer = []
+    for part in parts:
+        buffer.append(part)
+        if len(buffer) >= settings.EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _gpx(run):
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n'
+        f'<trk><name>{escape(run.comment or f"Run {run.id}")}</name><trkseg>\n'
+    )
+    for latitude, longitude, created_at in iter_points(run.id):
+        yield f'<trkpt lat="{latitude}" lon="{longitude}"><time>{_isoformat(created_at)}</time></trkpt>\n'
+    yield '</trkseg></trk></gpx>\n'
+
+
+def _csv(run):
+    # Тот же формат, что принимает потоковая загрузка точек (app_run.ingest)
+    yield 'latitude,longitude,created_at\n'
+    for latitude, longitude, created_at in iter_points(run.id):
+        yield f'{latitude},{longitude},{_isoformat(created_at)}\n'
+
+
+def _geojson(run):
+    # Координаты и время идут двумя проходами по треку: так память не зависит от его длины
+    properties = json.dumps({'run': run.id, 'athlete': run.athlete_id, 'comment': run.comment}, ensure_ascii=False)
+    yield f'{{"type":"Feature","properties":{properties[:-1]},"coordTimes":['
+    separator = ''
+    for _, _, created_at in iter_points(run.id):
+        yield f'{separator}"{_isoformat(created_at)}"'
+        separator = ','
+    yield ']},"geometry":{"type":"LineString","coordinates":['
+    separator = ''
+    for latitude, longitude, _ in iter_points(run.id):
+        yield f'{separator}[{longitude},{latitude}]'
+        separator = ','
+    yield ']}}\n'
+
+
+WRITERS = {
+    'gpx': _gpx,
+    'csv': _csv,
+    'geojson': _geojson,
+}
+
+
+def export_run(run, export_format):
+    return _chunked(WRITERS[export_format](run))
+
+
+class _ZipOutput:
+    """Приемник для ZipFile без seek: накапливает записанные байты до следующей выдачи клиенту."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_athlete_zip(runs, export_format='gpx'):
+    """Архив со всеми забегами спортсмена, собирается на лету по одному забегу."""
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for run in runs:
+            with archive.open(f'run-{run.id}.{export_format}', 'w', force_zip64=True) as member:
+                for chunk in export_run(run, export_format):
+                    member.write(chunk.encode())
+                    if output.chunks:
+                        yield output.drain()
+    yield output.drain()
@@ -1,11 +1,49 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Q
 
 import django_filters
+from rest_framework import serializers
 
-from app_run.models import Run, Challenge
+from app_run.geo import geohash_cover, geohash_prefix_range
+from app_run.models import Run, Challenge, Position
 
 User = get_user_model()
 
+
+def geohash_q(min_lat, min_lon, max_lat, max_lon, prefix=''):
+    """Условие на точки внутри прямоугольника: диапазоны по индексу geohash плюс точная проверка координат."""
+    # Соседние ячейки часто идут подряд в порядке geohash, их диапазоны склеиваем
+    ranges = []
+    for cell in geohash_cover(min_lat, min_lon, max_lat, max_lon):
+        low, high = geohash_prefix_range(cell)
+        if ranges and ranges[-1][1] == low:
+            ranges[-1][1] = high
+        else:
+            ranges.append([low, high])
+
+    cells = Q()
+    for low, high in ranges:
+        cell_q = Q(**{f'{prefix}geohash__gte': low})
+        if high is not None:
+            cell_q &= Q(**{f'{prefix}geohash__lt': high})
+        cells |= cell_q
+    return cells & Q(**{
+        f'{prefix}latitude__range': (min_lat, max_lat),
+        f'{prefix}longitude__range': (min_lon, max_lon),
+    })
+
+
+def parse_bbox(value):
+    """bbox в порядке GeoJSON: min_lon,min_lat,max_lon,max_lat."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        raise serializers.ValidationError({'bbox': "Expected 'min_lon,min_lat,max_lon,max_lat'."})
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+        raise serializers.ValidationError({'bbox': "Invalid bounding box."})
+    return min_lat, min_lon, max_lat, max_lon
+
+
 class RunFilter(django_filters.FilterSet):
     athlete = django_filters.ModelChoiceFilter(
         field_name='athlete',
@@ -16,10 +54,25 @@ class RunFilter(django_filters.FilterSet):
         choices=Run.STATUS_CHOICES,
         label='Status'
     )
+    bbox = django_filters.CharFilter(method='filter_bbox', label='Bbox (min_lon,min_lat,max_lon,max_lat)')
 
     class Meta:
         model = Run
-        fields = ['athlete', 'status']
+        fields = ['athlete', 'status', 'bbox']
+
+    def filter_bbox(self, queryset, name, value):
+        min_lat, min_lon, max_lat, max_lon = parse_bbox(value)
+        # Сначала дешевое пересечение с рамкой забега, затем проверка, что хоть одна точка попала в область
+        passed = Exists(Position.objects.filter(
+            geohash_q(min_lat, min_lon, max_lat, max_lon), run=OuterRef('pk'),
+        ))
+        return queryset.filter(
+            passed,
+            min_latitude__lte=max_lat,
+            max_latitude__gte=min_lat,
+            min_longitude__lte=max_lon,
+            max_longitude__gte=min_lon,
+        )
 
 
 class ChallengeFilter(django_filters.FilterSet):
@@ -0,0 +1,176 @@
+import heapq
+import math
+
+EARTH_RADIUS = 6371008.8  # средний радиус Земли, м
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Расстояние между двумя точками в метрах."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def haversine_many(latitudes, longitudes):
+    """Длины всех отрезков трека сразу: на вход массивы координат, на выход массив из n - 1 длин."""
+    lats = [math.radians(float(value)) for value in latitudes]
+    lons = [math.radians(float(value)) for value in longitudes]
+    cos_lats = [math.cos(value) for value in lats]
+    return [
+        2 * EARTH_RADIUS * math.asin(math.sqrt(
+            math.sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * math.sin((lon2 - lon1) / 2) ** 2
+        ))
+        for lat1, lat2, lon1, lon2, cos1, cos2
+        in zip(lats, lats[1:], lons, lons[1:], cos_lats, cos_lats[1:])
+    ]
+
+
+def _segment_distance(point, start, end):
+    (px, py), (ax, ay), (bx, by) = point, start, end
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def _farthest(points, first, last):
+    index, distance = None, -1.0
+    for i in range(first + 1, last):
+        candidate = _segment_distance(points[i], points[first], points[last])
+        if candidate > distance:
+            index, distance = i, candidate
+    return index, distance
+
+
+def simplify(latitudes, longitudes, tolerance=None, max_points=None):
+    """
+    Упрощение трека Дугласом-Пекером. Отрезки раскрываются в порядке убывания отклонения,
+    пока оно больше tolerance (в метрах) и точек меньше max_points.
+    Возвращает отсортированные индексы оставшихся точек.
+    """
+    count = len(latitudes)
+    if count <= 2:
+        return list(range(count))
+
+    # Локальная равнопромежуточная проекция в метрах
+    cos_lat = math.cos(math.radians(float(latitudes[0])))
+    points = [
+        (math.radians(float(lon)) * EARTH_RADIUS * cos_lat, math.radians(float(lat)) * EARTH_RADIUS)
+        for lat, lon in zip(latitudes, longitudes)
+    ]
+
+    kept = {0, count - 1}
+    index, distance = _farthest(points, 0, count - 1)
+    heap = [(-distance, 0, count - 1, index)]
+    while heap:
+        distance, first, last, index = heapq.heappop(heap)
+        if index is None or (tolerance is not None and -distance <= tolerance):
+            break
+        if max_points is not None and len(kept) >= max_points:
+            break
+        kept.add(index)
+        for start, end in ((first, index), (index, last)):
+            if end - start > 1:
+                farthest, distance = _farthest(points, start, end)
+                heapq.heappush(heap, (-distance, start, end, farthest))
+    return sorted(kept)
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 8  # ячейка ~38 x 19 м, точнее координат с 4 знаками не нужно
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def _spread_bits(value):
+    # abcd -> 0a0b0c0d: биты широты и долготы в geohash чередуются
+    return sum(((value >> bit) & 1) << (2 * bit) for bit in range(10))
+
+
+_SPREAD = [_spread_bits(value) for value in range(1024)]
+_GEOHASH_PAIRS = [GEOHASH_ALPHABET[value >> 5] + GEOHASH_ALPHABET[value & 31] for value in range(1024)]
+
+
+def geohash_encode_units(latitude_units, longitude_units):
+    """
+    То же, что geohash_encode с точностью GEOHASH_PRECISION, для координат в десятитысячных градуса.
+    Номер ячейки считается целочисленным делением, а не делением интервала пополам, что в несколько
+    раз быстрее; для координат с 4 знаками результат совпадает с geohash_encode.
+    """
+    # 40 бит: по 20 на широту и долготу; верхняя граница диапазона попадает в последнюю ячейку
+    latitude = min(((latitude_units + 900000) << 20) // 1800000, 0xFFFFF)
+    longitude = min(((longitude_units + 1800000) << 20) // 3600000, 0xFFFFF)
+    high = _SPREAD[longitude >> 10] << 1 | _SPREAD[latitude >> 10]
+    low = _SPREAD[longitude & 0x3FF] << 1 | _SPREAD[latitude & 0x3FF]
+    return (
+        _GEOHASH_PAIRS[high >> 10] + _GEOHASH_PAIRS[high & 0x3FF]
+        + _GEOHASH_PAIRS[low >> 10] + _GEOHASH_PAIRS[low & 0x3FF]
+    )
+
+
+def geohash_cell_size(precision):
+    """Размер ячейки (по широте, по долготе) в градусах."""
+    lat_bits, lon_bits = 5 * precision // 2, (5 * precision + 1) // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def geohash_cover(min_lat, min_lon, max_lat, max_lon, max_cells=16):
+    """Наименьший набор префиксов geohash не больше max_cells, покрывающий прямоугольник."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        rows = range(int((min_lat + 90) // height), int((max_lat + 90) // height) + 1)
+        columns = range(int((min_lon + 180) // width), int((max_lon + 180) // width) + 1)
+        if len(rows) * len(columns) <= max_cells:
+            return sorted({
+                geohash_encode(
+                    min(90.0, -90 + (row + 0.5) * height),
+                    min(180.0, -180 + (column + 0.5) * width),
+                    precision,
+                )
+                for row in rows
+                for column in columns
+            })
+    return ['']
+
+
+def geohash_prefix_range(prefix):
+    """Полуинтервал [low, high) строк с данным префиксом; high = None, если верхней границы нет."""
+    stripped = prefix.rstrip(GEOHASH_ALPHABET[-1])
+    if not stripped:
+        return prefix, None
+    last = GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(stripped[-1]) + 1]
+    return prefix, stripped[:-1] + last
+
+
+def bounding_box(latitude, longitude, radius):
+    """Прямоугольник (min_lat, min_lon, max_lat, max_lon), описанный вокруг круга радиусом radius метров."""
+    latitude, longitude = float(latitude), float(longitude)
+    delta_lat = math.degrees(radius / EARTH_RADIUS)
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    delta_lon = min(180.0, math.degrees(radius / (EARTH_RADIUS * cos_lat)))
+    return (
+        max(-90.0, latitude - delta_lat),
+        max(-180.0, longitude - delta_lon),
+        min(90.0, latitude + delta_lat),
+        min(180.0, longitude + delta_lon),
+    )
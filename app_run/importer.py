@@ -0,0 +1,225 @@
+"""
+Импорт архивов забегов (GPX и CSV) командой import_runs.
+
+Разбор файла, метрики, скорость, дистанция и geohash точек считаются в parse_file, которая
+выполняется в рабочих процессах и не обращается к БД: основному процессу остается только записать
+пачку уже готовых строк. Забеги создаются сразу завершенными, точки пишутся одним executemany
+(COPY на PostgreSQL) в обход объектов модели, а после записи пачки вызываются те же обработчики,
+что и при завершении забега через API. Каждая пачка - одна транзакция вместе с отметками
+ImportedFile, поэтому прерванный импорт продолжается с первого незаписанного файла.
+"""
+import hashlib
+import io
+import os
+import re
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from xml.etree import ElementTree
+from xml.sax.saxutils import unescape
+
+from django.db import connection
+
+from app_run.challenges import award_challenges
+from app_run.counters import adjust_run_counters, rebuild_aggregates, status_deltas
+from app_run.geo import geohash_encode_units, haversine_many
+from app_run.leaderboards import update_leaderboards
+from app_run.metrics import compute_point_metrics, compute_track_metrics
+from app_run.models import AthleteInfo, Position
+from app_run.response_cache import invalidate
+from app_run.rollups import add_run_to_rollups
+
+IMPORT_EXTENSIONS = ('.gpx', '.csv')
+COORDINATE_SCALE = 10 ** 4
+# Ограничение поля Position (см. validate_coordinate), в десятитысячных градуса
+COORDINATE_LIMIT = 90 * COORDINATE_SCALE
+POSITION_FIELDS = ('run', 'latitude', 'longitude', 'created_at', 'geohash', 'speed', 'distance')
+
+
+def find_files(paths):
+    """
+    Абсолютные пути файлов архива по списку файлов и каталогов (каталоги обходятся рекурсивно)
+    в стабильном порядке: по ним повторный запуск узнает уже загруженные файлы.
+    """
+    found = []
+    for path in map(os.path.abspath, paths):
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(
+                    os.path.join(root, name) for name in names if name.lower().endswith(IMPORT_EXTENSIONS)
+                )
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+# Разметка трекеров почти всегда одна: lat перед lon и время в <time>. Такие точки разбираются
+# регулярным выражением в несколько раз быстрее XML-парсера; остальные файлы разбираются как XML
+_GPX_POINT = re.compile(
+    rb'<trkpt\s+lat="([^"]*)"\s+lon="([^"]*)"[^>]*>(?:(?!</trkpt>).)*?<time>([^<]*)</time>', re.S
+)
+_GPX_NAME = re.compile(rb'<name>([^<]*)</name>')
+
+
+def _gpx_points_xml(data):
+    name, points = '', []
+    for _, element in ElementTree.iterparse(io.BytesIO(data)):
+        tag = element.tag.rpartition('}')[2]
+        if tag == 'trkpt':
+            time = element.find('{*}time')
+            points.append((element.get('lat'), element.get('lon'), time.text if time is not None else None))
+            # Разобранные точки не копим в дереве: память не зависит от длины трека
+            element.clear()
+        elif tag == 'name' and not name and element.text:
+            name = element.text.strip()
+    return name, points
+
+
+def _gpx_points(data):
+    points = _GPX_POINT.findall(data)
+    if len(points) != data.count(b'<trkpt'):
+        return _gpx_points_xml(data)
+    name = _GPX_NAME.search(data)
+    return unescape(name[1].decode()).strip() if name else '', points
+
+
+def _csv_points(data):
+    # Тот же формат, что отдает экспорт: latitude,longitude,created_at
+    points = []
+    for line in data.decode('utf-8-sig').splitlines():
+        line = line.strip()
+        if not line or line.startswith('latitude'):
+            continue
+        parts = line.split(',')
+        if len(parts) != 3:
+            raise ValueError(f"Некорректная строка CSV: {line}")
+        points.append(parts)
+    return '', points
+
+
+def _timestamp(value):
+    if not value:
+        raise ValueError("Точка без времени")
+    moment = datetime.fromisoformat(value.strip() if isinstance(value, str) else value.decode())
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=dt_timezone.utc)
+    if moment.tzinfo is dt_timezone.utc:
+        return moment
+    return moment.astimezone(dt_timezone.utc)
+
+
+def _coordinate_units(value):
+    units = round(float(value) * COORDINATE_SCALE)
+    if abs(units) > COORDINATE_LIMIT:
+        raise ValueError(f"Координата {value} вне диапазона [-90.0, 90.0]")
+    return units
+
+
+def _coordinate(units):
+    return Decimal(units).scaleb(-4)
+
+
+def parse_file(path, aware=True):
+    """
+    Разбирает файл архива. Возвращает словарь с путем, размером и sha256 содержимого и либо 'error',
+    либо готовые данные забега: 'comment', 'started_at', 'metrics' (поля Run) и 'rows' - значения
+    POSITION_FIELDS без забега в виде для записи в БД. aware - хранит ли БД время с часовым поясом;
+    если нет, время пишется в UTC без пояса, как это делает Django.
+    """
+    result = {'path': path}
+    try:
+        with open(path, 'rb') as source:
+            data = source.read()
+        result['size'] = len(data)
+        result['digest'] = hashlib.sha256(data).hexdigest()
+        name, raw_points = _gpx_points(data) if path.lower().endswith('.gpx') else _csv_points(data)
+        points = sorted(
+            (_timestamp(created_at), _coordinate_units(latitude), _coordinate_units(longitude))
+            for latitude, longitude, created_at in raw_points
+        )
+    except (OSError, ValueError, UnicodeDecodeError, ElementTree.ParseError) as error:
+        result['error'] = str(error)
+        return result
+    if not points:
+        result['error'] = "В файле нет точек"
+        return result
+
+    timestamps = [point[0] for point in points]
+    latitudes = [point[1] / COORDINATE_SCALE for point in points]
+    longitudes = [point[2] / COORDINATE_SCALE for point in points]
+    segments = haversine_many(latitudes, longitudes)
+    metrics = compute_track_metrics(latitudes, longitudes, timestamps, segments=segments)
+    # Координаты в метриках забега - Decimal, как в полях модели
+    metrics.update({
+        'min_latitude': _coordinate(min(point[1] for point in points)),
+        'max_latitude': _coordinate(max(point[1] for point in points)),
+        'min_longitude': _coordinate(min(point[2] for point in points)),
+        'max_longitude': _coordinate(max(point[2] for point in points)),
+        'last_latitude': _coordinate(points[-1][1]),
+        'last_longitude': _coordinate(points[-1][2]),
+    })
+
+    # Время уже в UTC, поэтому для БД без часовых поясов достаточно отрезать '+00:00'
+    end = None if aware else -6
+    rows = [
+        (
+            f'{latitude:.4f}',
+            f'{longitude:.4f}',
+            created_at.isoformat(sep=' ')[:end],
+            geohash_encode_units(latitude_units, longitude_units),
+            speed,
+            distance,
+        )
+        for (created_at, latitude_units, longitude_units), latitude, longitude, (speed, distance) in zip(
+            points, latitudes, longitudes, compute_point_metrics(latitudes, longitudes, timestamps, segments=segments)
+        )
+    ]
+    result.update({
+        'comment': name or os.path.splitext(os.path.basename(path))[0],
+        'started_at': timestamps[0],
+        'metrics': metrics,
+        'rows': rows,
+    })
+    return result
+
+
+def insert_positions(rows):
+    """Записывает точки одним COPY на PostgreSQL или executemany на других БД. rows - значения POSITION_FIELDS."""
+    quote = connection.ops.quote_name
+    table = quote(Position._meta.db_table)
+    columns = ', '.join(quote(Position._meta.get_field(name).column) for name in POSITION_FIELDS)
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            placeholders = ', '.join(['%s'] * len(POSITION_FIELDS))
+            cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+            return
+        data = ''.join(
+            '\t'.join(r'\N' if value is None else str(value) for value in row) + '\n'
+            for row in rows
+        )
+        sql = f'COPY {table} ({columns}) FROM STDIN'
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'):
+            # psycopg2
+            raw.copy_expert(sql, io.StringIO(data))
+        else:
+            with raw.copy(sql) as copy:
+                copy.write(data)
+
+
+def finish_imported_runs(runs):
+    """
+    Обработчики завершения забега для пачки импортированных забегов, в транзакции их записи.
+    Показатели для челленджей пересчитываются с нуля: record_finished_run добавляет забег к текущей
+    серии как самый поздний, а история приходит в произвольном порядке дат.
+    """
+    by_athlete = Counter(run.athlete_id for run in runs)
+    for athlete_id, count in by_athlete.items():
+        adjust_run_counters(athlete_id, status_deltas('finished', sign=count))
+    for run in runs:
+        add_run_to_rollups(run)
+        update_leaderboards(run)
+    athlete_infos = list(AthleteInfo.objects.select_for_update().filter(user_id__in=by_athlete))
+    rebuild_aggregates(athlete_infos)
+    award_challenges(athlete_infos)
+    invalidate('runs', *by_athlete)
@@ -0,0 +1,107 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rest_framework import serializers
+
+from app_run.ingest_filters import filter_points, remember
+from app_run.metrics import update_run_metrics
+from app_run.models import Position
+from app_run.validators import validate_coordinate
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+CSV_CONTENT_TYPES = ('text/csv',)
+CSV_HEADER = 'latitude'
+
+
+def save_positions(run, points):
+    positions = [Position(run=run, **point).fill_geohash() for point in points]
+    with transaction.atomic():
+        # Метрики считаются первыми: они проставляют точкам скорость и дистанцию
+        update_run_metrics(run, positions)
+        Position.objects.bulk_create(positions)
+    return positions
+
+
+def ingest_points(run, points):
+    """Пропускает точки с устройства через фильтр и записывает оставшиеся. Возвращает (позиции, отброшено)."""
+    points, dropped = filter_points(run, points)
+    positions = save_positions(run, points) if points else []
+    remember(run, points)
+    return positions, dropped
+
+
+def _parse_point(latitude, longitude, created_at=None):
+    try:
+        latitude = validate_coordinate(Decimal(str(latitude)))
+        longitude = validate_coordinate(Decimal(str(longitude)))
+    except InvalidOperation:
+        raise serializers.ValidationError("Координата должна быть числом.")
+
+    point = {'latitude': latitude, 'longitude': longitude}
+    if created_at:
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise serializers.ValidationError("Некорректное время точки.")
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        point['created_at'] = created_at
+    return point
+
+
+def parse_ndjson_line(line):
+    try:
+        data = json.loads(line, parse_float=Decimal)
+        return _parse_point(data['latitude'], data['longitude'], data.get('created_at'))
+    except (ValueError, KeyError, TypeError):
+        raise serializers.ValidationError("Некорректная строка NDJSON.")
+
+
+def parse_csv_line(line):
+    # latitude,longitude[,created_at]
+    parts = [part.strip() for part in line.split(',')]
+    if len(parts) not in (2, 3):
+        raise serializers.ValidationError("Некорректная строка CSV.")
+    return _parse_point(*parts)
+
+
+def get_line_parser(content_type):
+    if content_type in NDJSON_CONTENT_TYPES:
+        return parse_ndjson_line
+    if content_type in CSV_CONTENT_TYPES:
+        return parse_csv_line
+    return None
+
+
+def stream_positions(run, lines, parse_line, chunk_size):
+    """
+    Читает точки построчно и сбрасывает их в базу пачками по chunk_size строк,
+    поэтому в памяти одновременно находится не больше одной пачки. Генератор итогов записанных пачек:
+    если забег завершили посреди загрузки, следующая пачка поднимает RunNotActive, записанные остаются.
+    """
+    points, rejected, seen = [], 0, 0
+
+    def flush():
+        positions, dropped = ingest_points(run, points)
+        return {'accepted': len(positions), 'rejected': rejected, 'dropped': dropped}
+
+    for raw_line in lines:
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        if not line or line.lower().startswith(CSV_HEADER):
+            continue
+
+        seen += 1
+        try:
+            points.append(parse_line(line))
+        except serializers.ValidationError:
+            rejected += 1
+
+        if seen == chunk_size:
+            yield flush()
+            points, rejected, seen = [], 0, 0
+
+    if seen:
+        yield flush()
@@ -0,0 +1,202 @@
+"""
+Фильтр точек перед записью: дубликаты, дрожание координат на месте и выбросы по скорости.
+
+Правила смотрят только на небольшое окно последних принятых точек забега, которое хранится
+в памяти процесса. При первом обращении (и если другой воркер успел принять более свежие точки)
+окно начинается с последней точки из строки Run, поэтому читать трек из БД не нужно.
+Окно пополняется через remember() только после успешной записи: повтор запроса после ошибки
+не будет отброшен как дубликат. Точки старше последней принятой (догрузка после потери связи)
+проверяются только на повтор внутри окна: скорость и смещение по ним не оценить.
+"""
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.utils import timezone
+
+from app_run.geo import haversine
+
+
+class IngestRule:
+    """Правило отбрасывает точку, если она не добавляет к треку ничего достоверного."""
+
+    name = None
+
+    def rejects(self, point, recent):
+        """point - новая точка, recent - принятые точки забега от старых к новым."""
+        raise NotImplementedError
+
+
+class DuplicateRule(IngestRule):
+    """
+    Повтор времени уже принятой точки или та же позиция с разницей во времени меньше window секунд.
+    Соседние фиксы трекера с частотой 1 Гц дубликатами не считаются, даже если координаты совпали
+    после округления до 4 знаков.
+    """
+
+    name = 'duplicate'
+
+    def __init__(self, window, distance):
+        self.window = window
+        self.distance = distance
+
+    def rejects(self, point, recent):
+        for previous in recent:
+            elapsed = abs((point['created_at'] - previous['created_at']).total_seconds())
+            if elapsed == 0:
+                return True
+            if elapsed < self.window and self.distance >= haversine(
+                previous['latitude'], previous['longitude'], point['latitude'], point['longitude']
+            ):
+                return True
+        return False
+
+
+class SpeedRule(IngestRule):
+    """Скачок от предыдущей точки быстрее max_speed м/с - выброс GPS, а не бег."""
+
+    name = 'speed'
+
+    def __init__(self, max_speed):
+        self.max_speed = max_speed
+
+    def rejects(self, point, recent):
+        if not recent:
+            return False
+        previous = recent[-1]
+        elapsed = (point['created_at'] - previous['created_at']).total_seconds()
+        if elapsed <= 0:
+            # Точка из прошлого (догрузка после потери связи): скорость по ней не оценить
+            return False
+        segment = haversine(previous['latitude'], previous['longitude'], point['latitude'], point['longitude'])
+        return segment / elapsed > self.max_speed
+
+
+class StationaryRule(IngestRule):
+    """
+    Дрожание на месте: точка ближе distance метров к последней принятой, а средняя скорость
+    за последние window секунд ниже speed м/с. По одному отрезку стоянку от бега не отличить:
+    на частых фиксах бегун смещается на пару метров, а дрожание дает такие же скачки.
+    Поэтому скорость считается от последней принятой точки не моложе window секунд: у бегуна
+    за это время набираются десятки метров, а у стоящего на месте - только разброс GPS.
+    Пока таких точек нет (начало забега), точки не отбрасываются.
+    """
+
+    name = 'stationary'
+
+    def __init__(self, speed, window, distance):
+        self.speed = speed
+        self.window = window
+        self.distance = distance
+
+    def rejects(self, point, recent):
+        if not recent:
+            return False
+        previous = recent[-1]
+        if point['created_at'] <= previous['created_at']:
+            return False
+        shift = haversine(previous['latitude'], previous['longitude'], point['latitude'], point['longitude'])
+        if shift >= self.distance:
+            # Ушли дальше разброса GPS: после стоянки первые же точки движения проходят
+            return False
+        reference = next(
+            (
+                earlier for earlier in reversed(recent)
+                if (point['created_at'] - earlier['created_at']).total_seconds() >= self.window
+            ),
+            None,
+        )
+        if reference is None:
+            return False
+        elapsed = (point['created_at'] - reference['created_at']).total_seconds()
+        segment = haversine(reference['latitude'], reference['longitude'], point['latitude'], point['longitude'])
+        return segment / elapsed < self.speed
+
+
+def get_rules():
+    """Включенные правила в порядке проверки из INGEST_FILTERS."""
+    factories = {
+        'duplicate': lambda: DuplicateRule(settings.INGEST_DUPLICATE_WINDOW, settings.INGEST_DUPLICATE_DISTANCE),
+        'speed': lambda: SpeedRule(settings.INGEST_MAX_SPEED),
+        'stationary': lambda: StationaryRule(
+            settings.INGEST_STATIONARY_SPEED, settings.INGEST_STATIONARY_WINDOW, settings.INGEST_STATIONARY_DISTANCE
+        ),
+    }
+    return [factories[name]() for name in settings.INGEST_FILTERS]
+
+
+_windows = OrderedDict()
+_lock = threading.Lock()
+
+
+def _window(run_id):
+    # Вызывается под _lock. Давно не писавшие забеги вытесняются, как в LRU
+    window = _windows.get(run_id)
+    if window is None:
+        window = _windows[run_id] = deque(maxlen=settings.INGEST_FILTER_WINDOW_SIZE)
+        while len(_windows) > settings.INGEST_FILTER_MAX_RUNS:
+            _windows.popitem(last=False)
+    else:
+        _windows.move_to_end(run_id)
+    return window
+
+
+def _recent_points(run):
+    with _lock:
+        window = _window(run.pk)
+        last_position_at = run.last_position_at
+        if last_position_at is not None and (not window or window[-1]['created_at'] < last_position_at):
+            # Окна еще нет или более свежие точки принял другой воркер: начинаем с последней точки забега
+            window.clear()
+            window.append({
+                'latitude': run.last_latitude,
+                'longitude': run.last_longitude,
+                'created_at': last_position_at,
+            })
+        return list(window)
+
+
+def filter_points(run, points):
+    """
+    Точки, прошедшие фильтр (по времени), и число отброшенных каждым правилом.
+    Точкам без времени проставляется текущее, как это сделала бы модель.
+    """
+    rules = get_rules()
+    dropped = {rule.name: 0 for rule in rules}
+    for point in points:
+        point.setdefault('created_at', timezone.now())
+    if not rules:
+        return list(points), dropped
+
+    recent = _recent_points(run)
+    kept = []
+    for point in sorted(points, key=lambda p: p['created_at']):
+        rule = next((rule for rule in rules if rule.rejects(point, recent)), None)
+        if rule is not None:
+            dropped[rule.name] += 1
+            continue
+        kept.append(point)
+        recent.append(point)
+        del recent[:-settings.INGEST_FILTER_WINDOW_SIZE]
+    return kept, dropped
+
+
+def remember(run, points):
+    """Добавляет записанные точки в окно забега."""
+    if not settings.INGEST_FILTERS:
+        return
+    with _lock:
+        window = _window(run.pk)
+        for point in points:
+            window.append({key: point[key] for key in ('latitude', 'longitude', 'created_at')})
+
+
+def forget(run_id):
+    with _lock:
+        _windows.pop(run_id, None)
+
+
+def merge_dropped(total, dropped):
+    for name, count in dropped.items():
+        total[name] = total.get(name, 0) + count
+    return total
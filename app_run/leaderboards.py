@@ -0,0 +1,102 @@
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from app_run.models import Run, LeaderboardEntry
+from app_run.upserts import increment_or_create
+
+# Вклад одного завершенного забега в очки каждого рейтинга
+BOARD_SCORES = {
+    'runs': lambda run: 1,
+    'distance': lambda run: run.distance,
+}
+
+
+def month_period(day):
+    return day.strftime('%Y-%m')
+
+
+def update_leaderboards(run, sign=1):
+    """
+    Добавляет очки завершенного забега в рейтинги за все время и за месяц (или вычитает при sign=-1).
+    Места не хранятся: их пересчет сдвигал бы при каждом финише строки всех спортсменов ниже.
+    """
+    periods = (LeaderboardEntry.ALL_TIME, month_period(timezone.localdate(run.created_at)))
+    for board, score in BOARD_SCORES.items():
+        delta = sign * score(run)
+        for period in periods:
+            lookup = {'board': board, 'period': period, 'athlete_id': run.athlete_id}
+            increment_or_create(
+                LeaderboardEntry, lookup, {'score': F('score') + delta}, {'score': delta} if sign > 0 else None
+            )
+
+
+def ranked(board, period):
+    return LeaderboardEntry.objects.filter(board=board, period=period).order_by('-score', 'athlete_id')
+
+
+def top(board, period, limit):
+    """Первые limit записей рейтинга: [(место, запись)]."""
+    entries = ranked(board, period).select_related('athlete')[:limit]
+    return list(enumerate(entries, start=1))
+
+
+def rank(entry):
+    """
+    Место = 1 + число записей выше. Условие разбито на два диапазона индекса (строго больше и равные
+    очки с меньшим id): с OR планировщик читает весь рейтинг, а не начинает с нужного места.
+    """
+    entries = ranked(entry.board, entry.period)
+    higher = entries.filter(score__gt=entry.score).count()
+    return higher + entries.filter(score=entry.score, athlete_id__lt=entry.athlete_id).count() + 1
+
+
+def _neighbours(entry, count, above):
+    entries = ranked(entry.board, entry.period).select_related('athlete')
+    if above:
+        ties = entries.filter(score=entry.score, athlete_id__lt=entry.athlete_id).order_by('-athlete_id')
+        rest = entries.filter(score__gt=entry.score).order_by('score', '-athlete_id')
+    else:
+        ties = entries.filter(score=entry.score, athlete_id__gt=entry.athlete_id)
+        rest = entries.filter(score__lt=entry.score)
+    # Ближайшие соседи: сначала с теми же очками, затем следующие по индексу от очков спортсмена
+    neighbours = list(ties[:count])
+    if len(neighbours) < count:
+        neighbours += rest[:count - len(neighbours)]
+    return neighbours
+
+
+def around(entry, count):
+    """Место спортсмена и по count соседей сверху и снизу: [(место, запись)]."""
+    entry_rank = rank(entry)
+    above = _neighbours(entry, count, above=True)
+    window = [*reversed(above), entry, *_neighbours(entry, count, above=False)]
+    return entry_rank, list(enumerate(window, start=entry_rank - len(above)))
+
+
+def rebuild_leaderboards(athlete_ids):
+    """Пересчитывает рейтинги спортсменов с нуля по завершенным забегам."""
+    LeaderboardEntry.objects.filter(athlete_id__in=athlete_ids).delete()
+    rows = (
+        Run.objects
+        .filter(athlete_id__in=athlete_ids, status='finished')
+        .annotate(month=TruncMonth('created_at'))
+        .values('athlete_id', 'month')
+        .annotate(runs=Count('id'), distance=Sum('distance'))
+        .order_by()
+    )
+    totals, entries = {}, []
+    for row in rows:
+        all_time = totals.setdefault(row['athlete_id'], dict.fromkeys(BOARD_SCORES, 0))
+        for board in BOARD_SCORES:
+            all_time[board] += row[board]
+            entries.append(LeaderboardEntry(
+                board=board, period=month_period(row['month']), athlete_id=row['athlete_id'], score=row[board],
+            ))
+    for athlete_id, scores in totals.items():
+        for board, score in scores.items():
+            entries.append(LeaderboardEntry(
+                board=board, period=LeaderboardEntry.ALL_TIME, athlete_id=athlete_id, score=score,
+            ))
+    LeaderboardEntry.objects.bulk_create(entries, batch_size=5000)
+    return entries
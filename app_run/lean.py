@@ -0,0 +1,239 @@
+import json
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import CharField, F, Func
+from django.http import HttpResponse
+from django.utils import timezone
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import RelatedField
+from rest_framework.settings import api_settings
+
+from app_run.pagination import continuation_link, truncation_headers
+
+# СУБД, на которых Decimal и время форматируются в строку ответа прямо в SQL
+SQL_TEXT_VENDORS = ('sqlite', 'postgresql')
+
+
+class DecimalText(Func):
+    """Decimal-колонка строкой с decimal_places знаками, как ее выводит DecimalField DRF."""
+    output_field = CharField()
+
+    def __init__(self, expression, decimal_places):
+        super().__init__(expression)
+        self.decimal_places = decimal_places
+
+    def as_sqlite(self, compiler, connection, **extra):
+        # printf(NULL) дал бы '0.0000'; %%%% - один % после подстановки шаблона и параметров курсора
+        template = (
+            f"CASE WHEN %(expressions)s IS NULL THEN NULL "
+            f"ELSE printf('%%%%.{self.decimal_places}f', %(expressions)s) END"
+        )
+        return self.as_sql(compiler, connection, template=template, **extra)
+
+    def as_postgresql(self, compiler, connection, **extra):
+        # numeric(max_digits, decimal_places) хранит масштаб поля, текст уже с нужным числом знаков
+        return self.as_sql(compiler, connection, template='(%(expressions)s)::text', **extra)
+
+
+class UtcDateTimeText(Func):
+    """Время строкой ISO 8601 в UTC с 'Z', как его выводит DateTimeField DRF: без микросекунд, если они нулевые."""
+    output_field = CharField()
+
+    def as_sqlite(self, compiler, connection, **extra):
+        # Django хранит время в SQLite текстом в UTC: 'YYYY-MM-DD HH:MM:SS[.ffffff]'
+        return self.as_sql(compiler, connection, template="replace(%(expressions)s, ' ', 'T') || 'Z'", **extra)
+
+    def as_postgresql(self, compiler, connection, **extra):
+        template = (
+            "regexp_replace(to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US'), "
+            "'\\.000000$', '') || 'Z'"
+        )
+        return self.as_sql(compiler, connection, template=template, **extra)
+
+
+class _DecimalConverter:
+    def __init__(self, decimal_places):
+        self.decimal_places = decimal_places
+        # Конвертер БД уже привел Decimal к масштабу поля модели, поэтому форматируем без quantize
+        self.format = f'{{:.{decimal_places}f}}'.format
+
+    def __call__(self, value):
+        return self.format(value)
+
+    def sql(self, expression):
+        return DecimalText(expression, self.decimal_places)
+
+
+class _DateTimeConverter:
+    # То же, что DateTimeField.to_representation для ISO 8601 в текущей временной зоне
+    def __call__(self, value):
+        value = value.astimezone(timezone.get_current_timezone()).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    @staticmethod
+    def sql(expression):
+        # В SQL время форматируется только в UTC, для других зон - конвертером
+        return UtcDateTimeText(expression) if timezone.get_current_timezone_name() == 'UTC' else None
+
+
+def _decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output:
+        return field.to_representation
+    return _DecimalConverter(field.decimal_places)
+
+
+def compile_fields(serializer, prefix=''):
+    """
+    Раскладывает поля сериализатора в плоский список (путь в ответе, lookup для values_list, конвертер).
+    Поддерживаются поля модели, связанные поля по pk и вложенные сериализаторы.
+    """
+    compiled = []
+    for name, field in serializer.fields.items():
+        lookup = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            compiled.extend(
+                ((name,) + path, nested_lookup, converter)
+                for path, nested_lookup, converter in compile_fields(field, prefix=lookup + '__')
+            )
+            continue
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            raise ValueError(f"Field '{name}' can't be read with values_list()")
+
+        if isinstance(field, serializers.DecimalField):
+            converter = _decimal_converter(field)
+        elif (
+            isinstance(field, serializers.DateTimeField)
+            and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+            and not hasattr(field, 'timezone')
+            and settings.USE_TZ
+        ):
+            converter = _DateTimeConverter()
+        elif isinstance(field, (serializers.DateTimeField, serializers.DateField, serializers.TimeField)):
+            converter = field.to_representation
+        elif isinstance(field, serializers.FloatField):
+            converter = float
+        elif (
+            isinstance(field, (RelatedField, serializers.IntegerField, serializers.ChoiceField))
+            or type(field) is serializers.CharField
+        ):
+            # Драйвер БД уже отдает int/str в нужном виде
+            converter = None
+        else:
+            converter = field.to_representation
+        compiled.append(((name,), lookup, converter))
+    return compiled
+
+
+def _group(items, depth=0):
+    # Плоский список (путь, индекс в строке, конвертер) -> дерево [(имя, индекс, конвертер) | (имя, поддерево)]
+    tree, nested = [], {}
+    for path, index, converter in items:
+        name = path[depth]
+        if len(path) == depth + 1:
+            tree.append((name, index, converter))
+            continue
+        if name not in nested:
+            nested[name] = []
+            tree.append((name, nested[name]))
+        nested[name].append((path, index, converter))
+    return [item if len(item) == 3 else (item[0], _group(item[1], depth + 1)) for item in tree]
+
+
+def _row_builder(tree):
+    if all(len(item) == 3 for item in tree):
+        def build_flat(row):
+            return {
+                name: row[index] if converter is None or row[index] is None else converter(row[index])
+                for name, index, converter in tree
+            }
+        return build_flat
+
+    plan = [
+        (item[0], None, None, _row_builder(item[1])) if len(item) == 2 else item + (None,)
+        for item in tree
+    ]
+
+    def build(row):
+        result = {}
+        for name, index, converter, nested in plan:
+            if nested is not None:
+                result[name] = nested(row)
+            else:
+                value = row[index]
+                result[name] = value if converter is None or value is None else converter(value)
+        return result
+    return build
+
+
+def row_builder(compiled):
+    """Функция, которая превращает строку values_list() по полям compiled в словарь ответа сериализатора."""
+    return _row_builder(_group([(path, index, converter) for index, (path, _, converter) in enumerate(compiled)]))
+
+
+def render_rows(queryset, compiled, limit):
+    """
+    JSON-ответ по первым limit строкам queryset и последняя из них, если строк было больше (иначе None).
+    На SQL_TEXT_VENDORS Decimal и время приходят из БД готовыми строками ответа: конвертеры бэкенда
+    (разбор времени, Decimal) и форматирование в Python - большая часть стоимости чтения, и они
+    пропускаются. На остальных СУБД значения проходят конвертеры, как в ORM.
+    """
+    use_sql_text = connections[queryset.db].vendor in SQL_TEXT_VENDORS
+    columns, plan = [], []
+    for path, lookup, converter in compiled:
+        sql = getattr(converter, 'sql', None) if use_sql_text else None
+        expression = sql(F(lookup)) if sql is not None else None
+        columns.append(lookup if expression is None else expression)
+        plan.append((path, lookup, converter if expression is None else None))
+    build = row_builder(plan)
+    rows = [build(row) for row in queryset.values_list(*columns)[:limit + 1].iterator(chunk_size=2000)]
+    last = rows[limit - 1] if len(rows) > limit else None
+    del rows[limit:]
+
+    # Те же параметры, что у rest_framework.renderers.JSONRenderer
+    content = json.dumps(rows, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return content.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode(), last
+
+
+class LeanListMixin:
+    """
+    Быстрый list() для JSON-ответов без пагинации: строки читаются через values_list()
+    и сразу пишутся в JSON, минуя ModelSerializer. Ответ побайтово совпадает с обычным.
+    """
+    lean_compiled = None
+
+    def use_lean_list(self, request):
+        params = request.query_params
+        return (
+            'size' not in params
+            and 'cursor' not in params
+            and request.accepted_renderer.format == 'json'
+            and 'indent' not in request.accepted_media_type
+        )
+
+    @classmethod
+    def get_lean_fields(cls):
+        if cls.lean_compiled is None:
+            cls.lean_compiled = compile_fields(cls.serializer_class())
+        return cls.lean_compiled
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_lean_list(request):
+            return super().list(request, *args, **kwargs)
+
+        content, last = render_rows(
+            self.filter_queryset(self.get_queryset()), self.get_lean_fields(), settings.UNPAGINATED_RESULTS_LIMIT
+        )
+        headers = None
+        if last is not None:
+            next_link = None
+            ordering = getattr(self, 'keyset_ordering', None)
+            if ordering is not None:
+                # Ключ курсора берется из уже отданной строки: время в ней строкой ISO 8601, как в курсоре
+                next_link = continuation_link(request, self, last[ordering[0].lstrip('-')], last['id'])
+            headers = truncation_headers(next_link)
+        return HttpResponse(content, content_type='application/json', headers=headers)
@@ -0,0 +1,14 @@
+from django.contrib.auth.models import User
+
+
+def athlete_id_batches(batch_size):
+    """id всех пользователей пачками по batch_size в порядке pk, без OFFSET: следующая пачка - после последнего id."""
+    last_pk = 0
+    while True:
+        athlete_ids = list(
+            User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not athlete_ids:
+            return
+        last_pk = athlete_ids[-1]
+        yield athlete_ids
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_run.challenges import award_challenges
+from app_run.counters import rebuild_aggregates
+from app_run.models import AthleteInfo
+
+
+class Command(BaseCommand):
+    help = "Выдает челленджи из реестра по уже накопленным данным спортсменов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Сколько спортсменов обрабатывать за раз")
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help="Сначала пересчитать накопленные показатели по завершенным забегам"
+        )
+
+    def handle(self, *args, batch_size, rebuild, **options):
+        last_pk, processed, awarded = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                athlete_infos = list(
+                    AthleteInfo.objects.select_for_update().filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+                )
+                if not athlete_infos:
+                    break
+                last_pk = athlete_infos[-1].pk
+
+                if rebuild:
+                    rebuild_aggregates(athlete_infos)
+                awarded += len(award_challenges(athlete_infos))
+            processed += len(athlete_infos)
+            self.stdout.write(f"Обработано спортсменов: {processed}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано спортсменов: {processed}, выполненных условий: {awarded}"
+        ))
@@ -0,0 +1,49 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_run.metrics import METRIC_FIELDS, compute_track_metrics
+from app_run.models import Run, Position
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дистанцию, время, темп, лучшие 5 км и границы трека для уже существующих забегов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Сколько забегов обрабатывать за раз")
+        parser.add_argument('--run', type=int, nargs='*', dest='run_ids', help="Пересчитать только указанные забеги")
+
+    def handle(self, *args, batch_size, run_ids, **options):
+        runs = Run.objects.order_by('pk')
+        if run_ids:
+            runs = runs.filter(pk__in=run_ids)
+
+        last_pk, updated = 0, 0
+        while True:
+            batch = {run.pk: run for run in runs.filter(pk__gt=last_pk).only('pk')[:batch_size]}
+            if not batch:
+                break
+            last_pk = max(batch)
+
+            points = (
+                Position.objects
+                .filter(run_id__in=batch)
+                .order_by('run_id', 'created_at', 'id')
+                .values_list('run_id', 'latitude', 'longitude', 'created_at')
+                .iterator(chunk_size=10000)
+            )
+            changed = []
+            for run_id, track in groupby(points, key=lambda point: point[0]):
+                _, latitudes, longitudes, timestamps = zip(*track)
+                run = batch[run_id]
+                for field, value in compute_track_metrics(latitudes, longitudes, timestamps).items():
+                    setattr(run, field, value)
+                run.updated_at = timezone.now()
+                changed.append(run)
+
+            Run.objects.bulk_update(changed, [*METRIC_FIELDS, 'best_5k_time', 'updated_at'])
+            updated += len(changed)
+            self.stdout.write(f"Обработано забегов: {updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Метрики пересчитаны для {updated} забегов"))
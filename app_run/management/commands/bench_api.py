@@ -0,0 +1,269 @@
+import io
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from app_run.benchmarks import isolated_database, seed_athletes, seed_runs, seed_track
+from app_run.models import Run
+from app_run.stats import percentile
+
+# Масштабы набора данных: (спортсменов, забегов на спортсмена, забегов с треком, точек в треке)
+SCALES = {
+    '1k': (20, 5, 10, 100),
+    '100k': (200, 10, 100, 1000),
+    '10m': (5000, 20, 1000, 10000),
+}
+
+INGEST_STARTED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def ingest_point(n):
+    """n-я точка загружаемого трека: 5 с и 0.0002° широты (~22 м) от предыдущей."""
+    return {
+        'latitude': f'{55 + n * 0.0002:.4f}',
+        'longitude': '37.6100',
+        'created_at': (INGEST_STARTED_AT + timedelta(seconds=5 * n)).isoformat(),
+    }
+
+
+# Запросы к горячим таблицам не должны зависеть от объема данных: бюджет - наибольшее число запросов,
+# в абсолютных числах.
+# Формат: (название, метод, url, тело, ожидаемый статус, бюджет SQL-запросов).
+# url и тело могут быть функциями от (данные, номер повтора) для эндпоинтов, меняющих состояние.
+ENDPOINTS = [
+    ('api root', 'get', '/', None, 200, 0),
+    ('admin login', 'get', '/admin/login/', None, 200, 0),
+    ('company_details', 'get', '/api/company_details/', None, 200, 0),
+
+    ('runs: список', 'get', '/api/runs/', None, 200, 1),
+    ('runs: страница', 'get', '/api/runs/?size=50', None, 200, 2),
+    ('runs: курсор', 'get', '/api/runs/?cursor=&size=50', None, 200, 1),
+    ('runs: спортсмен и статус', 'get', lambda d, i: f"/api/runs/?athlete={d['athlete']}&status=finished",
+     None, 200, 2),
+    ('runs: bbox', 'get', '/api/runs/?bbox=37.0,55.0,37.5,55.5', None, 200, 1),
+    ('runs: карточка', 'get', lambda d, i: f"/api/runs/{d['track_run']}/", None, 200, 1),
+    ('runs: создание', 'post', '/api/runs/', lambda d, i: {'athlete': d['athlete']}, 201, 5),
+    ('runs: старт', 'post', lambda d, i: f"/api/runs/{d['init_runs'][i]}/start/", None, 200, 4),
+    # Финиш: +1 INSERT в челленджи, если у спортсмена выполнено их условие
+    ('runs: финиш', 'post', lambda d, i: f"/api/runs/{d['active_runs'][i]}/stop/", None, 200, 16),
+    ('runs: async старт', 'post', lambda d, i: f"/api/async/runs/{d['async_init_runs'][i]}/start/", None, 200, 4),
+    ('runs: async финиш', 'post', lambda d, i: f"/api/async/runs/{d['async_active_runs'][i]}/stop/", None, 200, 16),
+    ('runs: сплиты', 'get', lambda d, i: f"/api/runs/{d['track_run']}/splits/?unit=km", None, 200, 2),
+    ('runs: экспорт gpx', 'get', lambda d, i: f"/api/runs/{d['track_run']}/export.gpx", None, 200, 3),
+    ('runs: экспорт csv', 'get', lambda d, i: f"/api/runs/{d['track_run']}/export.csv", None, 200, 3),
+    ('runs: экспорт geojson', 'get', lambda d, i: f"/api/runs/{d['track_run']}/export.geojson", None, 200, 5),
+
+    ('users: список', 'get', '/api/users/', None, 200, 1),
+    ('users: страница', 'get', '/api/users/?size=50', None, 200, 2),
+    ('users: курсор', 'get', '/api/users/?cursor=&size=50', None, 200, 1),
+    ('users: по числу забегов', 'get', '/api/users/?size=50&ordering=-runs_finished', None, 200, 2),
+    ('users: карточка', 'get', lambda d, i: f"/api/users/{d['athlete']}/", None, 200, 1),
+    ('users: статистика', 'get', lambda d, i: f"/api/users/{d['athlete']}/stats/?bucket=week", None, 200, 2),
+    ('users: синхронизация', 'get', lambda d, i: f"/api/users/{d['athlete']}/sync/", None, 200, 4),
+    ('users: архив забегов', 'get', lambda d, i: f"/api/users/{d['small_athlete']}/export.zip", None, 200, 12),
+
+    ('athlete_info: чтение', 'get', lambda d, i: f"/api/athlete_info/{d['athlete']}/", None, 200, 2),
+    ('athlete_info: запись', 'put', lambda d, i: f"/api/athlete_info/{d['athlete']}/",
+     {'goals': 'Марафон', 'weight': 70}, 201, 3),
+
+    ('challenges: спортсмен', 'get', lambda d, i: f"/api/challenges/?athlete={d['athlete']}", None, 200, 1),
+    ('leaderboards: top', 'get', '/api/leaderboards/distance/?top=10', None, 200, 1),
+    ('leaderboards: место', 'get', lambda d, i: f"/api/leaderboards/distance/?athlete={d['athlete']}", None, 200, 7),
+
+    ('positions: трек', 'get', lambda d, i: f"/api/positions/?run={d['track_run']}", None, 200, 3),
+    ('positions: курсор', 'get', lambda d, i: f"/api/positions/?run={d['track_run']}&cursor=&size=100",
+     None, 200, 3),
+    ('positions: упрощенный трек', 'get', lambda d, i: f"/api/positions/?run={d['track_run']}&tolerance=25",
+     None, 200, 3),
+    ('positions: рядом', 'get', '/api/positions/nearby/?lat=55.45&lon=37.35&radius=1000', None, 200, 1),
+    ('positions: буфер', 'get', '/api/positions/write-behind/', None, 200, 0),
+    # Точки загрузки идут с шагом 5 с и ~22 м от точек предыдущего повтора, иначе фильтр
+    # при загрузке (app_run.ingest_filters) отбросит их как дубликаты и дрожание на месте.
+    # Эндпоинты одной точки ставят время сервера, поэтому у каждого повтора свой забег
+    ('positions: точка', 'post', '/api/positions/',
+     lambda d, i: {'run': d['point_runs'][i], **ingest_point(i)}, 201, 8),
+    ('positions: async точка', 'post', lambda d, i: f"/api/async/runs/{d['async_point_runs'][i]}/positions/",
+     lambda d, i: ingest_point(i), 201, 8),
+    ('positions: пачка 100', 'post', lambda d, i: f"/api/runs/{d['ingest_runs'][2]}/positions/bulk/",
+     lambda d, i: [ingest_point(i * 100 + j) for j in range(100)], 201, 8),
+    ('positions: async пачка 100', 'post', lambda d, i: f"/api/async/runs/{d['ingest_runs'][3]}/positions/bulk/",
+     lambda d, i: [ingest_point(i * 100 + j) for j in range(100)], 201, 8),
+    ('positions: поток 100', 'post', lambda d, i: f"/api/runs/{d['ingest_runs'][4]}/positions/stream/",
+     lambda d, i: ''.join(
+         '{latitude},{longitude},{created_at}\n'.format(**ingest_point(i * 100 + j)) for j in range(100)
+     ), 201, 8),
+]
+
+
+def seed(scale, repeat):
+    """Наполняет БД и возвращает id объектов, на которые ссылаются эндпоинты."""
+    athletes_count, runs_per_athlete, track_runs, points = SCALES[scale]
+    athletes = seed_athletes(athletes_count)
+    seed_runs(athletes, runs_per_athlete)
+    # Забеги с треками у первого спортсмена: на них смотрят эндпоинты точек, экспорта и поиска по области
+    tracked = seed_runs(athletes[:1], track_runs, status='in_progress')
+    for run in tracked:
+        seed_track(run, points)
+    call_command('backfill_run_metrics', stdout=io.StringIO())
+    Run.objects.filter(pk__in=[run.pk for run in tracked]).update(status='finished')
+
+    # Пулы для эндпоинтов, меняющих состояние: по забегу на каждый повтор и замер памяти
+    pool = repeat + 1
+    small = seed_athletes(1, prefix='bench-small')[0]
+    data = {
+        'athlete': athletes[0].id,
+        'small_athlete': small.id,
+        'track_run': tracked[0].id,
+        'init_runs': [run.id for run in seed_runs([athletes[1]], pool, status='init')],
+        'async_init_runs': [run.id for run in seed_runs([athletes[1]], pool, status='init')],
+        'active_runs': [run.id for run in seed_runs([athletes[2]], pool, status='in_progress')],
+        'async_active_runs': [run.id for run in seed_runs([athletes[2]], pool, status='in_progress')],
+        'point_runs': [run.id for run in seed_runs([athletes[3]], pool, status='in_progress')],
+        'async_point_runs': [run.id for run in seed_runs([athletes[3]], pool, status='in_progress')],
+        'ingest_runs': [run.id for run in seed_runs([athletes[3]], 5, status='in_progress')],
+    }
+    for run in seed_runs([small], 5):
+        seed_track(run, 100)
+    for run_id in data['active_runs'] + data['async_active_runs']:
+        seed_track(Run(pk=run_id), 20)
+
+    for command in ('reconcile_run_counters', 'rebuild_activity_rollups', 'rebuild_leaderboards'):
+        call_command(command, stdout=io.StringIO())
+    call_command('award_challenges', '--rebuild', stdout=io.StringIO())
+    return data
+
+
+def resolve(value, data, i):
+    """url или тело эндпоинта для i-го повтора."""
+    return value(data, i) if callable(value) else value
+
+
+def request(client, method, url, body):
+    if isinstance(body, str):
+        response = getattr(client, method)(url, body, content_type='text/csv')
+    elif body is not None:
+        response = getattr(client, method)(url, json.dumps(body), content_type='application/json')
+    else:
+        response = getattr(client, method)(url)
+    if response.streaming:
+        # Время потоковых ответов включает чтение всего тела
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, data, endpoint, repeat):
+    name, method, url, body, expected_status, budget = endpoint
+
+    durations, queries, statuses = [], 0, set()
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request(client, method, resolve(url, data, i), resolve(body, data, i))
+            durations.append(time.perf_counter() - started)
+        queries = max(queries, len(captured))
+        statuses.add(response.status_code)
+
+    # Память замеряем отдельным прогоном: tracemalloc заметно замедляет запрос
+    tracemalloc.start()
+    try:
+        request(client, method, resolve(url, data, repeat), resolve(body, data, repeat))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'name': name,
+        'method': method.upper(),
+        'url': resolve(url, data, 0),
+        'statuses': sorted(statuses),
+        'expected_status': expected_status,
+        'queries': queries,
+        'query_budget': budget,
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет все эндпоинты API через тестовый клиент на синтетических данных: задержки p50/p95/p99, "
+        "число SQL-запросов и пик памяти. Падает при превышении бюджета запросов, пишет JSON-отчет"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='1k', help="Объем точек: 1k, 100k или 10m")
+        parser.add_argument('--repeat', type=int, default=20, help="Повторов каждого запроса")
+        parser.add_argument('--only', help="Только эндпоинты, в названии которых есть эта подстрока")
+        parser.add_argument('--report', default='bench_api_report.json', help="Куда записать JSON-отчет")
+        parser.add_argument(
+            '--response-cache', action='store_true',
+            help="Не отключать кеш ответов: замер повторных чтений из кеша вместо полного пути запроса"
+        )
+
+    def handle(self, *args, scale, repeat, only, report, response_cache, **options):
+        endpoints = [endpoint for endpoint in ENDPOINTS if not only or only in endpoint[0]]
+        results = []
+        # Уровни упрощения треков после финиша не готовятся: фоновый поток конкурировал бы с замерами за БД,
+        # а тестовая SQLite в памяти отвечает ему "table is locked". Трек для эндпоинта упрощенного трека
+        # засеян без финиша и упрощается при первом чтении, как и раньше
+        settings_override = override_settings(RESPONSE_CACHE_ENABLED=response_cache, TRACK_SIMPLIFY_TOLERANCES=[])
+        with isolated_database(), settings_override:
+            self.stdout.write(f"Наполняю БД (масштаб {scale})...")
+            data = seed(scale, repeat)
+            client = Client()
+            for endpoint in endpoints:
+                result = measure(client, data, endpoint, repeat)
+                results.append(result)
+                self.stdout.write(
+                    f"{result['name']:<32} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['p99_ms']:8.1f} мс "
+                    f"{result['queries']:3d}/{result['query_budget']:<3d} SQL {result['peak_memory_kb']:10.0f} КБ"
+                )
+
+        failures = []
+        for result in results:
+            if result['queries'] > result['query_budget']:
+                failures.append(f"{result['name']}: {result['queries']} SQL при бюджете {result['query_budget']}")
+            if result['statuses'] != [result['expected_status']]:
+                failures.append(f"{result['name']}: статусы {result['statuses']}, ожидался {result['expected_status']}")
+
+        with open(report, 'w', encoding='utf-8') as output:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'git_revision': git_revision(),
+                'scale': scale,
+                'repeat': repeat,
+                'response_cache': response_cache,
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'endpoints': results,
+                'failures': failures,
+            }, output, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Отчет: {report}")
+
+        if failures:
+            raise CommandError('; '.join(failures))
+        self.stdout.write(self.style.SUCCESS(f"Все {len(results)} эндпоинтов в пределах бюджета"))
@@ -0,0 +1,66 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from app_run.benchmarks import isolated_database, timed, seed_athlete_ids
+from app_run.leaderboards import update_leaderboards, top, rank, around
+from app_run.models import Run, LeaderboardEntry
+from app_run.stats import percentile
+
+
+class Command(BaseCommand):
+    help = "Замеряет рейтинги на синтетических спортсменах: обновление при финише, top N и место с соседями"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--athletes', type=int, default=1_000_000)
+        parser.add_argument('--samples', type=int, default=200, help="Сколько случайных спортсменов замерять")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--max-p95-ms', type=float, help="Допустимый p95 для места с соседями, мс")
+
+    def handle(self, *args, athletes, samples, seed, max_p95_ms, **options):
+        rng = random.Random(seed)
+        with isolated_database():
+            self.stdout.write(f"Создаю {athletes} спортсменов...")
+            athlete_ids = seed_athlete_ids(athletes)
+            for board, score in (('runs', lambda: rng.randint(0, 500)), ('distance', lambda: rng.uniform(0, 5e6))):
+                entries = (
+                    LeaderboardEntry(board=board, athlete_id=athlete_id, score=score())
+                    for athlete_id in athlete_ids
+                )
+                batch = []
+                for entry in entries:
+                    batch.append(entry)
+                    if len(batch) == 5000:
+                        LeaderboardEntry.objects.bulk_create(batch)
+                        batch = []
+                LeaderboardEntry.objects.bulk_create(batch)
+
+            sample_ids = iter(rng.choices(athlete_ids, k=samples * 3))
+            finished_at = timezone.now()
+
+            def finish_run():
+                run = Run(athlete_id=next(sample_ids), distance=rng.uniform(1000, 42195), created_at=finished_at)
+                with transaction.atomic():
+                    update_leaderboards(run)
+
+            def entry():
+                return LeaderboardEntry.objects.get(board='distance', period='all', athlete_id=next(sample_ids))
+
+            results = [
+                ('обновление при финише', timed(finish_run, samples)[0]),
+                ('top 10', timed(lambda: top('distance', 'all', 10), samples)[0]),
+                ('место спортсмена', timed(lambda: rank(entry()), samples)[0]),
+                ('место и 5 соседей', timed(lambda: around(entry(), 5), samples)[0]),
+            ]
+
+        for name, durations in results:
+            self.stdout.write(
+                f"{name}: p50 {percentile(durations, 50) * 1000:.2f} мс, "
+                f"p95 {percentile(durations, 95) * 1000:.2f} мс, max {max(durations) * 1000:.2f} мс"
+            )
+        p95 = percentile(results[-1][1], 95) * 1000
+        if max_p95_ms is not None and p95 > max_p95_ms:
+            raise CommandError(f"p95 места с соседями {p95:.2f} мс больше {max_p95_ms} мс")
+        self.stdout.write(self.style.SUCCESS(f"Спортсменов в рейтинге: {athletes}"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from app_run.models import Run
+from app_run.track import compact_run, restore_positions
+
+
+class Command(BaseCommand):
+    help = (
+        "Упаковывает копии треков завершенных забегов в Run.track; с --restore-rows восстанавливает "
+        "строки точек забегов, упакованных раньше с их удалением"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="Сколько забегов обработать за запуск")
+        parser.add_argument('--restore-rows', action='store_true', help="Восстановить строки Position из Run.track")
+
+    def handle(self, *args, limit, restore_rows, **options):
+        if restore_rows:
+            runs = Run.objects.filter(track__isnull=False).order_by('pk').only('pk', 'track')
+        else:
+            runs = Run.objects.filter(status='finished', track__isnull=True).order_by('pk').only('pk')
+        if limit:
+            runs = runs[:limit]
+
+        processed = restored = 0
+        for run in runs.iterator():
+            if restore_rows:
+                restored += restore_positions(run)
+            else:
+                compact_run(run)
+            processed += 1
+            if processed % 100 == 0:
+                self.stdout.write(f"Обработано забегов: {processed}")
+
+        if restore_rows:
+            self.stdout.write(self.style.SUCCESS(f"Забегов: {processed}, восстановлено точек: {restored}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Упаковано забегов: {processed}"))
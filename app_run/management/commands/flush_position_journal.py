@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_run.write_behind import recover_journals
+
+
+class Command(BaseCommand):
+    help = "Дописывает в БД журналы отложенной записи точек, оставшиеся от остановленных процессов"
+
+    def handle(self, *args, **options):
+        recovered = recover_journals(settings.POSITIONS_WRITE_BEHIND_DIR)
+        self.stdout.write(self.style.SUCCESS(f"Восстановлено точек: {recovered}"))
@@ -0,0 +1,154 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from app_run.importer import find_files, finish_imported_runs, insert_positions, parse_file
+from app_run.models import ImportedFile, Run
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает историю забегов из архивов GPX и CSV: забеги создаются сразу завершенными. "
+        "Уже загруженные файлы пропускаются, поэтому прерванный импорт можно просто запустить снова"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Файлы и каталоги с архивами (.gpx, .csv)")
+        parser.add_argument(
+            '--athlete', type=int, default=None,
+            help="id спортсмена для всех файлов; по умолчанию спортсмен - пользователь с username, "
+                 "совпадающим с именем каталога файла",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help="Процессов для разбора файлов, 0 - разбирать в основном процессе",
+        )
+        parser.add_argument(
+            '--batch-points', type=int, default=200_000, help="Сколько точек записывать одной транзакцией"
+        )
+
+    def handle(self, *args, paths, athlete, workers, batch_points, **options):
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise CommandError(f"Нет таких файлов или каталогов: {', '.join(missing)}")
+        files = find_files(paths)
+        owners = self.resolve_athletes(files, athlete)
+        imported = ImportedFile.objects.filter(athlete_id__in=set(owners.values()))
+        # Файл с тем же путем и размером уже загружен: не тратим время на его разбор
+        done = set(imported.values_list('athlete_id', 'path', 'size'))
+        digests = set(imported.values_list('athlete_id', 'digest'))
+        pending = [
+            path for path in files
+            if path in owners and (owners[path], path, os.path.getsize(path)) not in done
+        ]
+        skipped, failed = len(owners) - len(pending), len(files) - len(owners)
+        self.stdout.write(f"Файлов: {len(files)}, к загрузке: {len(pending)}, уже загружено: {skipped}")
+
+        parse = partial(parse_file, aware=connection.features.supports_timezones)
+        started = time.perf_counter()
+        batch, batch_size, processed, runs, points = [], 0, 0, 0, 0
+        for result in self.parse_all(pending, parse, workers):
+            processed += 1
+            owner = owners[result['path']]
+            if 'error' in result:
+                failed += 1
+                self.stderr.write(f"{result['path']}: {result['error']}")
+                continue
+            if (owner, result['digest']) in digests:
+                skipped += 1
+                continue
+            digests.add((owner, result['digest']))
+            batch.append(result)
+            batch_size += len(result['rows'])
+            if batch_size >= batch_points:
+                self.write_batch(batch, owners)
+                runs, points = runs + len(batch), points + batch_size
+                batch, batch_size = [], 0
+                self.progress(processed, len(pending), runs, points, started)
+        if batch:
+            self.write_batch(batch, owners)
+            runs, points = runs + len(batch), points + batch_size
+            self.progress(processed, len(pending), runs, points, started)
+
+        if runs and settings.RUN_TRACK_COMPACTION:
+            self.stdout.write("Треки загружены построчно, упаковать их можно командой compact_runs")
+        message = f"Загружено забегов: {runs}, точек: {points}, пропущено файлов: {skipped}, с ошибками: {failed}"
+        self.stdout.write(self.style.SUCCESS(message) if not failed else self.style.WARNING(message))
+
+    def resolve_athletes(self, files, athlete_id):
+        """Спортсмен каждого файла: {путь: id}. Файлы без спортсмена выводятся как ошибки."""
+        if athlete_id is not None:
+            if not User.objects.filter(pk=athlete_id).exists():
+                raise CommandError(f"Спортсмен {athlete_id} не найден")
+            return dict.fromkeys(files, athlete_id)
+
+        usernames = {path: os.path.basename(os.path.dirname(path)) for path in files}
+        users = dict(User.objects.filter(username__in=set(usernames.values())).values_list('username', 'pk'))
+        owners = {}
+        for path, username in usernames.items():
+            if username in users:
+                owners[path] = users[username]
+            else:
+                self.stderr.write(f"{path}: нет пользователя {username}")
+        return owners
+
+    @staticmethod
+    def parse_all(paths, parse, workers):
+        """Результаты parse_file в порядке файлов. Вперед разбирается не больше двух файлов на процесс."""
+        if not workers:
+            yield from map(parse, paths)
+            return
+        # Соединения с БД не должны достаться дочерним процессам
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            futures = deque()
+            for path in paths:
+                futures.append(pool.submit(parse, path))
+                if len(futures) >= 2 * workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+    @staticmethod
+    def write_batch(batch, owners):
+        with transaction.atomic():
+            runs = Run.objects.bulk_create([
+                Run(
+                    athlete_id=owners[result['path']],
+                    status='finished',
+                    comment=result['comment'],
+                    **result['metrics'],
+                )
+                for result in batch
+            ])
+            # auto_now_add ставит текущее время, а забег из архива относится ко времени начала трека
+            for run, result in zip(runs, batch):
+                run.created_at = result['started_at']
+            Run.objects.bulk_update(runs, ['created_at'])
+            insert_positions([(run.pk, *row) for run, result in zip(runs, batch) for row in result['rows']])
+            ImportedFile.objects.bulk_create([
+                ImportedFile(
+                    athlete_id=run.athlete_id,
+                    run=run,
+                    path=result['path'],
+                    size=result['size'],
+                    digest=result['digest'],
+                    points=len(result['rows']),
+                )
+                for run, result in zip(runs, batch)
+            ])
+            finish_imported_runs(runs)
+
+    def progress(self, processed, total, runs, points, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Файлов: {processed}/{total}, забегов: {runs}, точек: {points} ({points / elapsed:.0f} точек/с)"
+        )
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.benchmarks import seed_athletes, seed_runs
+from app_run.stats import percentile
+
+
+class HttpConnection:
+    """Минимальный HTTP/1.1 клиент с keep-alive поверх asyncio streams: одно соединение на устройство."""
+
+    def __init__(self, base_url):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.reader = self.writer = None
+
+    async def post(self, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode()
+        self.writer.write(
+            f'POST {self.prefix}{path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            '\r\n'.encode() + payload
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            while size := int((await self.reader.readline()).strip(), 16):
+                await self.reader.readexactly(size + 2)
+            await self.reader.readline()
+        else:
+            await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+ENDPOINTS = {
+    # Синхронный DRF-эндпоинт точки и его async-вариант (app_run.async_views)
+    'wsgi': lambda run_id: ('/api/positions/', {'run': run_id}),
+    'asgi': lambda run_id: (f'/api/async/runs/{run_id}/positions/', {}),
+}
+
+
+async def run_device(base_url, endpoint, run_id, points, interval, latencies, errors, in_flight):
+    connection = HttpConnection(base_url)
+    path, extra = endpoint(run_id)
+    # Устройства стартуют вразнобой в пределах одного интервала, как настоящие трекеры
+    await asyncio.sleep(random.uniform(0, interval))
+    # Шаг ~22 м, чтобы фильтр при загрузке (app_run.ingest_filters) не принял точки за дрожание на месте.
+    # Оба эндпоинта ставят точке время сервера, и при --interval короче 1.5 с часть точек отбрасывается
+    # по скорости (ответ 200 с accepted = 0)
+    try:
+        for i in range(points):
+            body = {
+                'latitude': f'{55 + i / 5000:.4f}',
+                'longitude': '37.0000',
+                **extra,
+            }
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            started = time.perf_counter()
+            try:
+                status = await connection.post(path, body)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                status = None
+                await connection.close()
+            finally:
+                in_flight[0] -= 1
+            if status in (200, 201, 202):
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors.append(status)
+            await asyncio.sleep(interval)
+    finally:
+        await connection.close()
+
+
+async def run_load(base_url, endpoint, run_ids, points, interval):
+    latencies, errors, in_flight = [], [], [0, 0]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_device(base_url, endpoint, run_id, points, interval, latencies, errors, in_flight)
+        for run_id in run_ids
+    ))
+    return latencies, errors, in_flight[1], time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест трекинга: тысячи устройств шлют точки по одной через WSGI (DRF) и ASGI (async) "
+        "серверы. Серверы запускаются отдельно и должны смотреть в ту же БД, что и команда"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', help="Например http://127.0.0.1:8000 (gunicorn project_run.wsgi)")
+        parser.add_argument('--asgi-url', help="Например http://127.0.0.1:8001 (см. project_run/asgi.py)")
+        parser.add_argument('--devices', type=int, default=2000, help="Одновременных устройств (соединений)")
+        parser.add_argument('--points', type=int, default=10, help="Точек от каждого устройства")
+        parser.add_argument('--interval', type=float, default=1.0, help="Пауза устройства между точками, с")
+
+    def handle(self, *args, wsgi_url, asgi_url, devices, points, interval, **options):
+        targets = [(name, url) for name, url in (('wsgi', wsgi_url), ('asgi', asgi_url)) if url]
+        if not targets:
+            raise CommandError("Укажите --wsgi-url и/или --asgi-url")
+
+        athlete = seed_athletes(1, prefix=f'load-{int(time.time())}')[0]
+        for name, url in targets:
+            run_ids = [run.id for run in seed_runs([athlete], devices, status='in_progress')]
+            latencies, errors, peak, elapsed = asyncio.run(
+                run_load(url, ENDPOINTS[name], run_ids, points, interval)
+            )
+            total = len(latencies) + len(errors)
+            self.stdout.write(
+                f"{name} ({url}): устройств {devices}, запросов {total}, ошибок {len(errors)}, "
+                f"в полете одновременно до {peak}, {total / elapsed:.0f} запр/с"
+            )
+            if latencies:
+                self.stdout.write(
+                    f"    задержка p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+                    f"p95 {percentile(latencies, 95) * 1000:.1f} мс, "
+                    f"p99 {percentile(latencies, 99) * 1000:.1f} мс, max {max(latencies) * 1000:.1f} мс"
+                )
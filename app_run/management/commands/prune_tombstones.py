@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_run.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = "Удаляет отметки об удалении старше SYNC_TOMBSTONE_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Сколько отметок удалять за раз")
+
+    def handle(self, *args, batch_size, **options):
+        # Клиенты с токеном старше этой границы получают 410 и синхронизируются заново
+        cutoff = timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        expired = Tombstone.objects.filter(deleted_at__lt=cutoff)
+
+        deleted = 0
+        while True:
+            batch = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            Tombstone.objects.filter(pk__in=batch).delete()
+            deleted += len(batch)
+            self.stdout.write(f"Удалено отметок: {deleted}")
+
+        self.stdout.write(self.style.SUCCESS(f"Удалено отметок: {deleted}"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_run.management.batches import athlete_id_batches
+from app_run.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дневные, недельные и месячные итоги спортсменов по завершенным забегам"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Сколько спортсменов обрабатывать за раз")
+
+    def handle(self, *args, batch_size, **options):
+        processed, created = 0, 0
+        for athlete_ids in athlete_id_batches(batch_size):
+            with transaction.atomic():
+                created += len(rebuild_rollups(athlete_ids))
+            processed += len(athlete_ids)
+            self.stdout.write(f"Обработано спортсменов: {processed}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано спортсменов: {processed}, строк итогов: {created}"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_run.leaderboards import rebuild_leaderboards
+from app_run.management.batches import athlete_id_batches
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рейтинги за все время и по месяцам по завершенным забегам"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Сколько спортсменов обрабатывать за раз")
+
+    def handle(self, *args, batch_size, **options):
+        processed, created = 0, 0
+        for athlete_ids in athlete_id_batches(batch_size):
+            with transaction.atomic():
+                created += len(rebuild_leaderboards(athlete_ids))
+            processed += len(athlete_ids)
+            self.stdout.write(f"Обработано спортсменов: {processed}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано спортсменов: {processed}, записей рейтинга: {created}"
+        ))
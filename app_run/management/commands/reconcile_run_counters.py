@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_run.counters import count_runs
+from app_run.management.batches import athlete_id_batches
+from app_run.models import AthleteInfo
+from app_run.response_cache import invalidate
+
+COUNTER_FIELDS = ['runs_total', 'runs_in_progress', 'runs_finished']
+
+
+class Command(BaseCommand):
+    help = "Сверяет счетчики забегов в AthleteInfo с таблицей Run и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Сколько спортсменов сверять за раз")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать расхождения")
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        checked, repaired = 0, 0
+        for athlete_ids in athlete_id_batches(batch_size):
+            actual = count_runs(athlete_ids)
+            infos = {info.user_id: info for info in AthleteInfo.objects.filter(user_id__in=athlete_ids)}
+
+            drifted, missing = [], []
+            for athlete_id, counts in actual.items():
+                info = infos.get(athlete_id)
+                if info is None:
+                    if counts['runs_total']:
+                        missing.append(AthleteInfo(user_id=athlete_id, **counts))
+                    continue
+                if any(getattr(info, field) != value for field, value in counts.items()):
+                    self.stdout.write(
+                        f"Спортсмен {athlete_id}: "
+                        + ", ".join(f"{field} {getattr(info, field)} -> {counts[field]}" for field in COUNTER_FIELDS)
+                    )
+                    for field, value in counts.items():
+                        setattr(info, field, value)
+                    info.updated_at = timezone.now()
+                    drifted.append(info)
+
+            if not dry_run:
+                AthleteInfo.objects.bulk_update(drifted, [*COUNTER_FIELDS, 'updated_at'])
+                AthleteInfo.objects.bulk_create(missing, ignore_conflicts=True)
+                if drifted or missing:
+                    invalidate('users')
+            checked += len(athlete_ids)
+            repaired += len(drifted) + len(missing)
+
+        self.stdout.write(self.style.SUCCESS(f"Проверено спортсменов: {checked}, исправлено: {repaired}"))
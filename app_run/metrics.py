@@ -0,0 +1,193 @@
+from itertools import accumulate
+
+from django.db import transaction
+
+from app_run.geo import haversine, haversine_many
+from app_run.models import Run, Position
+from app_run.response_cache import invalidate_live
+
+# Отрезок считается движением, если скорость не ниже порога,
+# а пауза между точками не слишком длинная (иначе это остановка или потеря сигнала)
+MOVING_SPEED_THRESHOLD = 0.5  # м/с
+MAX_SEGMENT_GAP = 120  # с
+
+# Отрезок для лучшего времени забега, м
+FIVE_K = 5000
+
+# Длина сплита в метрах
+SPLIT_UNITS = {
+    'km': 1000,
+    'mi': 1609.344,
+}
+
+METRIC_FIELDS = [
+    'distance', 'moving_time', 'avg_pace',
+    'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude',
+    'last_latitude', 'last_longitude', 'last_position_at',
+]
+
+
+class RunNotActive(Exception):
+    """Забег уже не принимает точки: его завершили, пока точки ждали записи."""
+
+
+def is_moving(segment, elapsed):
+    return 0 < elapsed <= MAX_SEGMENT_GAP and segment / elapsed >= MOVING_SPEED_THRESHOLD
+
+
+def calculate_pace(distance, moving_time):
+    # Темп в секундах на километр
+    if distance <= 0:
+        return None
+    return moving_time / (distance / 1000)
+
+
+def segment_speed(segment, elapsed):
+    # Мгновенная скорость на отрезке от предыдущей точки, м/с
+    return segment / elapsed if elapsed > 0 else None
+
+
+def add_point(run, latitude, longitude, created_at):
+    """
+    Добавляет точку к метрикам забега и возвращает ее мгновенную скорость (None для первой точки)
+    и накопленную дистанцию. Точка не новее последней (догрузка после потери связи) только расширяет
+    границы трека: отрезок к ней от последней точки идет назад во времени и не входит ни в дистанцию,
+    ни в порядок трека, поэтому скорость и дистанция у нее None, а последняя точка забега не меняется.
+    """
+    speed = None
+    if run.last_position_at is not None:
+        elapsed = (created_at - run.last_position_at).total_seconds()
+        if elapsed <= 0:
+            _extend_bounds(run, latitude, longitude)
+            return None, None
+        segment = haversine(run.last_latitude, run.last_longitude, latitude, longitude)
+        run.distance += segment
+        if is_moving(segment, elapsed):
+            run.moving_time += elapsed
+        speed = segment_speed(segment, elapsed)
+
+    _extend_bounds(run, latitude, longitude)
+    run.last_latitude = latitude
+    run.last_longitude = longitude
+    run.last_position_at = created_at
+    return speed, run.distance
+
+
+def _extend_bounds(run, latitude, longitude):
+    if run.min_latitude is None:
+        run.min_latitude = run.max_latitude = latitude
+        run.min_longitude = run.max_longitude = longitude
+    else:
+        run.min_latitude = min(run.min_latitude, latitude)
+        run.max_latitude = max(run.max_latitude, latitude)
+        run.min_longitude = min(run.min_longitude, longitude)
+        run.max_longitude = max(run.max_longitude, longitude)
+
+
+def update_run_metrics(run, positions):
+    """
+    Добавляем к метрикам только новые отрезки, начиная с последней известной точки забега.
+    Заодно проставляет точкам скорость и накопленную дистанцию, поэтому вызывается до их сохранения.
+    Статус проверяется под блокировкой строки: точки, опоздавшие к завершению забега (буфер другого
+    воркера, следующая пачка потоковой загрузки), не меняют уже подведенные итоги - RunNotActive.
+    """
+    with transaction.atomic():
+        locked = Run.objects.select_for_update().get(pk=run.pk)
+        if locked.status != 'in_progress':
+            raise RunNotActive(locked.status)
+        for position in sorted(positions, key=lambda p: p.created_at):
+            position.speed, position.distance = add_point(
+                locked, position.latitude, position.longitude, position.created_at
+            )
+        locked.avg_pace = calculate_pace(locked.distance, locked.moving_time)
+        locked.save(update_fields=[*METRIC_FIELDS, 'updated_at'])
+        # Каждая точка меняет метрики забега: общий список забегов сбрасывается не чаще интервала
+        invalidate_live('runs', locked.athlete_id)
+
+    for field in METRIC_FIELDS:
+        setattr(run, field, getattr(locked, field))
+
+
+def fastest_window_time(distances, timestamps, window=FIVE_K):
+    """
+    Самое короткое время, за которое трек прошел window метров подряд, по накопленной дистанции точек;
+    конец отрезка интерполируется внутри сегмента, где дистанция дошла до window. None, если трек короче.
+    Время полное, с остановками: так засчитывают результат на дистанции.
+    """
+    if not distances:
+        return None
+    seconds = [(moment - timestamps[0]).total_seconds() for moment in timestamps]
+    best, end = None, 0
+    for start, start_distance in enumerate(distances):
+        target = start_distance + window
+        # Конец окна только сдвигается вперед вслед за началом: проход по треку линейный
+        while end < len(distances) and distances[end] < target:
+            end += 1
+        if end == len(distances):
+            break
+        previous = end - 1
+        finish = seconds[previous] + (seconds[end] - seconds[previous]) * (
+            (target - distances[previous]) / (distances[end] - distances[previous])
+        )
+        if best is None or finish - seconds[start] < best:
+            best = finish - seconds[start]
+    return best
+
+
+def finalize_run_metrics(run):
+    run.avg_pace = calculate_pace(run.distance, run.moving_time)
+    run.best_5k_time = None
+    if run.distance >= FIVE_K:
+        # Накопленная дистанция точек посчитана при загрузке, трек читается двумя колонками;
+        # опоздавшие точки без дистанции в трек не входят
+        points = list(
+            Position.objects.filter(run=run, distance__isnull=False)
+            .order_by('created_at', 'id').values_list('distance', 'created_at')
+        )
+        run.best_5k_time = fastest_window_time([point[0] for point in points], [point[1] for point in points])
+    run.save(update_fields=['avg_pace', 'best_5k_time', 'updated_at'])
+
+
+def compute_point_metrics(latitudes, longitudes, timestamps, segments=None):
+    """
+    Скорость и накопленная дистанция каждой точки трека, так же, как их считает add_point при загрузке.
+    segments - уже посчитанные haversine_many длины отрезков, если они есть у вызывающего.
+    """
+    if not latitudes:
+        return []
+    if segments is None:
+        segments = haversine_many(latitudes, longitudes)
+    points, distance = [(None, 0.0)], 0.0
+    for segment, earlier, later in zip(segments, timestamps, timestamps[1:]):
+        distance += segment
+        points.append((segment_speed(segment, (later - earlier).total_seconds()), distance))
+    return points
+
+
+def compute_track_metrics(latitudes, longitudes, timestamps, segments=None):
+    """Метрики всего трека по массивам координат и времени, используется для пересчета истории."""
+    if segments is None:
+        segments = haversine_many(latitudes, longitudes)
+    elapsed = [
+        (later - earlier).total_seconds()
+        for earlier, later in zip(timestamps, timestamps[1:])
+    ]
+    distance = sum(segments)
+    distances = list(accumulate(segments, initial=0.0))
+    moving_time = sum(
+        seconds for segment, seconds in zip(segments, elapsed)
+        if is_moving(segment, seconds)
+    )
+    return {
+        'distance': distance,
+        'moving_time': moving_time,
+        'avg_pace': calculate_pace(distance, moving_time),
+        'best_5k_time': fastest_window_time(distances, timestamps),
+        'min_latitude': min(latitudes),
+        'max_latitude': max(latitudes),
+        'min_longitude': min(longitudes),
+        'max_longitude': max(longitudes),
+        'last_latitude': latitudes[-1],
+        'last_longitude': longitudes[-1],
+        'last_position_at': timestamps[-1],
+    }
@@ -0,0 +1,240 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from app_run.routers import end_request, replica_aliases, start_request
+
+logger = logging.getLogger('app_run.instrumentation')
+
+# Замер текущего запроса. ContextVar, а не обертка соединения на время запроса: async-представления
+# ходят в БД из потоков sync_to_async со своими соединениями, а контекст переходит в эти потоки
+_recorder = ContextVar('sql_recorder', default=None)
+
+
+class QueryRecorder:
+    """Обертка connection.execute_wrapper: время и текст каждого SQL-запроса (без параметров)."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def total(self):
+        return sum(duration for _, duration in self.queries)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    """
+    Ставит соединению постоянную обертку замера (обработчик connection_created, см. AppRunConfig.ready).
+    Без замера в контексте она только передает запрос дальше.
+    """
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+class AsyncCapableMiddleware:
+    """
+    Основа middleware для WSGI и ASGI: под ASGI Django передает асинхронный get_response, и наследник
+    обрабатывает запрос в __acall__, не переключаясь в поток, как было бы с синхронным middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+class QueryInstrumentationMiddleware(AsyncCapableMiddleware):
+    """
+    Для доли запросов SQL_INSTRUMENTATION_SAMPLE_RATE считает число и время SQL-запросов, время
+    представления и рендеринга ответа. Результат уходит в заголовок Server-Timing и в лог
+    app_run.instrumentation одной JSON-строкой. Повторяющийся один и тот же SQL помечается как
+    вероятный N+1. Запросы, выполняемые при отдаче StreamingHttpResponse, в замер не попадают.
+    """
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.SQL_INSTRUMENTATION_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        # Новые соединения получают обертку при подключении, здесь - уже открытые в этом потоке
+        for alias in connections:
+            install_query_recorder(connections[alias])
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        recorder, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.handle(request, response, recorder)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        recorder, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.handle(request, response, recorder)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @staticmethod
+    def start(request):
+        recorder = QueryRecorder()
+        request._instrumentation = {'started': time.perf_counter()}
+        return recorder, _recorder.set(recorder)
+
+    def handle(self, request, response, recorder):
+        timings = request._instrumentation
+        timings['finished'] = time.perf_counter()
+        self.report(request, response, recorder, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_instrumentation'):
+            request._instrumentation['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после представления: так время сериализации отделяется от времени view
+        timings = getattr(request, '_instrumentation', None)
+        if timings is not None:
+            timings['view_finished'] = time.perf_counter()
+            response.add_post_render_callback(lambda _: timings.__setitem__('rendered', time.perf_counter()))
+        return response
+
+    def report(self, request, response, recorder, timings):
+        view_started = timings.get('view_started', timings['started'])
+        view_finished = timings.get('view_finished', timings.get('rendered', timings['finished']))
+        rendered = timings.get('rendered', view_finished)
+        sql_ms = recorder.total * 1000
+        durations = {
+            'view_ms': (view_finished - view_started) * 1000,
+            'render_ms': (rendered - view_finished) * 1000,
+            'total_ms': (timings['finished'] - timings['started']) * 1000,
+        }
+
+        repeated = Counter(sql for sql, _ in recorder.queries)
+        n_plus_one = [
+            {'sql': sql, 'count': count}
+            for sql, count in repeated.most_common()
+            if count >= settings.SQL_INSTRUMENTATION_REPEAT_THRESHOLD
+        ]
+        slowest = sorted(recorder.queries, key=lambda item: item[1], reverse=True)
+        slowest = [
+            {'sql': sql, 'ms': round(duration * 1000, 3)}
+            for sql, duration in slowest[:settings.SQL_INSTRUMENTATION_SLOWEST]
+        ]
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={sql_ms:.1f};desc="{len(recorder.queries)} queries"',
+            f'view;dur={durations["view_ms"]:.1f}',
+            f'render;dur={durations["render_ms"]:.1f}',
+            f'total;dur={durations["total_ms"]:.1f}',
+        ])
+
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'route': match.route if match else None,
+            'status': response.status_code,
+            'queries': len(recorder.queries),
+            'sql_ms': round(sql_ms, 3),
+            **{name: round(value, 3) for name, value in durations.items()},
+            'slowest': slowest,
+            'n_plus_one': n_plus_one,
+        }
+        level = logging.WARNING if n_plus_one else logging.INFO
+        logger.log(level, json.dumps(record, ensure_ascii=False))
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """
+    Направляет чтения безопасных запросов к представлениям с replica_reads = True на реплики
+    (см. app_run.routers). Клиенту, который что-то записал, ставит cookie READ_YOUR_WRITES_COOKIE:
+    до ее истечения он читает из основной БД. Без реплик в настройках не подключается.
+    Запросы, выполняемые при отдаче StreamingHttpResponse, идут в основную БД.
+    Состояние маршрутизации - ContextVar: под ASGI его видят и потоки sync_to_async представления.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.handle(request, response)
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.handle(request, response)
+
+    def start(self, request):
+        pinned_until = request.COOKIES.get(settings.READ_YOUR_WRITES_COOKIE, '')
+        request._replica_allowed = request.method in self.SAFE_METHODS and not (
+            pinned_until.isdigit() and int(pinned_until) > time.time()
+        )
+        # Представление еще не известно: реплику разрешает process_view
+        request._routing_state, token = start_request()
+        return token
+
+    def handle(self, request, response):
+        if request._routing_state.wrote or request.method not in self.SAFE_METHODS:
+            window = settings.READ_YOUR_WRITES_WINDOW
+            response.set_cookie(
+                settings.READ_YOUR_WRITES_COOKIE,
+                str(int(time.time() + window)),
+                max_age=window,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if request._replica_allowed and getattr(view_class, 'replica_reads', False):
+            request._routing_state.use_replica = True
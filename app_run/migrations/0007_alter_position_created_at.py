@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 19:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0006_position"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="position",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0007_alter_position_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="run",
+            name="avg_pace",
+            field=models.FloatField(
+                blank=True, help_text="Средний темп, с/км", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="distance",
+            field=models.FloatField(default=0, help_text="Дистанция, м"),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="last_latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="last_longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="last_position_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="max_latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="max_longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="min_latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="min_longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="moving_time",
+            field=models.FloatField(default=0, help_text="Время в движении, с"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0008_run_metrics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="run",
+            name="track",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 19:07
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_run_counters(apps, schema_editor):
+    Run = apps.get_model("app_run", "Run")
+    AthleteInfo = apps.get_model("app_run", "AthleteInfo")
+
+    rows = Run.objects.values("athlete_id").annotate(
+        runs_total=Count("id"),
+        runs_in_progress=Count("id", filter=Q(status="in_progress")),
+        runs_finished=Count("id", filter=Q(status="finished")),
+    )
+    for row in rows.iterator():
+        AthleteInfo.objects.update_or_create(
+            user_id=row.pop("athlete_id"), defaults=row
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0009_run_track"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="runs_finished",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="runs_in_progress",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="runs_total",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_run_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0010_athleteinfo_run_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="best_5k_time",
+            field=models.FloatField(
+                blank=True, help_text="Лучшее время на 5 км, с", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="best_streak_days",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="current_streak_days",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="last_run_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="athleteinfo",
+            name="total_distance",
+            field=models.FloatField(default=0, help_text="Суммарная дистанция, м"),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 19:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+from app_run.operations import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY на PostgreSQL нельзя выполнять в транзакции
+    atomic = False
+
+    dependencies = [
+        ("app_run", "0011_athleteinfo_aggregates"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name="position",
+            index=models.Index(
+                fields=["run", "created_at", "id"], name="position_run_created_idx"
+            ),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name="run",
+            index=models.Index(
+                fields=["athlete", "status", "created_at"],
+                name="run_athlete_status_idx",
+            ),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name="run",
+            index=models.Index(
+                condition=models.Q(("status", "finished")),
+                fields=["athlete"],
+                name="run_finished_athlete_idx",
+            ),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name="run",
+            index=models.Index(fields=["created_at", "id"], name="run_created_id_idx"),
+        ),
+    ]
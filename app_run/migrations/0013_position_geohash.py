@@ -0,0 +1,74 @@
+# Generated by Django 5.2 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+from app_run.operations import AddIndexConcurrentlyIfSupported
+
+BATCH_SIZE = 5000
+
+# Копия app_run.geo.geohash_encode на момент миграции: код приложения может измениться,
+# а миграция должна заполнять поле так же, как при ее создании
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 8
+
+
+def geohash_encode(latitude, longitude):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < GEOHASH_PRECISION:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def fill_geohash(apps, schema_editor):
+    Position = apps.get_model("app_run", "Position")
+
+    # Пачками по возрастанию id: миграция не атомарная, каждая пачка фиксируется сразу
+    last_id = 0
+    while True:
+        batch = list(
+            Position.objects.filter(id__gt=last_id, geohash="")
+            .order_by("id")
+            .only("id", "latitude", "longitude")[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for position in batch:
+            position.geohash = geohash_encode(position.latitude, position.longitude)
+        Position.objects.bulk_update(batch, ["geohash"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY на PostgreSQL нельзя выполнять в транзакции
+    atomic = False
+
+    dependencies = [
+        ("app_run", "0012_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="position",
+            name="geohash",
+            field=models.CharField(blank=True, default="", max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+        AddIndexConcurrentlyIfSupported(
+            model_name="position",
+            index=models.Index(fields=["geohash"], name="position_geohash_idx"),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0013_position_geohash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActivityRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "bucket",
+                    models.CharField(
+                        choices=[
+                            ("day", "День"),
+                            ("week", "Неделя"),
+                            ("month", "Месяц"),
+                        ],
+                        max_length=5,
+                    ),
+                ),
+                ("period_start", models.DateField()),
+                ("runs", models.PositiveIntegerField(default=0)),
+                ("distance", models.FloatField(default=0, help_text="Дистанция, м")),
+                (
+                    "moving_time",
+                    models.FloatField(default=0, help_text="Время в движении, с"),
+                ),
+                (
+                    "athlete",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="activity_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("athlete", "bucket", "period_start")},
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 19:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0014_activity_rollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "board",
+                    models.CharField(
+                        choices=[
+                            ("runs", "Завершенные забеги"),
+                            ("distance", "Дистанция"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("period", models.CharField(default="all", max_length=7)),
+                ("score", models.FloatField(default=0)),
+                (
+                    "athlete",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="leaderboard_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["board", "period", "-score", "athlete"],
+                        name="leaderboard_rank_idx",
+                    )
+                ],
+                "unique_together": {("board", "period", "athlete")},
+            },
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2 on 2026-10-18 21:40
+
+import math
+
+from django.db import migrations, models
+
+from app_run.operations import AddIndexConcurrentlyIfSupported
+
+BATCH_SIZE = 500
+
+# Копия app_run.metrics.compute_point_metrics (с haversine_many) на момент миграции: код приложения
+# может измениться, а миграция должна считать скорость и дистанцию так же, как при ее создании
+EARTH_RADIUS = 6371008.8  # средний радиус Земли, м
+
+
+def compute_point_metrics(latitudes, longitudes, timestamps):
+    lats = [math.radians(float(value)) for value in latitudes]
+    lons = [math.radians(float(value)) for value in longitudes]
+    cos_lats = [math.cos(value) for value in lats]
+    segments = [
+        2 * EARTH_RADIUS * math.asin(math.sqrt(
+            math.sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * math.sin((lon2 - lon1) / 2) ** 2
+        ))
+        for lat1, lat2, lon1, lon2, cos1, cos2
+        in zip(lats, lats[1:], lons, lons[1:], cos_lats, cos_lats[1:])
+    ]
+    points, distance = [(None, 0.0)], 0.0
+    for segment, earlier, later in zip(segments, timestamps, timestamps[1:]):
+        distance += segment
+        elapsed = (later - earlier).total_seconds()
+        points.append((segment / elapsed if elapsed > 0 else None, distance))
+    return points
+
+
+def fill_point_metrics(apps, schema_editor):
+    Run = apps.get_model("app_run", "Run")
+    Position = apps.get_model("app_run", "Position")
+
+    # Забег за забегом по возрастанию id: трек нужен целиком, каждая пачка забегов фиксируется сразу
+    last_id = 0
+    while True:
+        run_ids = list(
+            Run.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:BATCH_SIZE]
+        )
+        if not run_ids:
+            break
+        for run_id in run_ids:
+            positions = list(
+                Position.objects.filter(run_id=run_id)
+                .order_by("created_at", "id")
+                .only("id", "latitude", "longitude", "created_at")
+            )
+            if not positions:
+                continue
+            metrics = compute_point_metrics(
+                [position.latitude for position in positions],
+                [position.longitude for position in positions],
+                [position.created_at for position in positions],
+            )
+            for position, (speed, distance) in zip(positions, metrics):
+                position.speed = speed
+                position.distance = distance
+            Position.objects.bulk_update(
+                positions, ["speed", "distance"], batch_size=5000
+            )
+        last_id = run_ids[-1]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY на PostgreSQL нельзя выполнять в транзакции
+    atomic = False
+
+    dependencies = [
+        ("app_run", "0015_leaderboard_entry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="position",
+            name="speed",
+            field=models.FloatField(
+                blank=True, help_text="Мгновенная скорость, м/с", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="position",
+            name="distance",
+            field=models.FloatField(
+                blank=True, help_text="Дистанция от начала забега, м", null=True
+            ),
+        ),
+        migrations.RunPython(fill_point_metrics, migrations.RunPython.noop),
+        AddIndexConcurrentlyIfSupported(
+            model_name="position",
+            index=models.Index(
+                fields=["run", "distance"], name="position_run_distance_idx"
+            ),
+        ),
+    ]
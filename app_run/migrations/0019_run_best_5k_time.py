@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0018_imported_file"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="run",
+            name="best_5k_time",
+            field=models.FloatField(
+                blank=True, help_text="Самые быстрые 5 км подряд, с", null=True
+            ),
+        ),
+    ]
@@ -1,9 +1,22 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import Q
+from django.utils import timezone
 
+from app_run.geo import geohash_encode
 from app_run.validators import validate_coordinate
 
 
+def supports_update_returning(connection):
+    """
+    UPDATE ... RETURNING есть у PostgreSQL и SQLite 3.35+. Признак can_return_columns_from_insert его
+    не заменяет: у MariaDB RETURNING есть только у INSERT и DELETE, у Oracle - другой синтаксис (RETURNING INTO).
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
 class Run(models.Model):
 
     STATUS_CHOICES = [
@@ -12,11 +25,95 @@ class Run(models.Model):
         ('finished', 'Завершен'),
     ]
 
+    # Переходы статуса: действие -> (из какого статуса, в какой)
+    TRANSITIONS = {
+        'start': ('init', 'in_progress'),
+        'stop': ('in_progress', 'finished'),
+    }
+
     athlete = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     comment = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='init')
 
+    # Метрики забега, обновляются инкрементально по мере поступления точек
+    distance = models.FloatField(default=0, help_text="Дистанция, м")
+    moving_time = models.FloatField(default=0, help_text="Время в движении, с")
+    avg_pace = models.FloatField(null=True, blank=True, help_text="Средний темп, с/км")
+    # Считается по треку при завершении забега
+    best_5k_time = models.FloatField(null=True, blank=True, help_text="Самые быстрые 5 км подряд, с")
+    min_latitude = models.DecimalField(max_digits=6, decimal_places=4, null=True, blank=True)
+    max_latitude = models.DecimalField(max_digits=6, decimal_places=4, null=True, blank=True)
+    min_longitude = models.DecimalField(max_digits=6, decimal_places=4, null=True, blank=True)
+    max_longitude = models.DecimalField(max_digits=6, decimal_places=4, null=True, blank=True)
+
+    # Последняя точка трека, от нее считается следующий отрезок
+    last_latitude = models.DecimalField(max_digits=6, decimal_places=4, null=True, blank=True)
+    last_longitude = models.DecimalField(max_digits=6, decimal_places=4, null=True, blank=True)
+    last_position_at = models.DateTimeField(null=True, blank=True)
+
+    # Упакованная копия трека завершенного забега для чтения целиком (см. app_run.track.compact_run)
+    track = models.BinaryField(null=True, blank=True)
+
+    # Время последнего изменения для синхронизации (app_run.sync); UPDATE мимо save() ставит его сам
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Изменения забегов спортсмена с момента прошлой синхронизации
+            models.Index(fields=['athlete', 'updated_at'], name='run_athlete_updated_idx'),
+            # Забеги спортсмена с фильтром по статусу и сортировкой по дате
+            models.Index(fields=['athlete', 'status', 'created_at'], name='run_athlete_status_idx'),
+            # Завершенные забеги спортсмена (подсчет и выборка)
+            models.Index(fields=['athlete'], condition=Q(status='finished'), name='run_finished_athlete_idx'),
+            # Курсорная пагинация списка забегов
+            models.Index(fields=['created_at', 'id'], name='run_created_id_idx'),
+        ]
+
+    @classmethod
+    def apply_transition(cls, run_id, action):
+        """
+        Переводит забег в новый статус условным UPDATE ... WHERE id = ? AND status = ?,
+        поэтому из двух параллельных запросов переход выполнит только один.
+        Возвращает обновленный забег (без поля track) или None, если переход невозможен.
+        """
+        from_status, to_status = cls.TRANSITIONS[action]
+        using = router.db_for_write(cls)
+        connection = connections[using]
+
+        updated_at = timezone.now()
+
+        if not supports_update_returning(connection):
+            updated = cls.objects.using(using).filter(pk=run_id, status=from_status).update(
+                status=to_status, updated_at=updated_at
+            )
+            return cls.objects.using(using).defer('track').get(pk=run_id) if updated else None
+
+        # Новое состояние забирается тем же запросом через RETURNING
+        fields = [field for field in cls._meta.concrete_fields if field.name != 'track']
+        quote_name = connection.ops.quote_name
+        updated_at_field = cls._meta.get_field('updated_at')
+        sql = (
+            f"UPDATE {quote_name(cls._meta.db_table)} "
+            f"SET {quote_name('status')} = %s, {quote_name(updated_at_field.column)} = %s "
+            f"WHERE {quote_name('id')} = %s AND {quote_name('status')} = %s "
+            f"RETURNING {', '.join(quote_name(field.column) for field in fields)}"
+        )
+        params = [to_status, updated_at_field.get_db_prep_value(updated_at, connection), run_id, from_status]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+
+        values = []
+        for field, value in zip(fields, row):
+            column = field.get_col(cls._meta.db_table)
+            for converter in connection.ops.get_db_converters(column) + column.get_db_converters(connection):
+                value = converter(value, column, connection)
+            values.append(value)
+        return cls.from_db(using, [field.attname for field in fields], values)
+
 
 class AthleteInfo(models.Model):
     user = models.OneToOneField(
@@ -27,6 +124,20 @@ class AthleteInfo(models.Model):
     goals = models.TextField(blank=True, default='')
     weight = models.IntegerField(null=True, blank=True)
 
+    # Денормализованные счетчики забегов, меняются вместе со статусом забега (см. app_run.counters)
+    runs_total = models.PositiveIntegerField(default=0)
+    runs_in_progress = models.PositiveIntegerField(default=0)
+    runs_finished = models.PositiveIntegerField(default=0)
+
+    # Накопленные показатели по завершенным забегам для челленджей (см. app_run.challenges)
+    total_distance = models.FloatField(default=0, help_text="Суммарная дистанция, м")
+    current_streak_days = models.PositiveIntegerField(default=0)
+    best_streak_days = models.PositiveIntegerField(default=0)
+    last_run_date = models.DateField(null=True, blank=True)
+    best_5k_time = models.FloatField(null=True, blank=True, help_text="Лучшее время на 5 км, с")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
     class Meta:
         verbose_name_plural = 'Athletes Info'
 
@@ -34,12 +145,92 @@ class AthleteInfo(models.Model):
         return f"Athlete info for {self.user.username}"
 
 
+class ActivityRollup(models.Model):
+    """Итоги завершенных забегов спортсмена за день, неделю или месяц (см. app_run.rollups)."""
+
+    BUCKET_CHOICES = [
+        ('day', 'День'),
+        ('week', 'Неделя'),
+        ('month', 'Месяц'),
+    ]
+
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_rollups')
+    bucket = models.CharField(max_length=5, choices=BUCKET_CHOICES)
+    # Первый день периода: для недели понедельник, для месяца первое число
+    period_start = models.DateField()
+    runs = models.PositiveIntegerField(default=0)
+    distance = models.FloatField(default=0, help_text="Дистанция, м")
+    moving_time = models.FloatField(default=0, help_text="Время в движении, с")
+
+    class Meta:
+        unique_together = ('athlete', 'bucket', 'period_start')
+
+    def __str__(self):
+        return f"{self.athlete_id} {self.bucket} {self.period_start}"
+
+
+class LeaderboardEntry(models.Model):
+    """Очки спортсмена в рейтинге за все время или за месяц (см. app_run.leaderboards)."""
+
+    BOARD_CHOICES = [
+        ('runs', 'Завершенные забеги'),
+        ('distance', 'Дистанция'),
+    ]
+    ALL_TIME = 'all'
+
+    board = models.CharField(max_length=10, choices=BOARD_CHOICES)
+    # 'all' или месяц в виде 'YYYY-MM'
+    period = models.CharField(max_length=7, default=ALL_TIME)
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('board', 'period', 'athlete')
+        indexes = [
+            # Порядок рейтинга: top N и место спортсмена читаются по индексу, без сортировки таблицы
+            models.Index(fields=['board', 'period', '-score', 'athlete'], name='leaderboard_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.board} {self.period}: {self.athlete_id} = {self.score}"
+
+
 class Challenge(models.Model):
     full_name = models.CharField(max_length=250)
     athlete = models.ForeignKey(User, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['full_name', 'athlete']
+        indexes = [
+            models.Index(fields=['athlete', 'updated_at'], name='challenge_athlete_updated_idx'),
+        ]
+
+
+class Tombstone(models.Model):
+    """Отметка об удалении забега или челленджа: синхронизация отдает клиенту id удаленных строк."""
+
+    KIND_CHOICES = [
+        ('run', 'Забег'),
+        ('challenge', 'Челлендж'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # Без ограничения в БД: отметка переживает удаление самого спортсмена, старые чистит prune_tombstones
+    athlete = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['athlete', 'deleted_at'], name='tombstone_athlete_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted at {self.deleted_at}"
 
 
 class Position(models.Model):
@@ -56,7 +247,56 @@ class Position(models.Model):
         validators=[validate_coordinate],
         help_text="Долгота: от -90.0000 до 90.0000"
     )
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Время фиксации точки: при пакетной загрузке приходит с устройства
+    created_at = models.DateTimeField(default=timezone.now)
+    # Ячейка geohash точки: поиск по области идёт диапазонами по префиксу
+    geohash = models.CharField(max_length=12, blank=True, default='')
+    # Считаются при загрузке от предыдущей точки забега (см. app_run.metrics.update_run_metrics)
+    speed = models.FloatField(null=True, blank=True, help_text="Мгновенная скорость, м/с")
+    distance = models.FloatField(null=True, blank=True, help_text="Дистанция от начала забега, м")
+
+    class Meta:
+        indexes = [
+            # Трек забега по времени, в том числе курсорная пагинация по (-created_at, -id)
+            models.Index(fields=['run', 'created_at', 'id'], name='position_run_created_idx'),
+            models.Index(fields=['geohash'], name='position_geohash_idx'),
+            # Границы сплитов: первая точка не ближе N метров от старта ищется по индексу
+            models.Index(fields=['run', 'distance'], name='position_run_distance_idx'),
+        ]
 
     def __str__(self):
         return f"({self.latitude}, {self.longitude})"
+
+    def fill_geohash(self):
+        self.geohash = geohash_encode(self.latitude, self.longitude)
+        return self
+
+    def save(self, *args, **kwargs):
+        # bulk_create save() не вызывает, поэтому пакетная загрузка заполняет geohash сама
+        self.fill_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
+
+class ImportedFile(models.Model):
+    """Файл архива, загруженный командой import_runs: повторный запуск пропускает его (см. app_run.importer)."""
+
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # Удаление забега снимает отметку, и файл можно загрузить снова
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, related_name='imported_file')
+    path = models.TextField()
+    size = models.BigIntegerField()
+    # sha256 содержимого: тот же файл под другим именем повторно не загружается
+    digest = models.CharField(max_length=64)
+    points = models.PositiveIntegerField()
+    imported_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['athlete', 'digest'], name='imported_file_athlete_digest_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.path} -> run {self.run_id}"
@@ -0,0 +1,32 @@
+from django.db.migrations.operations import AddIndex
+
+
+class AddIndexConcurrentlyIfSupported(AddIndex):
+    """
+    AddIndex, который на PostgreSQL строит индекс через CREATE INDEX CONCURRENTLY,
+    не блокируя запись в таблицу. На остальных СУБД (локальный SQLite) работает как обычный AddIndex.
+    Миграция с этой операцией должна быть atomic = False.
+    """
+
+    def _concurrently(self, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return {}
+        if schema_editor.connection.in_atomic_block:
+            raise TypeError(
+                f"The {self.__class__.__name__} operation cannot be executed inside a transaction "
+                f"(set atomic = False on the migration)."
+            )
+        return {'concurrently': True}
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, **self._concurrently(schema_editor))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, **self._concurrently(schema_editor))
+
+    def describe(self):
+        return super().describe() + " (concurrently on PostgreSQL)"
@@ -0,0 +1,149 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def continuation_link(request, view, value, pk):
+    """
+    Ссылка на продолжение обрезанного списка без пагинации: курсорная страница (KeysetPagination) после
+    последней отданной записи с ключом (value, pk). Списки вьюсетов с keyset_ordering без параметра
+    ordering отсортированы по ключу курсора, поэтому продолжение начинается ровно там, где обрезан ответ;
+    для остальных списков None.
+    """
+    if getattr(view, 'keyset_ordering', None) is None or 'ordering' in request.query_params:
+        return None
+    url = replace_query_param(
+        request.build_absolute_uri(), KeysetPagination.cursor_query_param, encode_cursor(value, pk)
+    )
+    return replace_query_param(url, ConditionalPagination.page_size_query_param, settings.UNPAGINATED_RESULTS_LIMIT)
+
+
+def truncation_headers(next_link=None):
+    """
+    Заголовки ответа без пагинации, обрезанного до UNPAGINATED_RESULTS_LIMIT записей: X-Truncated,
+    X-Result-Limit и, если список можно продолжить, Link rel="next" (continuation_link).
+    """
+    headers = {'X-Truncated': 'true', 'X-Result-Limit': str(settings.UNPAGINATED_RESULTS_LIMIT)}
+    if next_link is not None:
+        headers['Link'] = f'<{next_link}>; rel="next"'
+    return headers
+
+
+class ConditionalPagination(PageNumberPagination):
+    page_size = 10  # Значение по умолчанию
+    page_size_query_param = 'size'
+    page_query_param = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginated = 'size' in request.query_params
+        # Включаем пагинацию только если указан параметр size
+        if self.paginated:
+            return super().paginate_queryset(queryset, request, view)
+        # Без пагинации отдаем не больше жесткого лимита записей; лишняя запись показывает, что ответ обрезан
+        limit = settings.UNPAGINATED_RESULTS_LIMIT
+        rows = list(queryset[:limit + 1])
+        self.headers = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_link = None
+            if getattr(view, 'keyset_ordering', None) is not None:
+                value = getattr(last, view.keyset_ordering[0].lstrip('-')).isoformat()
+                next_link = continuation_link(request, view, value, last.pk)
+            self.headers = truncation_headers(next_link)
+        return rows[:limit]
+
+    def get_paginated_response(self, data):
+        if not self.paginated:
+            return Response(data, headers=self.headers)
+        return super().get_paginated_response(data)
+
+
+class KeysetPagination(ConditionalPagination):
+    """
+    Курсорная пагинация по паре (поле времени, id) из view.keyset_ordering, например ('-created_at', '-id').
+    Следующая страница выбирается условием по ключу последней записи, без COUNT и OFFSET,
+    поэтому стоимость запроса не зависит от глубины страницы и размера таблицы.
+    Включается параметром cursor (пустой cursor — первая страница).
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.ordering = view.keyset_ordering
+        self.descending = self.ordering[0].startswith('-')
+        self.field = self.ordering[0].lstrip('-')
+        size = self.get_page_size(request)
+        position = self.decode_cursor(request.query_params[self.cursor_query_param])
+
+        if isinstance(queryset, list):
+            # Уже загруженные записи (например, распакованный трек) отсортированы так же
+            page = [obj for obj in queryset if position is None or self.is_after(obj, position)][:size + 1]
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if position is not None:
+                value, pk = position
+                lookup = 'lt' if self.descending else 'gt'
+                queryset = queryset.filter(
+                    Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'pk__{lookup}': pk})
+                )
+            page = list(queryset[:size + 1])
+
+        self.has_next = len(page) > size
+        page = page[:size]
+        self.last = page[-1] if page else None
+        return page
+
+    def is_after(self, obj, position):
+        key = (getattr(obj, self.field), obj.pk)
+        return key < position if self.descending else key > position
+
+    def encode_cursor(self, obj):
+        return encode_cursor(getattr(obj, self.field).isoformat(), obj.pk)
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value = parse_datetime(value)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or not isinstance(pk, int):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
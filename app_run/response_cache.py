@@ -0,0 +1,179 @@
+"""
+Кеш готовых ответов GET для списков, которые читаются намного чаще, чем меняются.
+
+Ключ ответа - эндпоинт, нормализованные параметры запроса и текущие поколения его областей:
+общей (все забеги) и спортсмена (забеги с ?athlete=<id>). Запись не ищет и не удаляет ключи,
+а после фиксации транзакции меняет поколения затронутых областей на время изменения, и старые
+ответы просто перестают находиться, вытесняясь из кеша по LRU. Ответ, прочитанный с реплики
+раньше DATABASE_REPLICA_LAG после изменения, не кешируется: реплика могла еще не получить запись. ETag ответа - тот же ключ,
+поэтому If-None-Match проверяется по одним поколениям, без обращения к БД и к самому ответу.
+
+Бэкенд - алиас RESPONSE_CACHE_ALIAS в CACHES: по умолчанию LocMemCache в памяти процесса,
+для нескольких воркеров нужен общий (Redis, Memcached), иначе запись в одном воркере
+не сбросит кеш других раньше RESPONSE_CACHE_TIMEOUT.
+"""
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from rest_framework.response import Response
+
+from app_run.routers import reading_from_replica
+
+
+# Заголовки ответа, которые хранятся в кеше вместе с телом: признаки обрезанного списка (app_run.pagination)
+CACHED_HEADERS = ('Link', 'X-Truncated', 'X-Result-Limit')
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _generation_key(endpoint, athlete_id=None):
+    return f'gen:{endpoint}' if athlete_id is None else f'gen:{endpoint}:{athlete_id}'
+
+
+def _generations(keys):
+    cache = _cache()
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # Начальное значение по времени: поколение, вытесненное из кеша, не начнется заново с уже
+            # использованного номера и не вернет старые ответы
+            cache.add(key, time.time_ns(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def _bump(keys):
+    # Поколение - время изменения в нс: по нему видно, успела ли реплика его получить
+    _cache().set_many({key: time.time_ns() for key in keys}, None)
+
+
+def invalidate(endpoint, *athlete_ids):
+    """Сбрасывает общие ответы эндпоинта и ответы по указанным спортсменам после фиксации транзакции."""
+    keys = [_generation_key(endpoint)]
+    keys.extend(_generation_key(endpoint, athlete_id) for athlete_id in set(athlete_ids) if athlete_id is not None)
+    transaction.on_commit(partial(_bump, keys))
+
+
+def _dirty_key(endpoint):
+    return f'dirty:{endpoint}'
+
+
+def _bump_live(endpoint, athlete_keys):
+    cache = _cache()
+    keys = list(athlete_keys)
+    # Общие ответы сбрасываются не чаще раза в RESPONSE_CACHE_LIVE_INTERVAL: add атомарен и пропускает
+    # только первую запись за интервал, остальные отмечают время первого несброшенного изменения
+    if cache.add(f'live:{endpoint}', 1, settings.RESPONSE_CACHE_LIVE_INTERVAL):
+        cache.delete(_dirty_key(endpoint))
+        keys.append(_generation_key(endpoint))
+    else:
+        cache.add(_dirty_key(endpoint), time.time_ns(), None)
+    _bump(keys)
+
+
+def invalidate_live(endpoint, *athlete_ids):
+    """
+    Сбрасывает ответы по указанным спортсменам сразу, а общие ответы - с задержкой не больше
+    RESPONSE_CACHE_LIVE_INTERVAL. Для частых изменений, которые не меняют состав общих списков
+    (метрики забега на трассе): каждая точка иначе сбрасывала бы общий список забегов.
+    """
+    keys = [_generation_key(endpoint, athlete_id) for athlete_id in set(athlete_ids) if athlete_id is not None]
+    transaction.on_commit(partial(_bump_live, endpoint, keys))
+
+
+def _flush_dirty(endpoint):
+    # Изменение, отложенное invalidate_live, сбрасывает общие ответы при чтении, как только ему
+    # исполнился интервал: последняя точка забега не ждет следующей записи
+    cache = _cache()
+    dirty_since = cache.get(_dirty_key(endpoint))
+    if dirty_since is not None and time.time_ns() - dirty_since >= settings.RESPONSE_CACHE_LIVE_INTERVAL * 10 ** 9:
+        cache.delete(_dirty_key(endpoint))
+        _bump([_generation_key(endpoint)])
+
+
+def _normalized_params(request):
+    return '&'.join(
+        f'{name}={value}'
+        for name in sorted(request.query_params)
+        for value in sorted(request.query_params.getlist(name))
+    )
+
+
+def cached_response(request, endpoint, render, athlete_id=None):
+    """
+    Ответ из кеша или render() с сохранением в кеш. Кешируются только успешные GET в JSON:
+    обзорный HTML-рендерер DRF зависит от пользователя и формы, а ошибки не стоят места в кеше.
+    """
+    if (
+        not settings.RESPONSE_CACHE_ENABLED
+        or request.method != 'GET'
+        or request.accepted_renderer.format != 'json'
+    ):
+        return render()
+
+    if athlete_id is None:
+        _flush_dirty(endpoint)
+    generations = _generations([_generation_key(endpoint, athlete_id)])
+    if reading_from_replica() and time.time_ns() - max(generations) < settings.DATABASE_REPLICA_LAG * 10 ** 9:
+        return render()
+    # Адрес с хостом входит в ключ: в ответе бывают абсолютные ссылки пагинации и id из пути
+    url = request.build_absolute_uri(request.path)
+    raw_key = f'{endpoint}|{url}|{request.accepted_media_type}|{_normalized_params(request)}|{generations}'
+    digest = hashlib.md5(raw_key.encode(), usedforsecurity=False).hexdigest()
+    etag = f'"{digest}"'
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    cache = _cache()
+    key = f'response:{endpoint}:{digest}'
+    cached = cache.get(key)
+    if cached is not None:
+        content, content_type, headers = cached
+        return HttpResponse(content, content_type=content_type, headers={**headers, 'ETag': etag})
+
+    response = render()
+    if response.status_code != 200 or response.streaming:
+        return response
+    headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+    if isinstance(response, Response):
+        # Рендерим тем же рендерером, что выбрал DRF, чтобы закешировать готовые байты
+        response = HttpResponse(
+            request.accepted_renderer.render(response.data, request.accepted_media_type, {'request': request}),
+            content_type=f'{request.accepted_media_type}; charset=utf-8'
+            if request.accepted_renderer.charset else request.accepted_media_type,
+            headers=headers,
+        )
+    cache.set(key, (response.content, response['Content-Type'], headers), settings.RESPONSE_CACHE_TIMEOUT)
+    response['ETag'] = etag
+    return response
+
+
+class CachedListMixin:
+    """
+    Кеширует list() вьюсета. cache_athlete_param - параметр фильтра по спортсмену:
+    такие ответы зависят только от поколения спортсмена и не сбрасываются записями других.
+    """
+    cache_endpoint = None
+    cache_athlete_param = None
+
+    def list(self, request, *args, **kwargs):
+        athlete_id = None
+        if self.cache_athlete_param:
+            value = request.query_params.get(self.cache_athlete_param, '')
+            athlete_id = int(value) if value.isdigit() else None
+        return cached_response(
+            request,
+            self.cache_endpoint,
+            partial(super().list, request, *args, **kwargs),
+            athlete_id=athlete_id,
+        )
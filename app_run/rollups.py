@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from app_run.models import Run, ActivityRollup
+from app_run.upserts import increment_or_create
+
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def period_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def add_run_to_rollups(run, sign=1):
+    """
+    Добавляет завершенный забег во все периоды (или вычитает при sign=-1) через UPDATE ... SET x = x + delta.
+    Забег относится к дню своего создания, так же считает и rebuild_rollups.
+    """
+    day = timezone.localdate(run.created_at)
+    deltas = {'runs': sign, 'distance': sign * run.distance, 'moving_time': sign * run.moving_time}
+    values = {field: F(field) + delta for field, delta in deltas.items()}
+    for bucket in BUCKETS:
+        lookup = {'athlete_id': run.athlete_id, 'bucket': bucket, 'period_start': period_start(day, bucket)}
+        increment_or_create(ActivityRollup, lookup, values, deltas if sign > 0 else None)
+    if sign < 0:
+        # Опустевшие периоды удаляем, чтобы итоги совпадали с результатом rebuild_rollups
+        ActivityRollup.objects.filter(athlete_id=run.athlete_id, runs=0).delete()
+
+
+def rebuild_rollups(athlete_ids):
+    """Пересчитывает итоги спортсменов с нуля по завершенным забегам, группировка на стороне БД."""
+    ActivityRollup.objects.filter(athlete_id__in=athlete_ids).delete()
+    rollups = []
+    for bucket, trunc in BUCKETS.items():
+        rows = (
+            Run.objects
+            .filter(athlete_id__in=athlete_ids, status='finished')
+            .annotate(period_start=trunc('created_at', output_field=DateField()))
+            .values('athlete_id', 'period_start')
+            .annotate(runs=Count('id'), distance=Sum('distance'), moving_time=Sum('moving_time'))
+            .order_by()
+        )
+        rollups.extend(ActivityRollup(bucket=bucket, **row) for row in rows)
+    ActivityRollup.objects.bulk_create(rollups, batch_size=5000)
+    return rollups
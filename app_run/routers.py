@@ -0,0 +1,74 @@
+"""
+Чтение с реплик БД для тяжелых GET-эндпоинтов.
+
+ReplicaRoutingMiddleware открывает на время запроса состояние маршрутизации (ContextVar), а
+ReplicaRouter по нему решает, куда идут чтения. С реплики читают только безопасные запросы
+к представлениям с replica_reads = True, и только если клиент недавно ничего не записывал:
+после записи он READ_YOUR_WRITES_WINDOW секунд читает из основной БД (метка в cookie),
+иначе мог бы не увидеть собственные изменения из-за отставания реплики. Внутри транзакции
+и после первой записи в том же запросе чтения тоже идут в основную БД.
+
+Реплики - алиасы DATABASE_REPLICAS, объявленные в DATABASES; если их нет, все запросы идут в default.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class RoutingState:
+    def __init__(self):
+        # Чтения с реплики разрешены (решает middleware по представлению и cookie клиента)
+        self.use_replica = False
+        # В запросе уже была запись: дальше он читает из основной БД
+        self.wrote = False
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASE_REPLICAS if alias in settings.DATABASES]
+
+
+def start_request():
+    """Новое состояние маршрутизации на время запроса: (состояние, токен для end_request)."""
+    state = RoutingState()
+    return state, _state.set(state)
+
+
+def end_request(token):
+    _state.reset(token)
+
+
+def reading_from_replica():
+    state = _state.get()
+    return state is not None and state.use_replica and not state.wrote and bool(replica_aliases())
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not reading_from_replica() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replica_aliases())
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        # Явно: иначе Django запишет объект, прочитанный с реплики, туда же, откуда он прочитан
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема приходит на реплики вместе с репликацией
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
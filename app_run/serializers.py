@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 
 from rest_framework import serializers
 
-from app_run.models import Run, AthleteInfo, Challenge, Position
+from app_run.metrics import SPLIT_UNITS
+from app_run.models import Run, AthleteInfo, Challenge, Position, ActivityRollup, LeaderboardEntry
+from app_run.sync import decode_token
 from app_run.validators import validate_coordinate
 
 
@@ -17,7 +20,18 @@ class RunSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Run
-        fields = '__all__'
+        exclude = ['last_latitude', 'last_longitude', 'last_position_at', 'track', 'best_5k_time']
+        read_only_fields = [
+            'distance', 'moving_time', 'avg_pace',
+            'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude',
+        ]
+
+    def validate_status(self, value):
+        # Смена статуса - это старт или финиш забега со счетчиками, итогами и рейтингами,
+        # поэтому она идет только через /start/ и /stop/, а не через PATCH
+        if self.instance is not None and value != self.instance.status:
+            raise serializers.ValidationError("Status can only be changed via /start/ and /stop/.")
+        return value
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -34,13 +48,15 @@ class UserSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_runs_finished(obj):
-        if hasattr(obj, 'finished_runs_count'):
-            return obj.finished_runs_count
-        return obj.run_set.filter(status='finished').count()
+        if hasattr(obj, 'runs_finished'):
+            return obj.runs_finished
+        athlete_info = getattr(obj, 'athlete_info', None)
+        return athlete_info.runs_finished if athlete_info else 0
 
 
 class AthleteInfoSerializer(serializers.ModelSerializer):
-    user_id = serializers.IntegerField(source='user.id', read_only=True)
+    # Берется из user_id самой записи, без отдельного запроса пользователя
+    user_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = AthleteInfo
@@ -55,6 +71,13 @@ class AthleteInfoSerializer(serializers.ModelSerializer):
                 )
         return value
 
+    def update(self, instance, validated_data):
+        # Сохраняем только переданные поля, чтобы не затереть счетчики забегов
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
 
 class ChallengeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -62,10 +85,27 @@ class ChallengeSerializer(serializers.ModelSerializer):
         fields = ['full_name', 'athlete']
 
 
+class ChallengeSyncSerializer(ChallengeSerializer):
+    class Meta(ChallengeSerializer.Meta):
+        fields = ['id', *ChallengeSerializer.Meta.fields, 'updated_at']
+
+
+class SyncQuerySerializer(serializers.Serializer):
+    token = serializers.CharField(required=False)
+
+    @staticmethod
+    def validate_token(value):
+        try:
+            return decode_token(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid sync token")
+
+
 class PositionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Position
-        fields = ['id', 'run', 'latitude', 'longitude', 'created_at']
+        fields = ['id', 'run', 'latitude', 'longitude', 'created_at', 'speed', 'distance']
+        read_only_fields = ['created_at', 'speed', 'distance']
 
     @staticmethod
     def validate_run(value):
@@ -80,3 +120,69 @@ class PositionSerializer(serializers.ModelSerializer):
     @staticmethod
     def validate_longitude(value):
         return validate_coordinate(value)
+
+
+class PositionPointSerializer(PositionSerializer):
+    """Одна точка без забега в теле (забег из адреса): время, как у PositionSerializer, ставит сервер."""
+    class Meta(PositionSerializer.Meta):
+        fields = ['latitude', 'longitude']
+        read_only_fields = []
+
+
+class PositionBulkItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Position
+        fields = ['latitude', 'longitude', 'created_at']
+
+
+class TrackSimplifySerializer(serializers.Serializer):
+    tolerance = serializers.FloatField(required=False, min_value=0)
+    max_points = serializers.IntegerField(required=False, min_value=2)
+
+
+class RunSplitsQuerySerializer(serializers.Serializer):
+    unit = serializers.ChoiceField(choices=list(SPLIT_UNITS), default='km')
+
+
+class NearbySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(default=1000, min_value=1, max_value=settings.NEARBY_MAX_RADIUS)
+    active = serializers.BooleanField(default=False)
+    since = serializers.DateTimeField(required=False)
+
+
+class ActivityRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ActivityRollup
+        fields = ['period_start', 'runs', 'distance', 'moving_time']
+
+
+class ActivityStatsQuerySerializer(serializers.Serializer):
+    bucket = serializers.ChoiceField(choices=ActivityRollup.BUCKET_CHOICES, default='week')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # from - ключевое слово, объявить поле атрибутом класса нельзя
+        self.fields['from'] = serializers.DateField(required=False)
+        self.fields['to'] = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if 'from' in attrs and 'to' in attrs and attrs['from'] > attrs['to']:
+            raise serializers.ValidationError("'from' must not be later than 'to'.")
+        return attrs
+
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    athlete_data = UserNestedSerializer(source='athlete', read_only=True)
+
+    class Meta:
+        model = LeaderboardEntry
+        fields = ['athlete', 'athlete_data', 'score']
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    period = serializers.RegexField(r'^(all|\d{4}-(0[1-9]|1[0-2]))$', default=LeaderboardEntry.ALL_TIME)
+    top = serializers.IntegerField(default=10, min_value=1, max_value=100)
+    athlete = serializers.IntegerField(required=False)
+    around = serializers.IntegerField(default=5, min_value=0, max_value=50)
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app_run.models import Run, Challenge
+from app_run.response_cache import invalidate
+from app_run.sync import add_tombstone
+
+TOMBSTONE_KINDS = {
+    Run: 'run',
+    Challenge: 'challenge',
+}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Пользователей создают и правят и мимо API (админка, createsuperuser); вход меняет только last_login
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate('users')
+    if not created:
+        # Имя и фамилия спортсмена входят в athlete_data его забегов
+        invalidate('runs', instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Вместе с пользователем каскадно удаляются его забеги, челленджи и AthleteInfo
+    invalidate('users')
+    for endpoint in ('runs', 'challenges', 'athlete_info'):
+        invalidate(endpoint, instance.pk)
+
+
+@receiver(post_delete, sender=Run)
+@receiver(post_delete, sender=Challenge)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    # При удалении всего аккаунта синхронизировать уже некому
+    if isinstance(origin, User):
+        return
+    add_tombstone(TOMBSTONE_KINDS[sender], instance.pk, instance.athlete_id)
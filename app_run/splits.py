@@ -0,0 +1,76 @@
+from bisect import bisect_left
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q, Subquery
+
+from app_run.metrics import SPLIT_UNITS
+from app_run.models import Position
+from app_run.track import unpack_positions
+
+
+def _boundaries(total_distance, unit_length):
+    # Старт, каждая полная единица дистанции и финиш
+    return [index * unit_length for index in range(int(total_distance // unit_length) + 1)]
+
+
+def _points_from_rows(run, boundaries):
+    """
+    Первая точка не ближе каждой границы плюс последняя точка забега, одним запросом:
+    каждый подзапрос - поиск по индексу (run, distance), весь трек не читается.
+    """
+    track = Position.objects.filter(run_id=run.pk, distance__isnull=False)
+    lookups = [
+        Q(pk=Subquery(track.filter(distance__gte=boundary).order_by('distance').values('pk')[:1]))
+        for boundary in boundaries
+    ]
+    lookups.append(Q(pk=Subquery(track.order_by('-distance').values('pk')[:1])))
+    return list(
+        Position.objects
+        .filter(reduce(or_, lookups))
+        .order_by('distance', 'id')
+        .values_list('distance', 'created_at')
+    )
+
+
+def _points_from_track(positions, boundaries):
+    # Упакованный трек уже в памяти, границы находим бинарным поиском по накопленной дистанции
+    if not positions:
+        return []
+    distances = [position.distance for position in positions]
+    indexes = {bisect_left(distances, boundary) for boundary in boundaries}
+    indexes.add(len(positions) - 1)
+    return [
+        (positions[index].distance, positions[index].created_at)
+        for index in sorted(indexes) if index < len(positions)
+    ]
+
+
+def build_splits(points, unit_length):
+    """points: (накопленная дистанция, время) на границах сплитов по возрастанию дистанции."""
+    splits = []
+    for (start_distance, started_at), (end_distance, ended_at) in zip(points, points[1:]):
+        distance = end_distance - start_distance
+        if distance <= 0:
+            continue
+        elapsed = (ended_at - started_at).total_seconds()
+        splits.append({
+            'split': len(splits) + 1,
+            'distance': round(distance, 1),
+            'elapsed_time': elapsed,
+            # Темп в секундах на единицу сплита (км или милю)
+            'pace': round(elapsed / (distance / unit_length), 1),
+        })
+    return splits
+
+
+def run_splits(run, unit='km'):
+    """Сплиты забега по уже посчитанной при загрузке дистанции точек (run с полями distance и track)."""
+    unit_length = SPLIT_UNITS[unit]
+    if run.track is not None:
+        positions = unpack_positions(run.pk, run.track)
+        boundaries = _boundaries(positions[-1].distance if positions else 0, unit_length)
+        points = _points_from_track(positions, boundaries)
+    else:
+        points = _points_from_rows(run, _boundaries(run.distance, unit_length))
+    return build_splits(points, unit_length)
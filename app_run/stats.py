@@ -0,0 +1,5 @@
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга: значение из самой выборки, без интерполяции."""
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
@@ -0,0 +1,80 @@
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app_run.models import Run, Challenge, AthleteInfo, Tombstone
+
+# Токен синхронизации - закодированная граница по времени изменения; клиент хранит его как есть
+TOKEN_VERSION = 1
+
+# Ключ списка удаленных id в ответе по виду отметки
+DELETED_KEYS = {
+    'run': 'runs',
+    'challenge': 'challenges',
+}
+
+
+def encode_token(moment):
+    return base64.urlsafe_b64encode(json.dumps([TOKEN_VERSION, moment.isoformat()]).encode()).decode()
+
+
+def decode_token(token):
+    """Граница из токена; ValueError, если токен поврежден или от другой версии формата."""
+    try:
+        version, value = json.loads(base64.urlsafe_b64decode(token.encode()))
+        moment = parse_datetime(value)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError(token)
+    if version != TOKEN_VERSION or moment is None:
+        raise ValueError(token)
+    return moment
+
+
+def token_expired(since):
+    # Отметки об удалении старше срока хранения уже удалены, такой клиент должен загрузить все заново
+    return since < timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+
+
+def add_tombstone(kind, object_id, athlete_id):
+    Tombstone.objects.create(kind=kind, object_id=object_id, athlete_id=athlete_id)
+
+
+def collect_changes(athlete_id, since=None):
+    """
+    Строки спортсмена, созданные, измененные или удаленные после since (все строки, если since нет),
+    и токен для следующего вызова. Каждая выборка идет по индексу (athlete, updated_at / deleted_at),
+    поэтому стоимость зависит от числа изменений, а не от истории спортсмена.
+
+    Граница нового токена отстает от текущего времени на SYNC_SAFETY_MARGIN: время изменения
+    ставится до фиксации транзакции, и строка, зафиксированная позже чтения, попадет в следующий ответ.
+    Строки из этого окна клиент получит повторно, поэтому он должен применять их как upsert.
+    """
+    token = encode_token(timezone.now() - timedelta(seconds=settings.SYNC_SAFETY_MARGIN))
+
+    runs = Run.objects.filter(athlete_id=athlete_id).select_related('athlete').defer('track')
+    challenges = Challenge.objects.filter(athlete_id=athlete_id)
+    athlete_info = AthleteInfo.objects.filter(user_id=athlete_id)
+    deleted = Tombstone.objects.filter(athlete_id=athlete_id)
+    if since is None:
+        deleted = deleted.none()
+    else:
+        runs = runs.filter(updated_at__gt=since)
+        challenges = challenges.filter(updated_at__gt=since)
+        athlete_info = athlete_info.filter(updated_at__gt=since)
+        deleted = deleted.filter(deleted_at__gt=since)
+
+    deleted_ids = {key: [] for key in DELETED_KEYS.values()}
+    for kind, object_id in deleted.order_by('deleted_at').values_list('kind', 'object_id'):
+        deleted_ids[DELETED_KEYS[kind]].append(object_id)
+
+    return token, {
+        'runs': runs.order_by('updated_at', 'id'),
+        'challenges': challenges.order_by('updated_at', 'id'),
+        'athlete_info': athlete_info.first(),
+        'deleted': deleted_ids,
+    }
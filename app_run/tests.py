@@ -1,3 +1,887 @@
-from django.test import TestCase
+import asyncio
+import re
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app_run.benchmarks import seed_runs, seed_track
+from app_run.counters import rebuild_athlete_aggregates
+from app_run.filters import geohash_q
+from app_run.geo import bounding_box
+from app_run.ingest_filters import DuplicateRule, SpeedRule, StationaryRule, forget
+from app_run.leaderboards import month_period, ranked, rebuild_leaderboards, update_leaderboards
+from app_run.lean import LeanListMixin
+from app_run.management.commands.bench_api import ENDPOINTS, request, resolve, seed
+from app_run.metrics import SPLIT_UNITS, fastest_window_time
+from app_run.middleware import ReplicaRoutingMiddleware
+from app_run.models import (
+    Run, Challenge, Position, ActivityRollup, AthleteInfo, LeaderboardEntry, Tombstone, supports_update_returning,
+)
+from app_run.rollups import add_run_to_rollups, rebuild_rollups
+from app_run.routers import ReplicaRouter
+from app_run.sync import encode_token
+from app_run.track import compact_run, precompute_simplified_tracks
+from app_run.write_behind import DEAD_LETTER_NAME, write_points
+
+STARTED_AT = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+# Градус широты в метрах
+METERS_PER_DEGREE = 111_195
+
+
+# Признаки полного просмотра таблицы или отдельной сортировки в плане запроса
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (?!.*USING (COVERING )?INDEX)|TEMP B-TREE'),
+    'postgresql': re.compile(r'\bSeq Scan\b|^\s*(->\s*)?Sort\b', re.MULTILINE),
+}
+
+
+def hot_queries():
+    """Горячие запросы API: (название, queryset, ожидаемый индекс или None, если подходит любой)."""
+    return [
+        (
+            'трек забега (/api/positions/?run=)',
+            Position.objects.filter(run_id=1).order_by('-created_at', '-id'),
+            'position_run_created_idx',
+        ),
+        (
+            'забеги спортсмена по статусу (/api/runs/?athlete=&status=)',
+            Run.objects.filter(athlete_id=1, status='in_progress').order_by('created_at'),
+            'run_athlete_status_idx',
+        ),
+        (
+            'число завершенных забегов спортсмена',
+            Run.objects.filter(athlete_id=1, status='finished').values('pk'),
+            None,
+        ),
+        (
+            'курсорная страница забегов (/api/runs/?cursor=)',
+            Run.objects.filter(created_at__gt=datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+            .order_by('created_at', 'id')[:10],
+            'run_created_id_idx',
+        ),
+        (
+            'челленджи спортсмена (/api/challenges/?athlete=)',
+            Challenge.objects.filter(athlete_id=1),
+            None,
+        ),
+        (
+            'точки рядом (/api/positions/nearby/)',
+            Position.objects.filter(
+                geohash_q(*bounding_box(55.75, 37.61, 1000)),
+                created_at__gte=datetime(2025, 1, 1, tzinfo=dt_timezone.utc),
+            ).values_list('id', 'latitude', 'longitude'),
+            'position_geohash_idx',
+        ),
+        (
+            'граница сплита (/api/runs/<id>/splits/)',
+            Position.objects.filter(run_id=1, distance__gte=1000).order_by('distance')[:1],
+            'position_run_distance_idx',
+        ),
+        (
+            'изменения забегов (/api/users/<id>/sync/)',
+            Run.objects.filter(athlete_id=1, updated_at__gt=datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+            .order_by('updated_at', 'id'),
+            'run_athlete_updated_idx',
+        ),
+        (
+            'удаленные строки (/api/users/<id>/sync/)',
+            Tombstone.objects.filter(athlete_id=1, deleted_at__gt=datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+            .order_by('deleted_at'),
+            'tombstone_athlete_deleted_idx',
+        ),
+        (
+            'итоги спортсмена (/api/users/<id>/stats/)',
+            ActivityRollup.objects.filter(athlete_id=1, bucket='week', period_start__gte=date(2025, 1, 1))
+            .order_by('period_start'),
+            None,
+        ),
+        (
+            'top N рейтинга (/api/leaderboards/<board>/)',
+            ranked('distance', 'all')[:10],
+            'leaderboard_rank_idx',
+        ),
+        (
+            'место в рейтинге (/api/leaderboards/<board>/?athlete=)',
+            ranked('distance', 'all').filter(score__gt=1000).values('pk'),
+            'leaderboard_rank_idx',
+        ),
+    ]
+
+
+def point(seconds, north=0.0):
+    """Точка трека через seconds секунд после старта, в north метрах к северу от него (координаты с 4 знаками)."""
+    return {
+        'latitude': (Decimal('55.7500') + Decimal(north / METERS_PER_DEGREE)).quantize(Decimal('0.0001')),
+        'longitude': Decimal('37.6100'),
+        'created_at': STARTED_AT + timedelta(seconds=seconds),
+    }
+
+
+class DuplicateRuleTests(SimpleTestCase):
+    rule = DuplicateRule(window=1.0, distance=1.0)
+
+    def test_rejects_same_timestamp(self):
+        self.assertTrue(self.rule.rejects(point(10, north=50), [point(10)]))
+
+    def test_rejects_same_position_within_window(self):
+        self.assertTrue(self.rule.rejects(point(10.3, north=0.5), [point(10)]))
+
+    def test_accepts_next_fix_at_one_hertz(self):
+        # Бегун 3.3 м/с: после округления до 4 знаков соседние фиксы часто совпадают по координатам
+        self.assertFalse(self.rule.rejects(point(11, north=3.3), [point(10)]))
+
+    def test_accepts_new_position(self):
+        self.assertFalse(self.rule.rejects(point(10.5, north=20), [point(10)]))
+
+
+class SpeedRuleTests(SimpleTestCase):
+    rule = SpeedRule(max_speed=15.0)
+
+    def test_rejects_teleport(self):
+        self.assertTrue(self.rule.rejects(point(11, north=500), [point(10)]))
+
+    def test_accepts_running_speed(self):
+        self.assertFalse(self.rule.rejects(point(15, north=25), [point(10)]))
+
+    def test_accepts_first_point(self):
+        self.assertFalse(self.rule.rejects(point(10), []))
+
+    def test_accepts_late_point(self):
+        self.assertFalse(self.rule.rejects(point(5, north=500), [point(10)]))
+
+
+class StationaryRuleTests(SimpleTestCase):
+    rule = StationaryRule(speed=0.5, window=10.0, distance=10.0)
+
+    def test_rejects_jitter_while_standing(self):
+        recent = [point(0), point(1, north=3)]
+        self.assertTrue(self.rule.rejects(point(20, north=-4), recent))
+
+    def test_accepts_running_at_one_hertz(self):
+        recent = [point(second, north=3.3 * second) for second in range(11)]
+        self.assertFalse(self.rule.rejects(point(11, north=3.3 * 11), recent))
+
+    def test_accepts_slow_walk(self):
+        recent = [point(second, north=1.2 * second) for second in range(11)]
+        self.assertFalse(self.rule.rejects(point(11, north=1.2 * 11), recent))
+
+    def test_accepts_until_window_is_known(self):
+        # Начало забега: за window секунд точек еще нет, стоянку не определить
+        self.assertFalse(self.rule.rejects(point(3, north=2), [point(0), point(2, north=1)]))
+
+    def test_accepts_moving_off_after_stop(self):
+        self.assertFalse(self.rule.rejects(point(120, north=12), [point(0)]))
+
+    def test_moving_track_is_kept(self):
+        # Трек 300 фиксов с частотой 1 Гц и скоростью 3.3 м/с проходит все правила целиком
+        rules = [DuplicateRule(1.0, 1.0), SpeedRule(15.0), self.rule]
+        recent, kept = [], 0
+        for second in range(300):
+            candidate = point(second, north=3.3 * second)
+            if not any(rule.rejects(candidate, recent) for rule in rules):
+                recent.append(candidate)
+                kept += 1
+        self.assertEqual(kept, 300)
+
+
+class FastestWindowTests(SimpleTestCase):
+    @staticmethod
+    def track(*legs):
+        """Трек из отрезков (метров, секунд) с точкой каждые 100 м."""
+        distances, timestamps, distance, moment = [0.0], [STARTED_AT], 0.0, STARTED_AT
+        for meters, seconds in legs:
+            for _ in range(int(meters // 100)):
+                distance += 100
+                moment += timedelta(seconds=seconds * 100 / meters)
+                distances.append(distance)
+                timestamps.append(moment)
+        return distances, timestamps
+
+    def test_fast_second_half(self):
+        # 5 км за 30 минут, затем 5 км за 20: лучшее время - вторая половина, а не средний темп (25 минут)
+        self.assertAlmostEqual(fastest_window_time(*self.track((5000, 1800), (5000, 1200))), 1200)
+
+    def test_window_ends_inside_segment(self):
+        distances, timestamps = [0.0, 4000.0, 6000.0], [STARTED_AT + timedelta(seconds=s) for s in (0, 1000, 1400)]
+        self.assertAlmostEqual(fastest_window_time(distances, timestamps), 1200)
+
+    def test_short_track(self):
+        self.assertIsNone(fastest_window_time(*self.track((4900, 1500))))
+        self.assertIsNone(fastest_window_time([], []))
+
+
+class PositionCreateTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        # Окно фильтра живет в памяти процесса, а id забегов между тестами повторяются
+        self.addCleanup(forget, self.run.id)
+
+    def test_dropped_point_is_reported(self):
+        body = {'run': self.run.id, 'latitude': '55.7500', 'longitude': '37.6100'}
+        for url in ('/api/positions/', f'/api/async/runs/{self.run.id}/positions/'):
+            with self.subTest(url):
+                self.client.post(url, body, content_type='application/json')
+                repeat = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(repeat.status_code, 200)
+                self.assertEqual((repeat.json()['accepted'], repeat.json()['dropped']['duplicate']), (0, 1))
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 1)
+
+    def test_async_point_time_is_set_by_server(self):
+        body = {'latitude': '55.7500', 'longitude': '37.6100', 'created_at': '2020-01-01T00:00:00Z'}
+        response = self.client.post(f'/api/async/runs/{self.run.id}/positions/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        created_at = Position.objects.get(run=self.run).created_at
+        self.assertLess(timezone.now() - created_at, timedelta(minutes=1))
+
+    @override_settings(POSITIONS_WRITE_BEHIND=True)
+    def test_async_journal_write_leaves_event_loop(self):
+        loops = []
+
+        def append(positions):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+
+        url, body = f'/api/async/runs/{self.run.id}/positions/', {'latitude': '55.7500', 'longitude': '37.6100'}
+        with mock.patch('app_run.async_views.get_buffer') as get_buffer:
+            get_buffer.return_value.append.side_effect = append
+            response = self.client.post(url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        # Журнал пишется в потоке без event loop
+        self.assertEqual(loops, [None])
+
+    def test_late_point_keeps_metrics(self):
+        url = f'/api/runs/{self.run.id}/positions/bulk/'
+        self.client.post(url, [point(0), point(10, north=40)], content_type='application/json')
+        before = Run.objects.get(pk=self.run.id)
+        self.client.post(url, [point(5, north=500)], content_type='application/json')
+
+        run = Run.objects.get(pk=self.run.id)
+        self.assertEqual(
+            (run.distance, run.moving_time, run.last_position_at),
+            (before.distance, before.moving_time, before.last_position_at),
+        )
+        late = Position.objects.get(run=self.run, created_at=STARTED_AT + timedelta(seconds=5))
+        self.assertEqual((late.speed, late.distance), (None, None))
+
+
+class RunUpdateTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+
+    def patch(self, body):
+        return self.client.patch(f'/api/runs/{self.run.id}/', body, content_type='application/json')
+
+    def test_status_change_is_rejected(self):
+        response = self.patch({'status': 'finished'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+        self.assertEqual(Run.objects.get(pk=self.run.id).status, 'in_progress')
+
+    def test_other_fields_are_updated(self):
+        response = self.patch({'status': 'in_progress', 'comment': 'Интервалы'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Run.objects.get(pk=self.run.id).comment, 'Интервалы')
+
+
+class FinishedRunRemovalTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.addCleanup(forget, self.run.id)
+        track = [point(0), point(600, north=2000)]
+        self.client.post(f'/api/runs/{self.run.id}/positions/bulk/', track, content_type='application/json')
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+
+    def assertNothingLeft(self, athlete_id):
+        info = AthleteInfo.objects.get(user_id=athlete_id)
+        self.assertEqual(
+            (info.runs_finished, info.total_distance, info.current_streak_days, info.best_streak_days),
+            (0, 0, 0, 0),
+        )
+        self.assertFalse(ActivityRollup.objects.filter(athlete_id=athlete_id).exists())
+        self.assertFalse(LeaderboardEntry.objects.filter(athlete_id=athlete_id, score__gt=0).exists())
+
+    def test_delete_reverses_aggregates(self):
+        self.assertGreater(AthleteInfo.objects.get(user_id=self.athlete.id).total_distance, 0)
+        self.client.delete(f'/api/runs/{self.run.id}/')
+        self.assertNothingLeft(self.athlete.id)
+
+    def test_reassign_moves_aggregates(self):
+        other = User.objects.create(username='other')
+        response = self.client.patch(
+            f'/api/runs/{self.run.id}/', {'athlete': other.id}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNothingLeft(self.athlete.id)
+
+        info = AthleteInfo.objects.get(user_id=other.id)
+        self.assertEqual((info.runs_finished, info.best_streak_days), (1, 1))
+        self.assertAlmostEqual(info.total_distance, Run.objects.get(pk=self.run.id).distance)
+        self.assertEqual(ActivityRollup.objects.filter(athlete_id=other.id, bucket='day').get().runs, 1)
+
+
+class StreakDateTests(TestCase):
+    def test_finish_and_rebuild_use_run_start_date(self):
+        athlete = User.objects.create(username='runner')
+        run = Run.objects.create(athlete=athlete, status='in_progress')
+        self.addCleanup(forget, run.id)
+        started_at = timezone.now() - timedelta(days=1)
+        Run.objects.filter(pk=run.id).update(created_at=started_at)
+        self.client.post(f'/api/runs/{run.id}/stop/')
+
+        fields = ['last_run_date', 'current_streak_days', 'best_streak_days']
+        finished = AthleteInfo.objects.values(*fields).get(user_id=athlete.id)
+        self.assertEqual(finished['last_run_date'], timezone.localdate(started_at))
+        rebuild_athlete_aggregates([athlete.id])
+        self.assertEqual(AthleteInfo.objects.values(*fields).get(user_id=athlete.id), finished)
+
+
+@override_settings(RUN_TRACK_COMPACTION=True, TRACK_SIMPLIFY_TOLERANCES=[])
+class CompactedRunTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        self.addCleanup(forget, self.run.id)
+        track = [point(0), point(600, north=2000)]
+        self.client.post(f'/api/runs/{self.run.id}/positions/bulk/', track, content_type='application/json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.first = Position.objects.filter(run=self.run).earliest('created_at')
+
+    def test_track_is_packed(self):
+        self.assertIsNotNone(Run.objects.get(pk=self.run.id).track)
+        response = self.client.get('/api/positions/', {'run': self.run.id})
+        self.assertEqual([item['id'] for item in response.json()][-1], self.first.id)
+
+    def test_position_reads(self):
+        self.assertEqual(self.client.get(f'/api/positions/{self.first.id}/').status_code, 200)
+        self.assertIn(self.first.id, [item['id'] for item in self.client.get('/api/positions/').json()])
+        params = {'lat': 55.75, 'lon': 37.61, 'radius': 100, 'since': '2023-12-31T00:00:00Z'}
+        nearby = self.client.get('/api/positions/nearby/', params)
+        self.assertEqual([item['id'] for item in nearby.json()], [self.first.id])
+
+    def test_bbox_checks_points(self):
+        # Обе области пересекают рамку забега, но точка есть только в первой
+        for bbox, expected in (('37.60,55.749,37.62,55.751', [self.run.id]), ('37.60,55.755,37.62,55.76', [])):
+            with self.subTest(bbox):
+                response = self.client.get('/api/runs/', {'bbox': bbox})
+                self.assertEqual([item['id'] for item in response.json()], expected)
+
+    def test_position_edit_drops_packed_track(self):
+        response = self.client.patch(
+            f'/api/positions/{self.first.id}/', {'latitude': '55.7490'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(Run.objects.get(pk=self.run.id).track)
+
+    def test_rows_deleted_by_old_compaction_are_restored(self):
+        rows = list(Position.objects.filter(run=self.run).values_list('id', 'geohash', 'distance'))
+        Position.objects.filter(run=self.run).delete()
+        call_command('compact_runs', '--restore-rows', stdout=StringIO())
+        self.assertCountEqual(Position.objects.filter(run=self.run).values_list('id', 'geohash', 'distance'), rows)
+
+
+class ApplyTransitionTests(TestCase):
+    def test_update_returning_only_where_supported(self):
+        for vendor, expected in (('postgresql', True), ('mysql', False), ('oracle', False)):
+            with self.subTest(vendor):
+                self.assertIs(supports_update_returning(mock.Mock(vendor=vendor)), expected)
+
+    def test_both_paths_return_updated_run(self):
+        athlete = User.objects.create(username='runner')
+        fields = ('status', 'comment', 'athlete_id', 'created_at', 'updated_at', 'min_latitude')
+        for returning in (True, False):
+            with self.subTest(returning=returning):
+                run = Run.objects.create(
+                    athlete=athlete, status='init', comment='Утро', min_latitude=Decimal('55.7500')
+                )
+                with mock.patch('app_run.models.supports_update_returning', return_value=returning):
+                    started = Run.apply_transition(run.id, 'start')
+                    self.assertIsNone(Run.apply_transition(run.id, 'start'))
+                stored = Run.objects.get(pk=run.id)
+                self.assertEqual(stored.status, 'in_progress')
+                for field in fields:
+                    self.assertEqual(getattr(started, field), getattr(stored, field), field)
+
+class LateWriteBehindFlushTests(TestCase):
+    def test_points_of_finished_run_go_to_dead_letter(self):
+        run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        track = [point(0), point(5, north=20)]
+        self.client.post(f'/api/runs/{run.id}/positions/bulk/', track, content_type='application/json')
+        self.client.post(f'/api/runs/{run.id}/stop/')
+        distance = Run.objects.get(pk=run.id).distance
+
+        # Буфер другого воркера сбрасывается уже после завершения забега
+        with tempfile.TemporaryDirectory() as directory, override_settings(POSITIONS_WRITE_BEHIND_DIR=directory):
+            rejected = write_points([(run.id, point(10, north=1000))])
+            dead_letter = (Path(directory) / DEAD_LETTER_NAME).read_text().splitlines()
+
+        self.assertEqual(rejected, 1)
+        self.assertEqual(len(dead_letter), 1)
+        self.assertEqual(Position.objects.filter(run=run).count(), 2)
+        self.assertEqual(Run.objects.get(pk=run.id).distance, distance)
+
+
+class LeanListTests(TestCase):
+    def test_matches_serializer_output(self):
+        athlete = User.objects.create(username='runner', first_name='Имя')
+        run = seed_runs([athlete], 3)[0]
+        seed_track(run, 50)
+        # Время без микросекунд и отрицательные координаты: их строки лёгкий путь формирует в SQL
+        other = seed_runs([athlete], 1)[0]
+        seed_track(other, 5, started_at=datetime(2024, 1, 1, 6, 30, tzinfo=dt_timezone.utc))
+        Position.objects.create(run=other, latitude=Decimal('-0.5'), longitude=Decimal('-73.0001'))
+
+        for url in (
+            f'/api/positions/?run={run.id}', f'/api/positions/?run={other.id}',
+            '/api/runs/', f'/api/runs/?athlete={athlete.id}',
+        ):
+            with self.subTest(url=url), override_settings(RESPONSE_CACHE_ENABLED=False):
+                with mock.patch.object(LeanListMixin, 'use_lean_list', return_value=False):
+                    expected = self.client.get(url).content
+                self.assertEqual(self.client.get(url).content, expected)
+
+
+@override_settings(UNPAGINATED_RESULTS_LIMIT=2)
+class TruncatedListTests(TestCase):
+    def setUp(self):
+        seed_runs([User.objects.create(username='runner')], 3)
+        self.addCleanup(caches[settings.RESPONSE_CACHE_ALIAS].clear)
+
+    def assertTruncated(self, response):
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual((response['X-Truncated'], response['X-Result-Limit']), ('true', '2'))
+        next_url = re.fullmatch(r'<(.+)>; rel="next"', response['Link']).group(1)
+        ids = [run['id'] for run in response.json() + self.client.get(next_url).json()['results']]
+        self.assertCountEqual(ids, Run.objects.values_list('id', flat=True))
+
+    def test_lean_and_serializer_lists_are_marked(self):
+        self.assertTruncated(self.client.get('/api/runs/'))
+        # Повторный запрос отдается из кеша ответов вместе с заголовками
+        self.assertTruncated(self.client.get('/api/runs/'))
+        with mock.patch.object(LeanListMixin, 'use_lean_list', return_value=False):
+            self.assertTruncated(self.client.get('/api/runs/?status=finished'))
+
+    def test_complete_list_is_not_marked(self):
+        with override_settings(UNPAGINATED_RESULTS_LIMIT=3):
+            response = self.client.get('/api/runs/')
+        self.assertFalse(response.has_header('X-Truncated'))
+
+
+class ActivityStatsTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        # Понедельник и среда одной недели, понедельник следующей
+        days = [datetime(2024, 1, 1, 9, tzinfo=dt_timezone.utc) + timedelta(days=offset) for offset in (0, 2, 7)]
+        for run, created_at in zip(seed_runs([self.athlete], 3), days):
+            Run.objects.filter(pk=run.pk).update(created_at=created_at)
+            run.created_at = created_at
+            add_run_to_rollups(run)
+
+    def stats(self, **params):
+        response = self.client.get(f'/api/users/{self.athlete.id}/stats/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(row['period_start'], row['runs'], row['distance']) for row in response.json()['results']]
+
+    def test_weeks_from_mid_week(self):
+        # from внутри недели включает всю неделю
+        expected = [('2024-01-01', 2, 5000 + 5001), ('2024-01-08', 1, 5002)]
+        self.assertEqual(self.stats(bucket='week', **{'from': '2024-01-03'}), expected)
+        self.assertEqual(self.stats(bucket='day', to='2024-01-02'), [('2024-01-01', 1, 5000)])
+
+    def test_incremental_rollups_match_rebuild(self):
+        incremental = {bucket: self.stats(bucket=bucket) for bucket in ('day', 'week', 'month')}
+        rebuild_rollups([self.athlete.id])
+        self.assertEqual({bucket: self.stats(bucket=bucket) for bucket in ('day', 'week', 'month')}, incremental)
+
+    def test_invalid_range_is_rejected(self):
+        response = self.client.get(f'/api/users/{self.athlete.id}/stats/', {'from': '2024-02-01', 'to': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        # Дистанции спортсменов; у второго и третьего поровну, выше тот, у кого меньше id
+        self.athletes = [User.objects.create(username=f'runner{i}') for i in range(5)]
+        for athlete, distance in zip(self.athletes, (3000, 9000, 9000, 1000, 5000)):
+            run = seed_runs([athlete], 1)[0]
+            Run.objects.filter(pk=run.pk).update(distance=distance)
+            run.distance = distance
+            update_leaderboards(run)
+        self.expected = [self.athletes[i].id for i in (1, 2, 4, 0, 3)]
+
+    def get(self, board='distance', **params):
+        response = self.client.get(f'/api/leaderboards/{board}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_top(self):
+        results = self.get(top=3)['results']
+        self.assertEqual([(row['rank'], row['athlete']) for row in results], list(enumerate(self.expected[:3], 1)))
+        self.assertEqual(self.get('runs', period=month_period(timezone.localdate()))['results'][0]['score'], 1)
+
+    def test_around_athlete(self):
+        data = self.get(athlete=self.athletes[4].id, around=1)
+        self.assertEqual(data['rank'], 3)
+        window = [(row['rank'], row['athlete']) for row in data['results']]
+        self.assertEqual(window, list(enumerate(self.expected, 1))[1:4])
+
+    def test_incremental_scores_match_rebuild(self):
+        before = self.get(top=10)['results']
+        rebuild_leaderboards([athlete.id for athlete in self.athletes])
+        self.assertEqual(self.get(top=10)['results'], before)
+
+    def test_missing_board_or_athlete(self):
+        self.assertEqual(self.client.get('/api/leaderboards/pace/').status_code, 404)
+        other = User.objects.create(username='other')
+        self.assertEqual(self.client.get('/api/leaderboards/distance/', {'athlete': other.id}).status_code, 404)
+
+
+class RunSplitsTests(TestCase):
+    def setUp(self):
+        # 2.5 км на север: точка каждые 100 м и 30 с
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        self.addCleanup(forget, self.run.id)
+        track = [point(30 * i, north=100 * i) for i in range(26)]
+        self.client.post(f'/api/runs/{self.run.id}/positions/bulk/', track, content_type='application/json')
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+
+    def splits(self, unit):
+        response = self.client.get(f'/api/runs/{self.run.id}/splits/', {'unit': unit})
+        self.assertEqual(response.status_code, 200)
+        return [(row['split'], row['distance'], row['elapsed_time']) for row in response.json()['splits']]
+
+    def assertSplits(self, splits, expected):
+        self.assertEqual(len(splits), len(expected))
+        for (number, distance, elapsed), (expected_distance, expected_elapsed) in zip(splits, expected):
+            self.assertAlmostEqual(distance, expected_distance, delta=5)
+            self.assertEqual(elapsed, expected_elapsed)
+
+    def test_km_and_mi(self):
+        self.assertSplits(self.splits('km'), [(1000, 300), (1000, 300), (500, 150)])
+        # Граница мили 1609 м - на точке 1700 м
+        self.assertSplits(self.splits('mi'), [(1700, 510), (800, 240)])
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/splits/', {'unit': 'yd'}).status_code, 400)
+
+    def test_packed_track_gives_same_splits(self):
+        rows = {unit: self.splits(unit) for unit in SPLIT_UNITS}
+        compact_run(Run.objects.get(pk=self.run.id))
+        self.assertIsNotNone(Run.objects.get(pk=self.run.id).track)
+        self.assertEqual({unit: self.splits(unit) for unit in SPLIT_UNITS}, rows)
+
+
+@override_settings(SYNC_SAFETY_MARGIN=0)
+class SyncTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.url = f'/api/users/{self.athlete.id}/sync/'
+        self.kept, self.removed = Run.objects.bulk_create([Run(athlete=self.athlete), Run(athlete=self.athlete)])
+
+    def sync(self, token=None):
+        return self.client.get(self.url, {'token': token} if token else {})
+
+    def test_token_returns_only_changes_and_tombstones(self):
+        first = self.sync().json()
+        self.assertEqual({run['id'] for run in first['runs']}, {self.kept.id, self.removed.id})
+        self.assertEqual(first['deleted'], {'runs': [], 'challenges': []})
+
+        self.client.delete(f'/api/runs/{self.removed.id}/')
+        added = Run.objects.create(athlete=self.athlete)
+        changes = self.sync(first['token']).json()
+        self.assertEqual([run['id'] for run in changes['runs']], [added.id])
+        self.assertEqual(changes['deleted']['runs'], [self.removed.id])
+
+        self.assertEqual(self.sync(changes['token']).json()['runs'], [])
+
+    def test_expired_and_broken_tokens(self):
+        expired = encode_token(timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS + 1))
+        self.assertEqual(self.sync(expired).status_code, 410)
+        self.assertEqual(self.sync('not-a-token').status_code, 400)
+
+
+class ImportRunsTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.folder = Path(directory.name, 'runner')
+        self.folder.mkdir()
+        rows = [f'{55.75 + i / 1000:.4f},37.6100,2024-01-01T00:{i:02d}:00+00:00' for i in range(5)]
+        (self.folder / 'morning.csv').write_text('latitude,longitude,created_at\n' + '\n'.join(rows) + '\n')
+
+    def run_import(self):
+        call_command('import_runs', str(self.folder), '--workers', '0', stdout=StringIO(), stderr=StringIO())
+
+    def test_repeated_import_skips_loaded_files(self):
+        self.run_import()
+        self.assertEqual(Run.objects.filter(athlete=self.athlete, status='finished').count(), 1)
+        self.assertEqual(Position.objects.count(), 5)
+
+        # Тот же путь и размер: файл даже не разбирается
+        with mock.patch('app_run.management.commands.import_runs.parse_file') as parse:
+            self.run_import()
+        parse.assert_not_called()
+
+        # Копия под другим именем разбирается, но совпадает по sha256
+        (self.folder / 'copy.csv').write_bytes((self.folder / 'morning.csv').read_bytes())
+        self.run_import()
+        self.assertEqual(Run.objects.count(), 1)
+        self.assertEqual(Position.objects.count(), 5)
+
+
+class SimplifiedTrackTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        seed_track(self.run, 50)
+        self.addCleanup(caches[settings.TRACK_SIMPLIFY_CACHE_ALIAS].clear)
+
+    def test_stop_defers_precompute(self):
+        with mock.patch('app_run.track._precompute_executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(executor.submit.call_args.args[1], self.run.id)
+
+    def test_precomputed_levels_are_read_from_cache(self):
+        Run.objects.filter(pk=self.run.id).update(status='finished')
+        precompute_simplified_tracks(self.run.id)
+
+        # Из БД читается только статус забега, трек не загружается
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/positions/', {'run': self.run.id, 'tolerance': 25})
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheInvalidationTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner', first_name='Имя')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.addCleanup(forget, self.run.id)
+        self.addCleanup(caches[settings.RESPONSE_CACHE_ALIAS].clear)
+
+    def post_track(self, track):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/runs/{self.run.id}/positions/bulk/', track, content_type='application/json')
+
+    def test_position_write_refreshes_global_list(self):
+        self.client.get('/api/runs/')
+        self.post_track([point(0), point(5, north=20)])
+
+        distance = self.client.get('/api/runs/').json()[0]['distance']
+        self.assertAlmostEqual(distance, Run.objects.get(pk=self.run.id).distance)
+        self.assertGreater(distance, 0)
+
+    def test_live_writes_refresh_global_list_after_interval(self):
+        self.post_track([point(0), point(5, north=20)])
+        self.client.get('/api/runs/')
+        # Вторая запись внутри интервала откладывает сброс общего списка до чтения после интервала
+        self.post_track([point(10, north=40)])
+        self.assertNotEqual(
+            self.client.get('/api/runs/').json()[0]['distance'], Run.objects.get(pk=self.run.id).distance
+        )
+
+        later = time.time_ns() + settings.RESPONSE_CACHE_LIVE_INTERVAL * 10 ** 9
+        with mock.patch('app_run.response_cache.time.time_ns', return_value=later):
+            distance = self.client.get('/api/runs/').json()[0]['distance']
+        self.assertAlmostEqual(distance, Run.objects.get(pk=self.run.id).distance)
+
+    def test_rename_invalidates_runs(self):
+        self.client.get('/api/runs/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.athlete.first_name = 'Новое'
+            self.athlete.save()
+        self.assertEqual(self.client.get('/api/runs/').json()[0]['athlete_data']['first_name'], 'Новое')
+
+
+class NearbyTests(TestCase):
+    url = '/api/positions/nearby/'
+    params = {'lat': 55.75, 'lon': 37.61, 'radius': 500}
+
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+
+    def add_point(self, age, north=0.0):
+        values = point(0, north)
+        values['created_at'] = timezone.now() - timedelta(seconds=age)
+        return Position(run=self.run, **values).fill_geohash()
+
+    def test_default_window_skips_old_points(self):
+        recent, old = Position.objects.bulk_create([self.add_point(60), self.add_point(3 * 24 * 3600, north=100)])
+        response = self.client.get(self.url, self.params)
+        self.assertEqual([item['id'] for item in response.json()], [recent.id])
+
+        since = (timezone.now() - timedelta(days=7)).isoformat()
+        response = self.client.get(self.url, {**self.params, 'since': since})
+        self.assertEqual([item['id'] for item in response.json()], [recent.id, old.id])
+
+    def test_active_returns_last_point_of_run(self):
+        _, last = Position.objects.bulk_create([self.add_point(30, north=50), self.add_point(10, north=20)])
+        response = self.client.get(self.url, {**self.params, 'active': 'true'})
+        self.assertEqual([item['id'] for item in response.json()], [last.id])
+
+    @override_settings(NEARBY_MAX_SCANNED_ROWS=3)
+    def test_scanned_rows_are_capped(self):
+        Position.objects.bulk_create([self.add_point(age, north=age) for age in range(10, 20)])
+        self.assertEqual(len(self.client.get(self.url, self.params).json()), 3)
+
+
+class MiddlewareTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        self.addCleanup(forget, self.run.id)
+        self.url = f'/api/async/runs/{self.run.id}/positions/'
+        self.body = {'latitude': '55.7500', 'longitude': '37.6100'}
+
+    def assertQueriesTimed(self, response):
+        self.assertEqual(response.status_code, 201)
+        queries = int(re.search(r'"(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+
+    def test_instrumentation_counts_view_queries(self):
+        body = {'run': self.run.id, **self.body}
+        with override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1), self.assertLogs('app_run.instrumentation'):
+            self.assertQueriesTimed(self.client.post('/api/positions/', body, content_type='application/json'))
+
+    async def test_instrumentation_counts_async_view_queries(self):
+        with override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1), self.assertLogs('app_run.instrumentation'):
+            response = await self.async_client.post(self.url, self.body, content_type='application/json')
+        # Запросы идут из потока sync_to_async, но попадают в замер запроса
+        self.assertQueriesTimed(response)
+
+    async def test_replica_routing_pins_async_writer(self):
+        with mock.patch('app_run.middleware.replica_aliases', return_value=['replica']):
+            response = await self.async_client.post(self.url, self.body, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(settings.READ_YOUR_WRITES_COOKIE, response.cookies)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        for module in ('app_run.routers', 'app_run.middleware'):
+            patcher = mock.patch(f'{module}.replica_aliases', return_value=['replica'])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def route(self, method='get', pinned_until=None, atomic=False, write=False):
+        """БД, из которой представление с replica_reads прочитало бы Run, и ответ middleware."""
+        router, seen = ReplicaRouter(), {}
+
+        def view(request):
+            if write:
+                router.db_for_write(Run)
+            with mock.patch.object(connections[DEFAULT_DB_ALIAS], 'in_atomic_block', atomic):
+                seen['db'] = router.db_for_read(Run)
+            return HttpResponse()
+        view.cls = type('ReplicaView', (), {'replica_reads': True})
+
+        request = getattr(RequestFactory(), method)('/api/runs/')
+        if pinned_until is not None:
+            request.COOKIES[settings.READ_YOUR_WRITES_COOKIE] = str(int(pinned_until))
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return seen['db'], response
+
+    def test_reads_go_to_replica(self):
+        db, response = self.route()
+        self.assertEqual(db, 'replica')
+        self.assertNotIn(settings.READ_YOUR_WRITES_COOKIE, response.cookies)
+        # Истекшая метка больше не держит клиента на основной БД
+        self.assertEqual(self.route(pinned_until=time.time() - 1)[0], 'replica')
+
+    def test_writer_reads_own_writes(self):
+        db, response = self.route(method='post')
+        self.assertEqual(db, DEFAULT_DB_ALIAS)
+        self.assertIn(settings.READ_YOUR_WRITES_COOKIE, response.cookies)
+        # Запись внутри GET тоже переводит чтения запроса и клиента на основную БД
+        db, response = self.route(write=True)
+        self.assertEqual(db, DEFAULT_DB_ALIAS)
+        self.assertIn(settings.READ_YOUR_WRITES_COOKIE, response.cookies)
+
+        pinned_until = int(response.cookies[settings.READ_YOUR_WRITES_COOKIE].value)
+        self.assertEqual(self.route(pinned_until=pinned_until)[0], DEFAULT_DB_ALIAS)
+
+    def test_atomic_block_reads_primary(self):
+        self.assertEqual(self.route(atomic=True)[0], DEFAULT_DB_ALIAS)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN горячих запросов API: индекс, а не полный просмотр таблицы или отдельная сортировка."""
+
+    def test_hot_queries_use_indexes(self):
+        full_scan = FULL_SCAN.get(connection.vendor)
+        if full_scan is None:
+            self.skipTest(f"EXPLAIN-проверка не поддерживается для {connection.vendor}")
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # На пустых таблицах планировщик предпочитает Seq Scan, проверяем именно применимость индекса
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for name, queryset, index in hot_queries():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIsNone(full_scan.search(plan), plan)
+                if index is not None:
+                    self.assertIn(index, plan)
+
+
+class QueryBudgetTests(TransactionTestCase):
+    """
+    Число SQL-запросов эндпоинтов в пределах бюджета bench_api, самые частые записи - ровно столько, сколько
+    задумано. TransactionTestCase: в TestCase атомарные блоки становятся точками сохранения, и SAVEPOINT
+    попадали бы в счет запросов.
+    """
+
+    # Уровни упрощения трека готовит фоновый поток: его запросы не в счет, но он мешал бы очистке БД
+    @override_settings(RESPONSE_CACHE_ENABLED=False, TRACK_SIMPLIFY_TOLERANCES=[])
+    def test_endpoints_match_query_budget(self):
+        data = seed('1k', 1)
+        for run_id in data['point_runs'] + data['async_point_runs'] + data['ingest_runs']:
+            self.addCleanup(forget, run_id)
+
+        for name, method, url, body, expected_status, budget in ENDPOINTS:
+            with self.subTest(name):
+                with CaptureQueriesContext(connection) as captured:
+                    response = request(self.client, method, resolve(url, data, 0), resolve(body, data, 0))
+                self.assertLessEqual(len(captured), budget)
+                self.assertEqual(response.status_code, expected_status)
+
+    def test_single_point_post(self):
+        run = Run.objects.create(athlete=User.objects.create(username='runner'), status='in_progress')
+        self.addCleanup(forget, run.id)
+        body = {'run': run.id, 'latitude': '55.7500', 'longitude': '37.6100'}
+
+        # Проверка забега, BEGIN, SAVEPOINT, блокировка забега, UPDATE метрик, RELEASE, INSERT точки, COMMIT
+        with self.assertNumQueries(8):
+            response = self.client.post('/api/positions/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(TRACK_SIMPLIFY_TOLERANCES=[])
+    def test_finish(self):
+        athlete = User.objects.create(username='runner')
+        # Первый финиш создает строки показателей, итогов и рейтингов, замеряется следующий
+        first, run = seed_runs([athlete], 2, status='in_progress')
+        self.client.post(f'/api/runs/{first.id}/stop/')
+        seed_track(run, 20)
+
+        # Переход, счетчики, трек и темп, показатели спортсмена, 3 периода итогов, 4 строки рейтингов.
+        # Шестнадцатый запрос появляется, когда у спортсмена выполнено условие челленджа
+        with self.assertNumQueries(15):
+            response = self.client.post(f'/api/runs/{run.id}/stop/')
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,215 @@
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app_run.geo import simplify
+from app_run.metrics import compute_point_metrics
+from app_run.models import Run, Position
+from app_run.serializers import PositionSerializer
+
+# Формат упакованного трека:
+#   заголовок: версия (1 байт), число точек (4 байта), время первой точки в мкс от эпохи (8 байт);
+#   далее по каждой точке четыре zigzag-varint дельты от предыдущей точки:
+#   id, широта * 10^4, долгота * 10^4, время в мкс.
+TRACK_VERSION = 1
+HEADER = struct.Struct('>BIq')
+COORDINATE_SCALE = 10 ** 4
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+logger = logging.getLogger(__name__)
+
+# Уровни упрощения готовятся по очереди в одном потоке процесса, после ответа на запрос завершения
+_precompute_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='track-simplify')
+
+
+def _write_varint(buffer, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag: отрицательные дельты тоже кодируются коротко
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varints(data, offset):
+    value, shift = 0, 0
+    for byte in data[offset:]:
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            yield (value >> 1) ^ -(value & 1), offset
+            value, shift = 0, 0
+        else:
+            shift += 7
+
+
+def _to_micros(moment):
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def pack_track(points):
+    """points: последовательность (id, latitude, longitude, created_at) в порядке трека."""
+    points = list(points)
+    base = _to_micros(points[0][3]) if points else 0
+
+    buffer = bytearray(HEADER.pack(TRACK_VERSION, len(points), base))
+    previous = (0, 0, 0, base)
+    for position_id, latitude, longitude, created_at in points:
+        current = (
+            position_id,
+            int(latitude * COORDINATE_SCALE),
+            int(longitude * COORDINATE_SCALE),
+            _to_micros(created_at),
+        )
+        for value, prev in zip(current, previous):
+            _write_varint(buffer, value - prev)
+        previous = current
+    return bytes(buffer)
+
+
+def unpack_track(data):
+    """Генератор точек (id, latitude, longitude, created_at), обратный pack_track."""
+    data = bytes(data)
+    version, count, base = HEADER.unpack_from(data)
+    if version != TRACK_VERSION:
+        raise ValueError(f"Unsupported track version: {version}")
+
+    values = _read_varints(data, HEADER.size)
+    position_id, latitude, longitude, micros = 0, 0, 0, base
+    for _ in range(count):
+        position_id += next(values)[0]
+        latitude += next(values)[0]
+        longitude += next(values)[0]
+        micros += next(values)[0]
+        yield (
+            position_id,
+            Decimal(latitude).scaleb(-4),
+            Decimal(longitude).scaleb(-4),
+            EPOCH + timedelta(microseconds=micros),
+        )
+
+
+def unpack_positions(run_id, data):
+    positions = [
+        Position(id=position_id, run_id=run_id, latitude=latitude, longitude=longitude, created_at=created_at)
+        for position_id, latitude, longitude, created_at in unpack_track(data)
+    ]
+    # Скорость и дистанция в упакованный трек не входят, восстанавливаем их по координатам
+    metrics = compute_point_metrics(
+        [position.latitude for position in positions],
+        [position.longitude for position in positions],
+        [position.created_at for position in positions],
+    )
+    for position, (speed, distance) in zip(positions, metrics):
+        position.speed = speed
+        position.distance = distance
+    return positions
+
+
+def compact_run(run):
+    """
+    Упаковывает трек завершенного забега в Run.track. Упакованный трек - копия для чтения трека целиком
+    (список точек забега, сплиты, экспорт, упрощение) одной строкой; строки Position остаются: по ним
+    работают чтение точки по id, общий список точек, поиск рядом и фильтр забегов по области.
+    """
+    with transaction.atomic():
+        points = (
+            Position.objects.filter(run=run)
+            .order_by('created_at', 'id').values_list('id', 'latitude', 'longitude', 'created_at')
+        )
+        run.track = pack_track(points)
+        run.save(update_fields=['track'])
+
+
+def drop_packed_track(run_id):
+    """Сбрасывает упакованную копию трека после изменения его точек: чтение вернется к строкам Position."""
+    Run.objects.filter(pk=run_id, track__isnull=False).update(track=None, updated_at=timezone.now())
+
+
+def restore_positions(run):
+    """
+    Восстанавливает строки Position забега, упакованного раньше, когда упаковка их удаляла.
+    Забеги, у которых строки есть, не меняются. Возвращает число восстановленных точек.
+    """
+    with transaction.atomic():
+        if run.track is None or Position.objects.filter(run=run).exists():
+            return 0
+        positions = unpack_positions(run.pk, run.track)
+        for position in positions:
+            position.fill_geohash()
+        Position.objects.bulk_create(positions, batch_size=5000)
+        return len(positions)
+
+
+def load_track(run_id):
+    """Все точки забега в хронологическом порядке: из упакованного трека или из строк Position."""
+    packed = Run.objects.filter(pk=run_id, track__isnull=False).values_list('track', flat=True).first()
+    if packed is not None:
+        return unpack_positions(run_id, packed)
+    return list(Position.objects.filter(run_id=run_id).order_by('created_at', 'id'))
+
+
+def _simplified_cache_key(run_id, tolerance, max_points):
+    if tolerance is not None:
+        tolerance = float(tolerance)
+    return f'track-simplified:{run_id}:{tolerance}:{max_points}'
+
+
+def simplified_track_data(run_id, tolerance=None, max_points=None, finished=False, positions=None):
+    """
+    Сериализованный упрощенный трек в порядке выдачи PositionViewSet (новые точки первыми).
+    Трек завершенного забега больше не меняется, поэтому результат для него кешируется.
+    positions - уже загруженный трек, если он есть у вызывающего.
+    """
+    cache = caches[settings.TRACK_SIMPLIFY_CACHE_ALIAS]
+    key = _simplified_cache_key(run_id, tolerance, max_points)
+    if finished:
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    if positions is None:
+        positions = load_track(run_id)
+    kept = simplify(
+        [position.latitude for position in positions],
+        [position.longitude for position in positions],
+        tolerance=tolerance,
+        max_points=max_points,
+    )
+    data = PositionSerializer([positions[index] for index in reversed(kept)], many=True).data
+
+    if finished:
+        cache.set(key, data, settings.TRACK_SIMPLIFY_CACHE_TIMEOUT)
+    return data
+
+
+def precompute_simplified_tracks(run_id):
+    # Заранее готовим обзорные уровни детализации, чтобы карты не пересчитывали трек; трек читается один раз
+    positions = load_track(run_id)
+    for tolerance in settings.TRACK_SIMPLIFY_TOLERANCES:
+        simplified_track_data(run_id, tolerance=tolerance, finished=True, positions=positions)
+
+
+def _precompute_in_background(run_id):
+    try:
+        precompute_simplified_tracks(run_id)
+    except Exception:
+        # Уровень, который не успели подготовить, посчитается при первом чтении
+        logger.exception("Не удалось подготовить упрощенный трек забега %s", run_id)
+    finally:
+        # Соединение потока пула не должно висеть между задачами
+        connection.close()
+
+
+def schedule_simplified_tracks(run):
+    """Готовит уровни упрощения трека в фоновом потоке после коммита, не задерживая ответ на завершение забега."""
+    if settings.TRACK_SIMPLIFY_TOLERANCES:
+        transaction.on_commit(partial(_precompute_executor.submit, _precompute_in_background, run.pk))
@@ -0,0 +1,18 @@
+from django.db import IntegrityError, transaction
+
+
+def increment_or_create(model, lookup, values, defaults):
+    """
+    Сдвигает строку lookup через UPDATE ... SET x = F(x) + delta (values), не читая ее. Если строки
+    еще нет, создает ее с defaults - словарем или функцией, которая его вернет; defaults=None - не создавать.
+    Строку, созданную параллельно между UPDATE и INSERT, обновляет повторным UPDATE.
+    """
+    rows = model.objects.filter(**lookup)
+    if rows.update(**values) or defaults is None:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **(defaults() if callable(defaults) else defaults))
+    except IntegrityError:
+        # Строку успели создать параллельно
+        rows.update(**values)
@@ -1,123 +1,225 @@
-import json
-from decimal import Decimal
+from copy import copy
+from datetime import timedelta
+from functools import partial, reduce
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Count, Q
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework import viewsets
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from app_run.filters import RunFilter, ChallengeFilter
-from app_run.models import Run, AthleteInfo, Challenge, Position
+from app_run.challenges import award_challenges
+from app_run.counters import (
+    adjust_run_counters, status_deltas, transition_deltas, record_finished_run, rebuild_athlete_aggregates,
+)
+from app_run.export import EXPORT_FORMATS, export_run, export_athlete_zip
+from app_run.filters import RunFilter, ChallengeFilter, geohash_q
+from app_run.geo import bounding_box, haversine
+from app_run.ingest import ingest_points, stream_positions, get_line_parser
+from app_run.ingest_filters import filter_points, forget, merge_dropped, remember
+from app_run.leaderboards import update_leaderboards, top, around
+from app_run.lean import LeanListMixin, row_builder
+from app_run.metrics import RunNotActive, update_run_metrics, finalize_run_metrics
+from app_run.models import Run, AthleteInfo, Challenge, Position, ActivityRollup, LeaderboardEntry
+from app_run.pagination import ConditionalPagination, KeysetPagination, truncation_headers
+from app_run.response_cache import CachedListMixin, cached_response, invalidate
+from app_run.rollups import add_run_to_rollups, period_start
 from app_run.serializers import RunSerializer, UserSerializer, AthleteInfoSerializer, ChallengeSerializer, \
-    PositionSerializer
+    PositionSerializer, PositionBulkItemSerializer, TrackSimplifySerializer, NearbySerializer, \
+    ActivityRollupSerializer, ActivityStatsQuerySerializer, LeaderboardEntrySerializer, LeaderboardQuerySerializer, \
+    RunSplitsQuerySerializer, ChallengeSyncSerializer, SyncQuerySerializer
+from app_run.splits import run_splits
+from app_run.sync import add_tombstone, collect_changes, token_expired
+from app_run.track import (
+    compact_run, drop_packed_track, unpack_positions, schedule_simplified_tracks, simplified_track_data,
+)
+from app_run.write_behind import get_buffer, buffer_stats
+
+RUN_NOT_ACTIVE_ERROR = 'Забег еще не начат или уже завершен.'
+
+
+def run_not_active():
+    return Response({'error': RUN_NOT_ACTIVE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET'])
 def company_details(request):
-        return Response({
+        return cached_response(request, 'company_details', lambda: Response({
             'company_name': settings.COMPANY_NAME,
             'slogan': settings.SLOGAN,
             'contacts': settings.CONTACTS,
-        })
-
-class ConditionalPagination(PageNumberPagination):
-    page_size = 10  # Значение по умолчанию
-    page_size_query_param = 'size'
-    page_query_param = 'page'
-
-    def paginate_queryset(self, queryset, request, view=None):
-        # Включаем пагинацию только если указан параметр size
-        if 'size' in request.query_params:
-            return super().paginate_queryset(queryset, request, view)
-        return None
-
-
-class RunViewSet(viewsets.ModelViewSet):
-    queryset = Run.objects.select_related('athlete')
+        }))
+
+class RunViewSet(CachedListMixin, LeanListMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'runs'
+    cache_athlete_param = 'athlete'
+    # GET-запросы читают с реплики, если она настроена (app_run.routers)
+    replica_reads = True
+    # Список без пагинации в порядке курсора: обрезанный ответ продолжается курсорной страницей
+    queryset = Run.objects.select_related('athlete').order_by('created_at', 'id')
     serializer_class = RunSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     ordering_fields = ['created_at']
-    pagination_class = ConditionalPagination
+    pagination_class = KeysetPagination
+    keyset_ordering = ('created_at', 'id')
     filterset_class = RunFilter
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            run = serializer.save()
+            adjust_run_counters(run.athlete_id, status_deltas(run.status))
+            invalidate('runs', run.athlete_id)
+
+    def perform_update(self, serializer):
+        # Статус через PATCH не меняется (RunSerializer.validate_status)
+        old_athlete_id = serializer.instance.athlete_id
+        with transaction.atomic():
+            run = serializer.save()
+            if run.athlete_id != old_athlete_id:
+                adjust_run_counters(old_athlete_id, status_deltas(run.status, -1))
+                adjust_run_counters(run.athlete_id, status_deltas(run.status))
+                if run.status == 'finished':
+                    # Итоги и рейтинги забега переходят к новому спортсмену
+                    previous = copy(run)
+                    previous.athlete_id = old_athlete_id
+                    add_run_to_rollups(previous, -1)
+                    update_leaderboards(previous, -1)
+                    add_run_to_rollups(run)
+                    update_leaderboards(run)
+                    rebuild_athlete_aggregates([old_athlete_id, run.athlete_id])
+                # У прежнего спортсмена забег пропадает так же, как при удалении
+                add_tombstone('run', run.pk, old_athlete_id)
+            invalidate('runs', old_athlete_id, run.athlete_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            adjust_run_counters(instance.athlete_id, status_deltas(instance.status, -1))
+            invalidate('runs', instance.athlete_id)
+            if instance.status == 'finished':
+                add_run_to_rollups(instance, -1)
+                update_leaderboards(instance, -1)
+                rebuild_athlete_aggregates([instance.athlete_id])
+
+    @action(detail=True)
+    def splits(self, request, pk=None):
+        params = RunSplitsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        unit = params.validated_data['unit']
+        run = get_object_or_404(Run.objects.only('distance', 'track'), pk=pk)
+
+        # Дистанция точек посчитана при загрузке, поэтому границы сплитов - точечные поиски по индексу
+        return Response({
+            'run_id': run.id,
+            'unit': unit,
+            'splits': run_splits(run, unit),
+        })
 
-class RunStartAPIView(APIView):
-    def post(self, request, run_id):
-        run = get_object_or_404(Run, pk=run_id)
-
-        if run.status != 'init':
-            return Response(
-                {'error': 'Забег уже начат или завершен.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        run.status = 'in_progress'
-        run.save()
-
-        return Response(
-            {'status': 'Забег начат.', 'run_id': run.id, 'current_status': run.status},
-            status=status.HTTP_200_OK
-        )
 
+class RunTransitionAPIView(APIView):
+    action = None
+    success_message = None
+    error_message = None
 
-class RunStopAPIView(APIView):
     def post(self, request, run_id):
-        run = get_object_or_404(Run, pk=run_id)
-
-        if run.status != 'in_progress':
+        run = self.perform_transition(run_id)
+        if run is None:
             return Response(
-                {'error': 'Забег еще не начат или уже завершен.'},
+                {'error': self.error_message},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        run.status = 'finished'
-        run.save()
-
-        # Проверяем, не стал ли этот забег 10-м завершённым
-        finished_runs_count = Run.objects.filter(
-            athlete=run.athlete,
-            status='finished'
-        ).count()
-
-        if finished_runs_count == 10:
-            # Создаём челлендж, если ещё не существует
-            Challenge.objects.get_or_create(
-                athlete=run.athlete,
-                full_name="Сделай 10 Забегов!"
-            )
-
         return Response(
-            {'status': 'Забег завершен.', 'run_id': run.id, 'current_status': run.status},
+            {'status': self.success_message, 'run_id': run.id, 'current_status': run.status},
             status=status.HTTP_200_OK
         )
 
-
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = User.objects.filter(is_superuser=False)
+    def perform_transition(self, run_id):
+        """Забег после перехода или None, если статус не подходит. Общий для sync и async (app_run.async_views)."""
+        with transaction.atomic():
+            run = Run.apply_transition(run_id, self.action)
+            if run is None:
+                # Переход не выполнен: отличаем несуществующий забег от неподходящего статуса
+                if not Run.objects.filter(pk=run_id).exists():
+                    raise Http404
+                return None
+            invalidate('runs', run.athlete_id)
+            self.on_transition(run)
+
+        self.after_transition(run)
+        return run
+
+    def on_transition(self, run):
+        """Выполняется в транзакции перехода."""
+
+    def after_transition(self, run):
+        """Выполняется после фиксации перехода."""
+
+
+class RunStartAPIView(RunTransitionAPIView):
+    action = 'start'
+    success_message = 'Забег начат.'
+    error_message = 'Забег уже начат или завершен.'
+
+    def on_transition(self, run):
+        adjust_run_counters(run.athlete_id, transition_deltas('init', 'in_progress'))
+
+
+class RunStopAPIView(RunTransitionAPIView):
+    action = 'stop'
+    success_message = 'Забег завершен.'
+    error_message = RUN_NOT_ACTIVE_ERROR
+
+    def perform_transition(self, run_id):
+        if settings.POSITIONS_WRITE_BEHIND:
+            # Точки из буфера этого процесса должны попасть в итоговые метрики забега;
+            # буферы других воркеров сбрасываются в пределах POSITIONS_WRITE_BEHIND_MAX_DELAY
+            get_buffer().flush()
+        return super().perform_transition(run_id)
+
+    def on_transition(self, run):
+        adjust_run_counters(run.athlete_id, transition_deltas('in_progress', 'finished'))
+        finalize_run_metrics(run)
+        # Челленджи проверяются по накопленным показателям, без пересчета истории забегов
+        athlete_info = record_finished_run(run)
+        award_challenges([athlete_info])
+        add_run_to_rollups(run)
+        update_leaderboards(run)
+
+    def after_transition(self, run):
+        forget(run.id)
+        if settings.RUN_TRACK_COMPACTION:
+            compact_run(run)
+        schedule_simplified_tracks(run)
+
+
+class UserViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
+    cache_endpoint = 'users'
+    replica_reads = True
+    queryset = User.objects.filter(is_superuser=False).order_by('date_joined', 'id')
     serializer_class = UserSerializer
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['first_name', 'last_name']
-    ordering_fields = ['date_joined']
-    pagination_class = ConditionalPagination
+    ordering_fields = ['date_joined', 'runs_finished']
+    pagination_class = KeysetPagination
+    keyset_ordering = ('date_joined', 'id')
 
     def get_queryset(self):
         qs = super().get_queryset()
 
+        # Счетчик берется из AthleteInfo, без GROUP BY по всей таблице забегов
         qs = qs.annotate(
-            finished_runs_count=Count(
-                'run',
-                filter=Q(run__status='finished')
-            )
+            runs_finished=Coalesce('athlete_info__runs_finished', Value(0))
         )
 
         type_user = self.request.query_params.get('type', '').strip().lower()
@@ -129,9 +231,60 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
             case _:
                 return qs
 
+    @action(detail=True)
+    def stats(self, request, pk=None):
+        params = ActivityStatsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        bucket = params.validated_data['bucket']
+        user = get_object_or_404(User.objects.filter(is_superuser=False).only('id'), pk=pk)
+
+        # Читаются только готовые итоги: объем работы зависит от длины периода, а не от числа забегов
+        rollups = ActivityRollup.objects.filter(athlete=user, bucket=bucket).order_by('period_start')
+        if 'from' in params.validated_data:
+            rollups = rollups.filter(period_start__gte=period_start(params.validated_data['from'], bucket))
+        if 'to' in params.validated_data:
+            rollups = rollups.filter(period_start__lte=params.validated_data['to'])
+        limit = settings.UNPAGINATED_RESULTS_LIMIT
+        rollups = list(rollups[:limit + 1])
+        return Response(
+            {
+                'athlete': user.id,
+                'bucket': bucket,
+                'results': ActivityRollupSerializer(rollups[:limit], many=True).data,
+            },
+            headers=truncation_headers() if len(rollups) > limit else None,
+        )
+
+    @action(detail=True)
+    def sync(self, request, pk=None):
+        params = SyncQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        since = params.validated_data.get('token')
+        user = get_object_or_404(User.objects.filter(is_superuser=False).only('id'), pk=pk)
+        if since is not None and token_expired(since):
+            return Response(
+                {'error': 'Токен синхронизации устарел, нужна полная синхронизация.'},
+                status=status.HTTP_410_GONE
+            )
+
+        # Без токена - первая синхронизация: все строки спортсмена и токен для следующих
+        token, changes = collect_changes(user.id, since)
+        athlete_info = changes['athlete_info']
+        return Response({
+            'token': token,
+            'runs': RunSerializer(changes['runs'], many=True).data,
+            'challenges': ChallengeSyncSerializer(changes['challenges'], many=True).data,
+            'athlete_info': AthleteInfoSerializer(athlete_info).data if athlete_info else None,
+            'deleted': changes['deleted'],
+        })
+
 
 class AthleteInfoAPIView(APIView):
     def get(self, request, user_id):
+        return cached_response(request, 'athlete_info', partial(self.retrieve, user_id), athlete_id=user_id)
+
+    @staticmethod
+    def retrieve(user_id):
         user = get_object_or_404(User, pk=user_id)
         athlete_info, created = AthleteInfo.objects.get_or_create(user=user)
         serializer = AthleteInfoSerializer(athlete_info)
@@ -144,29 +297,62 @@ class AthleteInfoAPIView(APIView):
 
         if serializer.is_valid():
             serializer.save()
+            invalidate('athlete_info', user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ChallengeViewSet(viewsets.ReadOnlyModelViewSet):
+class LeaderboardAPIView(APIView):
+    replica_reads = True
+
+    def get(self, request, board):
+        if board not in dict(LeaderboardEntry.BOARD_CHOICES):
+            raise Http404
+        params = LeaderboardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        period = params.validated_data['period']
+
+        athlete_id = params.validated_data.get('athlete')
+        if athlete_id is None:
+            athlete_rank, window = None, top(board, period, params.validated_data['top'])
+        else:
+            entry = LeaderboardEntry.objects.select_related('athlete').filter(
+                board=board, period=period, athlete_id=athlete_id
+            ).first()
+            if entry is None:
+                return Response(
+                    {'error': 'Спортсмен не участвует в этом рейтинге.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            athlete_rank, window = around(entry, params.validated_data['around'])
+
+        data = LeaderboardEntrySerializer([entry for _, entry in window], many=True).data
+        return Response({
+            'board': board,
+            'period': period,
+            'rank': athlete_rank,
+            'results': [{'rank': place, **item} for (place, _), item in zip(window, data)],
+        })
+
+
+class ChallengeViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
+    cache_endpoint = 'challenges'
+    cache_athlete_param = 'athlete'
+    replica_reads = True
     queryset = Challenge.objects.all()
     serializer_class = ChallengeSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = ChallengeFilter
     pagination_class = ConditionalPagination
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super().default(obj)
-
-
-class PositionViewSet(viewsets.ModelViewSet):
-    queryset = Position.objects.all().order_by('-created_at')
+class PositionViewSet(LeanListMixin, viewsets.ModelViewSet):
+    replica_reads = True
+    queryset = Position.objects.all().order_by('-created_at', '-id')
     serializer_class = PositionSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['run']
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -175,15 +361,230 @@ class PositionViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(run_id=run_id)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        run_id = request.query_params.get('run')
+        track = None
+        if run_id and run_id.isdigit():
+            simplify_params = TrackSimplifySerializer(data=request.query_params)
+            simplify_params.is_valid(raise_exception=True)
+            if simplify_params.validated_data:
+                return self.simplified_list(int(run_id), **simplify_params.validated_data)
+
+            track = Run.objects.filter(pk=run_id, track__isnull=False).values_list('track', flat=True).first()
+        if track is None:
+            return super().list(request, *args, **kwargs)
+
+        # Трек завершенного забега хранится упакованным в одной строке Run
+        positions = unpack_positions(int(run_id), track)
+        positions.reverse()
+        page = self.paginate_queryset(positions)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(positions, many=True).data)
+
+    @staticmethod
+    def simplified_list(run_id, tolerance=None, max_points=None):
+        run = get_object_or_404(Run.objects.only('status'), pk=run_id)
+        data = simplified_track_data(
+            run_id,
+            tolerance=tolerance,
+            max_points=max_points,
+            finished=run.status == 'finished'
+        )
+        return Response(data)
+
+    @action(detail=False, url_path='write-behind')
+    def write_behind(self, request):
+        # Глубина буфера и задержка сброса в этом процессе, для подбора порогов
+        return Response(buffer_stats())
+
+    @action(detail=False)
+    def nearby(self, request):
+        params = NearbySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        lat, lon, radius, active = (params.validated_data[key] for key in ('lat', 'lon', 'radius', 'active'))
+        now = timezone.now()
+        since = params.validated_data.get('since', now - timedelta(seconds=settings.NEARBY_HISTORY_WINDOW))
+        if active:
+            since = max(since, now - timedelta(seconds=settings.NEARBY_ACTIVE_WINDOW))
+
+        # Индекс по geohash отсекает все, что вне описанного прямоугольника, круг проверяем точно
+        queryset = Position.objects.filter(geohash_q(*bounding_box(lat, lon, radius)), created_at__gte=since)
+        if active:
+            queryset = queryset.filter(run__status='in_progress').order_by('run', '-created_at')
+
+        compiled = self.get_lean_fields()
+        lookups = [lookup for _, lookup, _ in compiled]
+        run_index, lat_index, lon_index = (lookups.index(name) for name in ('run', 'latitude', 'longitude'))
+        rows = queryset.values_list(*lookups)[:settings.NEARBY_MAX_SCANNED_ROWS]
+
+        found, seen_runs = [], set()
+        for row in rows.iterator(chunk_size=2000):
+            distance = haversine(lat, lon, row[lat_index], row[lon_index])
+            if distance > radius:
+                continue
+            if active:
+                # Для "кто бежит рядом сейчас" нужна только последняя точка каждого забега
+                if row[run_index] in seen_runs:
+                    continue
+                seen_runs.add(row[run_index])
+            found.append((distance, row))
+        found.sort(key=lambda item: item[0])
+
+        build = row_builder(compiled)
+        data = []
+        for distance, row in found[:settings.UNPAGINATED_RESULTS_LIMIT]:
+            item = build(row)
+            item['distance'] = round(distance, 1)
+            data.append(item)
+        truncated = len(found) > settings.UNPAGINATED_RESULTS_LIMIT
+        return Response(data, headers=truncation_headers() if truncated else None)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            position = serializer.save()
+            # Упакованная копия трека больше не совпадает со строками
+            drop_packed_track(position.run_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            drop_packed_track(instance.run_id)
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            # Скорость и дистанцию точки считаем от предыдущей точки забега до вставки строки
+            position = Position(**serializer.validated_data)
+            update_run_metrics(position.run, [position])
+            serializer.save(speed=position.speed, distance=position.distance)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-
-        # Конвертируем данные в JSON с обработкой Decimal
-        data = json.dumps(serializer.data, cls=DecimalEncoder)
+        run = serializer.validated_data['run']
+        kept, dropped = filter_points(run, [serializer.validated_data])
+        if not kept:
+            # Дубликат, дрожание на месте или выброс: точка не записывается, клиент видит это по accepted
+            return JsonResponse({'run': run.id, 'accepted': 0, 'dropped': dropped}, status=status.HTTP_200_OK)
+        if settings.POSITIONS_WRITE_BEHIND:
+            # Точка подтверждается после записи в журнал, в БД она попадет пачкой (id еще нет)
+            position = Position(**serializer.validated_data)
+            get_buffer().append([position])
+            remember(run, kept)
+            return JsonResponse(self.get_serializer(position).data, status=status.HTTP_202_ACCEPTED)
+        try:
+            self.perform_create(serializer)
+        except RunNotActive:
+            # Забег завершили между проверкой сериализатора и записью
+            return run_not_active()
+        remember(run, kept)
+
+        # Decimal в serializer.data уже приведены к строкам, повторная сериализация не нужна
+        data = serializer.data
         return JsonResponse(
-            json.loads(data),  # Загружаем обратно, чтобы JsonResponse мог обработать
+            data,
             status=status.HTTP_201_CREATED,
-            headers=self.get_success_headers(serializer.data)
+            headers=self.get_success_headers(data)
+        )
+
+
+class PositionBulkCreateAPIView(APIView):
+    def post(self, request, run_id):
+        run = get_object_or_404(Run, pk=run_id)
+
+        # Статус забега проверяем один раз на всю пачку точек
+        if run.status != 'in_progress':
+            return run_not_active()
+
+        serializer = PositionBulkItemSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.POSITIONS_BULK_MAX_SIZE
+        )
+        serializer.is_valid(raise_exception=True)
+        try:
+            positions, dropped = ingest_points(run, serializer.validated_data)
+        except RunNotActive:
+            return run_not_active()
+
+        return Response(
+            {'run_id': run.id, 'created': len(positions), 'dropped': dropped},
+            status=status.HTTP_201_CREATED
+        )
+
+
+class PositionStreamUploadAPIView(APIView):
+    def post(self, request, run_id):
+        run = get_object_or_404(Run, pk=run_id)
+
+        if run.status != 'in_progress':
+            return run_not_active()
+
+        parse_line = get_line_parser(request.content_type)
+        if parse_line is None:
+            return Response(
+                {'error': 'Поддерживаются только NDJSON и CSV.'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+
+        # Тело читаем построчно из потока, не трогая request.data
+        lines = request.stream or []
+        chunks, error = [], None
+        try:
+            for chunk in stream_positions(run, lines, parse_line, settings.POSITIONS_STREAM_CHUNK_SIZE):
+                chunks.append(chunk)
+        except RunNotActive:
+            # Забег завершили посреди загрузки: уже записанные пачки остаются, остаток тела не читаем
+            error = RUN_NOT_ACTIVE_ERROR
+
+        data = {
+            'run_id': run.id,
+            'accepted': sum(chunk['accepted'] for chunk in chunks),
+            'rejected': sum(chunk['rejected'] for chunk in chunks),
+            'dropped': reduce(merge_dropped, (chunk['dropped'] for chunk in chunks), {}),
+            'chunks': chunks,
+        }
+        if error is not None:
+            return Response({'error': error, **data}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class ExportAPIView(APIView):
+    def perform_content_negotiation(self, request, force=False):
+        # Клиенты скачивания присылают Accept файла (application/gpx+xml и т.п.), ошибки все равно отдаем в JSON
+        return super().perform_content_negotiation(request, force=True)
+
+    @staticmethod
+    def attachment(chunks, content_type, filename):
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class RunExportAPIView(ExportAPIView):
+    def get(self, request, run_id, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+        run = get_object_or_404(Run.objects.defer('track'), pk=run_id)
+        # Точки читаются из БД по мере отправки ответа
+        return self.attachment(
+            export_run(run, export_format), EXPORT_FORMATS[export_format], f'run-{run.id}.{export_format}'
+        )
+
+
+class AthleteExportAPIView(ExportAPIView):
+    def get(self, request, user_id):
+        export_format = request.query_params.get('type', 'gpx')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"Формат должен быть одним из: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        user = get_object_or_404(User, pk=user_id)
+        runs = Run.objects.filter(athlete=user).defer('track').order_by('created_at', 'id')
+        return self.attachment(
+            export_athlete_zip(runs.iterator(chunk_size=100), export_format),
+            'application/zip',
+            f'runs-{user.id}.zip',
         )
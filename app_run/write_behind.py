@@ -0,0 +1,290 @@
+"""
+Отложенная запись точек (write-behind) для PositionViewSet.create и async-эндпоинта точки.
+
+Точка подтверждается клиенту сразу после записи в журнал процесса и попадает в БД пачкой
+через save_positions: по заполнению буфера, по таймеру и при остановке процесса (atexit).
+
+Гарантия сохранности: пока пачка не записана в БД, она остается в файле журнала. Журнал
+удерживается flock'ом живого процесса; журналы упавших или перезапущенных воркеров подхватывает
+первый же буфер в другом процессе (или команда flush_position_journal) и дописывает в БД,
+пропуская уже записанные точки. При ошибке БД пачка остается в памяти и журнале до следующей попытки.
+Точки забега, который успели завершить до записи пачки, в забег не пишутся (его итоги уже подведены),
+а откладываются в DEAD_LETTER_NAME в каталоге журналов для ручного разбора.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from app_run.ingest import save_positions
+from app_run.metrics import RunNotActive
+from app_run.models import Run, Position
+from app_run.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_NAME = 'dead-letter.jsonl'
+
+
+def _encode(position):
+    return json.dumps({
+        'run': position.run_id,
+        'latitude': str(position.latitude),
+        'longitude': str(position.longitude),
+        'created_at': position.created_at.isoformat(),
+    }) + '\n'
+
+
+def _decode(line):
+    record = json.loads(line)
+    return record['run'], {
+        'latitude': Decimal(record['latitude']),
+        'longitude': Decimal(record['longitude']),
+        'created_at': parse_datetime(record['created_at']),
+    }
+
+
+def dead_letter(run_id, points):
+    with open(Path(settings.POSITIONS_WRITE_BEHIND_DIR) / DEAD_LETTER_NAME, 'a') as journal:
+        journal.write(''.join(_encode(Position(run_id=run_id, **point)) for point in points))
+
+
+def write_points(points, skip_existing=False):
+    """
+    points: [(run_id, {'latitude', 'longitude', 'created_at'})]. Возвращает число точек,
+    отложенных в журнал отказов: их забег уже завершен.
+    """
+    by_run, rejected = {}, 0
+    for run_id, point in points:
+        by_run.setdefault(run_id, []).append(point)
+    runs = Run.objects.defer('track').in_bulk(by_run)
+
+    for run_id, run_points in by_run.items():
+        if run_id not in runs:
+            logger.warning("write-behind: забег %s удален, пропущено точек: %s", run_id, len(run_points))
+            continue
+        if skip_existing:
+            # Повтор журнала после падения: пачка могла успеть записаться до удаления журнала
+            existing = set(
+                Position.objects
+                .filter(run_id=run_id, created_at__in=[point['created_at'] for point in run_points])
+                .values_list('created_at', 'latitude', 'longitude')
+            )
+            run_points = [
+                point for point in run_points
+                if (point['created_at'], point['latitude'], point['longitude']) not in existing
+            ]
+        if not run_points:
+            continue
+        try:
+            save_positions(runs[run_id], run_points)
+        except RunNotActive:
+            logger.warning(
+                "write-behind: забег %s уже завершен, в %s отложено точек: %s",
+                run_id, DEAD_LETTER_NAME, len(run_points),
+            )
+            dead_letter(run_id, run_points)
+            rejected += len(run_points)
+    return rejected
+
+
+def recover_journals(directory, own_lock=None):
+    """Дописывает в БД журналы процессов, которые больше не держат свою блокировку. Возвращает число точек."""
+    recovered = 0
+    for lock_path in sorted(Path(directory).glob('*.lock')):
+        if lock_path == own_lock:
+            continue
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # процесс жив и сам отвечает за свой журнал
+            for segment in sorted(Path(directory).glob(f'{lock_path.stem}-*.journal')):
+                points = []
+                for line in segment.read_text().splitlines():
+                    try:
+                        points.append(_decode(line))
+                    except (ValueError, KeyError):
+                        # Недописанная строка при падении процесса: клиенту эта точка не подтверждалась
+                        logger.warning("write-behind: пропущена поврежденная строка журнала %s", segment.name)
+                with transaction.atomic():
+                    write_points(points, skip_existing=True)
+                segment.unlink()
+                recovered += len(points)
+            lock_path.unlink()
+    return recovered
+
+
+class PositionBuffer:
+    def __init__(self, directory, max_size, max_delay):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.max_delay = max_delay
+
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.pending = []
+        self.pending_since = None
+        # Закрытые сегменты журнала с точками, которые еще не попали в БД (после неудачных попыток)
+        self.pending_segments = []
+        self.segment_number = 0
+
+        self.flushes = 0
+        self.failures = 0
+        self.flushed_points = 0
+        self.recovered_points = 0
+        self.dead_letter_points = 0
+        self.latencies = deque(maxlen=200)
+        self.last_error = None
+
+        # pid в контейнерах повторяется между перезапусками, поэтому имя дополнено случайной частью
+        name = f'{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.lock_path = self.directory / f'{name}.lock'
+        self.lock_file = open(self.lock_path, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.journal = self._open_segment()
+
+        self.thread = threading.Thread(target=self._run, name='position-write-behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _open_segment(self):
+        self.segment_number += 1
+        path = self.directory / f'{self.lock_path.stem}-{self.segment_number:08d}.journal'
+        return open(path, 'a', buffering=1)
+
+    def append(self, positions):
+        # Строка журнала уходит в ОС до ответа клиенту: падение процесса ее не теряет
+        with self.lock:
+            self.journal.write(''.join(_encode(position) for position in positions))
+            self.pending.extend((position.run_id, {
+                'latitude': position.latitude,
+                'longitude': position.longitude,
+                'created_at': position.created_at,
+            }) for position in positions)
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            if len(self.pending) >= self.max_size:
+                self.wakeup.set()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                points, segments, since = self.pending, [*self.pending_segments, self.journal], self.pending_since
+                self.pending, self.pending_since, self.pending_segments = [], None, []
+                self.journal = self._open_segment()
+            segments[-1].close()
+
+            started = time.monotonic()
+            try:
+                # Пачка пишется целиком или никак: повтор после ошибки не создает дублей
+                with transaction.atomic():
+                    rejected = write_points(points)
+            except Exception as error:
+                # Ничего не теряем: точки возвращаются в начало буфера, их сегмент журнала остается на диске
+                self.failures += 1
+                self.last_error = repr(error)
+                logger.exception("write-behind: не удалось записать %s точек", len(points))
+                with self.lock:
+                    self.pending[:0] = points
+                    self.pending_segments[:0] = segments
+                    self.pending_since = since
+                return 0
+            finally:
+                close_old_connections()
+
+            for segment in segments:
+                Path(segment.name).unlink()
+            self.latencies.append(time.monotonic() - started)
+            self.flushes += 1
+            self.flushed_points += len(points) - rejected
+            self.dead_letter_points += rejected
+            return len(points)
+
+    def _run(self):
+        try:
+            self.recovered_points += recover_journals(self.directory, own_lock=self.lock_path)
+        except Exception:
+            logger.exception("write-behind: не удалось восстановить журналы")
+        while not self.stopped:
+            self.wakeup.wait(self.max_delay)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Остановка процесса: дописываем буфер; если БД недоступна, журнал подхватит следующий процесс."""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join(timeout=self.max_delay + 5)
+        self.flush()
+        with self.lock:
+            if not self.pending:
+                self.journal.close()
+                Path(self.journal.name).unlink(missing_ok=True)
+                self.lock_path.unlink(missing_ok=True)
+        self.lock_file.close()
+
+    def stats(self):
+        with self.lock:
+            depth = len(self.pending)
+            oldest = time.monotonic() - self.pending_since if self.pending_since is not None else None
+        latencies = list(self.latencies)
+        return {
+            'enabled': True,
+            'depth': depth,
+            'oldest_pending_age': oldest,
+            'flushes': self.flushes,
+            'flush_failures': self.failures,
+            'flushed_points': self.flushed_points,
+            'recovered_points': self.recovered_points,
+            'dead_letter_points': self.dead_letter_points,
+            'flush_latency': {
+                'last': latencies[-1] if latencies else None,
+                'p50': percentile(latencies, 50) if latencies else None,
+                'p95': percentile(latencies, 95) if latencies else None,
+            },
+            'last_error': self.last_error,
+            'max_size': self.max_size,
+            'max_delay': self.max_delay,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Буфер процесса; создается при первой точке, после fork воркера."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer.stopped:
+            _buffer = PositionBuffer(
+                settings.POSITIONS_WRITE_BEHIND_DIR,
+                settings.POSITIONS_WRITE_BEHIND_MAX_SIZE,
+                settings.POSITIONS_WRITE_BEHIND_MAX_DELAY,
+            )
+        return _buffer
+
+
+def buffer_stats():
+    if _buffer is None:
+        return {'enabled': settings.POSITIONS_WRITE_BEHIND, 'depth': 0}
+    return _buffer.stats()
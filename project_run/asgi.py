@@ -5,6 +5,23 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+Production ASGI profile (live tracking devices, see app_run.async_views):
+
+    DJANGO_SETTINGS_MODULE=project_run.settings.asgi \\
+    gunicorn project_run.asgi:application \\
+        -k uvicorn.workers.UvicornWorker --workers <CPU cores> \\
+        --backlog 4096 --keep-alive 75 --timeout 30
+
+- Devices post to /api/async/runs/<id>/positions/ (and .../positions/bulk/,
+  /api/async/runs/<id>/start/ and /stop/). These are plain Django async views. DRF
+  endpoints still work under ASGI but occupy a thread for the whole request.
+- A waiting device costs a coroutine, not a thread. Database work is capped per process by
+  ASYNC_DB_CONCURRENCY, so several thousand open device connections per worker are fine.
+  Raise the open files limit accordingly (ulimit -n 65536).
+- Put pgbouncer (pool_mode = transaction) in front of PostgreSQL and point DB_HOST at it.
+  Keep workers * ASYNC_DB_CONCURRENCY within its default_pool_size.
+- Compare with the WSGI path using: manage.py load_test_tracking --wsgi-url ... --asgi-url ...
 """
 
 import os
@@ -0,0 +1,13 @@
+import os
+
+from .production import *
+
+# Профиль развертывания под ASGI (см. project_run/asgi.py).
+# Синхронный код под ASGI выполняется в отдельном потоке на каждый запрос, поэтому постоянные
+# соединения не переиспользуются: пул держит pgbouncer (pool_mode = transaction) на DB_HOST.
+DATABASES['default']['CONN_MAX_AGE'] = 0
+# В режиме transaction pgbouncer не поддерживает серверные курсоры (iterator() в экспорте)
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Одновременных обращений к БД на процесс; держать не больше default_pool_size pgbouncer / число процессов
+ASYNC_DB_CONCURRENCY = int(os.environ.get('ASYNC_DB_CONCURRENCY', 20))
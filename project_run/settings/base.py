@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,10 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Отключается сам, если SQL_INSTRUMENTATION_SAMPLE_RATE = 0
+    'app_run.middleware.QueryInstrumentationMiddleware',
+    # Отключается сам, если не заданы DATABASE_REPLICAS
+    'app_run.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'project_run.urls'
@@ -119,3 +124,127 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 COMPANY_NAME = 'Бег навсегда'
 SLOGAN = 'Беги к тому, о чем мечтаешь'
 CONTACTS = 'Простоквашино'
+
+# Максимальное число точек в одном запросе пакетной загрузки
+POSITIONS_BULK_MAX_SIZE = 5000
+
+# Размер пачки при потоковой загрузке NDJSON/CSV
+POSITIONS_STREAM_CHUNK_SIZE = 1000
+
+# Упаковывать копию трека забега в одну строку при завершении (см. app_run.track.compact_run)
+RUN_TRACK_COMPACTION = False
+
+# Уровни упрощения трека (допуск в метрах), которые готовятся заранее после завершения забега,
+# и алиас CACHES, где они хранятся
+TRACK_SIMPLIFY_TOLERANCES = [5, 25, 100]
+TRACK_SIMPLIFY_CACHE_ALIAS = 'tracks'
+TRACK_SIMPLIFY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Жесткий лимит записей в ответе списка без пагинации
+UNPAGINATED_RESULTS_LIMIT = 1000
+
+# Поиск точек рядом: максимальный радиус в метрах и окно "сейчас на трассе" в секундах
+NEARBY_MAX_RADIUS = 50000
+NEARBY_ACTIVE_WINDOW = 300
+# Окно истории в секундах, если клиент не передал since, и сколько строк в прямоугольнике
+# поиска просматривать не больше (в людном месте за окно их может набраться очень много)
+NEARBY_HISTORY_WINDOW = 60 * 60 * 24
+NEARBY_MAX_SCANNED_ROWS = 20000
+
+# Сколько точек читать из БД и отдавать клиенту за раз при потоковом экспорте
+EXPORT_CHUNK_SIZE = 2000
+
+# Сколько запросов async-эндпоинтов трекинга одновременно обращаются к БД в одном процессе
+ASYNC_DB_CONCURRENCY = 20
+
+# Отложенная запись одиночных точек (см. app_run.write_behind): точка подтверждается после записи
+# в журнал процесса и попадает в БД пачкой по размеру буфера или по таймеру (секунды)
+POSITIONS_WRITE_BEHIND = False
+POSITIONS_WRITE_BEHIND_MAX_SIZE = 500
+POSITIONS_WRITE_BEHIND_MAX_DELAY = 1.0
+# Локальный каталог журналов, общий для воркеров одной машины
+POSITIONS_WRITE_BEHIND_DIR = BASE_DIR / 'var' / 'position_journal'
+
+# Фильтр точек при загрузке (app_run.ingest_filters): включенные правила в порядке проверки,
+# окно последних точек на забег и сколько забегов держать в памяти процесса.
+# Окно не меньше типичной пачки: повтор пачки после таймаута целиком отбрасывается как дубликаты
+INGEST_FILTERS = ['duplicate', 'speed', 'stationary']
+INGEST_FILTER_WINDOW_SIZE = 100
+INGEST_FILTER_MAX_RUNS = 2000
+# Повтор позиции в пределах окна, секунды и метры
+INGEST_DUPLICATE_WINDOW = 1.0
+INGEST_DUPLICATE_DISTANCE = 1.0
+# Максимальная правдоподобная скорость, м/с
+INGEST_MAX_SPEED = 15.0
+# Стоянка: средняя скорость за окно ниже порога (м/с, окно в секундах), а смещение от последней
+# принятой точки в пределах разброса GPS (метры) - такие точки считаются дрожанием на месте
+INGEST_STATIONARY_SPEED = 0.5
+INGEST_STATIONARY_WINDOW = 10.0
+INGEST_STATIONARY_DISTANCE = 10.0
+
+# Кеш ответов списков (app_run.response_cache). Алиас в CACHES можно заменить на общий бэкенд
+# (Redis, Memcached): с LocMemCache каждый воркер держит и сбрасывает свой кеш сам
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        # LocMemCache вытесняет давно не читанные записи (LRU)
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Упрощенные треки завершенных забегов: отдельно от default, чтобы их не вытесняли другие записи.
+    # По записи на уровень TRACK_SIMPLIFY_TOLERANCES: 3 уровня последних 5000 забегов
+    'tracks': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tracks',
+        'OPTIONS': {'MAX_ENTRIES': 15000},
+    },
+}
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_ALIAS = 'responses'
+# Страховка на случай записей мимо API, например правок в админке, секунды
+RESPONSE_CACHE_TIMEOUT = 300
+# Как долго общие списки могут отставать от метрик забегов на трассе, секунды: точки приходят
+# каждые несколько секунд, и общий список сбрасывается не на каждую (app_run.response_cache.invalidate_live)
+RESPONSE_CACHE_LIVE_INTERVAL = 5
+
+# Чтение с реплик (app_run.routers): алиасы реплик из DATABASES; без них все запросы идут в default.
+# Локально проверяется с настройками project_run.settings.local_replica
+DATABASE_ROUTERS = ['app_run.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+# Ожидаемое отставание реплик, секунды: ответ, прочитанный с реплики раньше этого срока
+# после записи, не кешируется (см. app_run.response_cache)
+DATABASE_REPLICA_LAG = 2
+# Сколько секунд клиент после своей записи читает из основной БД и cookie с этой меткой
+READ_YOUR_WRITES_WINDOW = 5
+READ_YOUR_WRITES_COOKIE = 'db_pin'
+
+# Синхронизация изменений (app_run.sync): отставание границы токена от текущего времени, секунды,
+# и сколько дней хранить отметки об удалении (токены старше требуют полной синхронизации)
+SYNC_SAFETY_MARGIN = 30
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Замер SQL по запросам (app_run.middleware): доля запросов от 0 (выключено) до 1, сколько самых
+# медленных запросов писать в лог и со скольких повторов одного и того же SQL считать его N+1
+SQL_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('SQL_INSTRUMENTATION_SAMPLE_RATE', 0))
+SQL_INSTRUMENTATION_SLOWEST = 3
+SQL_INSTRUMENTATION_REPEAT_THRESHOLD = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'app_run.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
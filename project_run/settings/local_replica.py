@@ -0,0 +1,16 @@
+import os
+
+from .local import *
+
+# Локальная проверка чтения с реплики на двух SQLite. По умолчанию реплика - отдельное подключение
+# только для чтения к той же БД: запись, по ошибке направленная в реплику, упадет с
+# "attempt to write a readonly database". Чтобы увидеть отставание реплики, укажите в REPLICA_DB_NAME
+# копию файла БД: записи в нее не попадают, а клиент после записи READ_YOUR_WRITES_WINDOW секунд
+# читает из основной БД.
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.environ.get('REPLICA_DB_NAME', f"file:{DATABASES['default']['NAME']}?mode=ro"),
+    # В тестах реплика - то же подключение, что и основная БД
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_REPLICAS = ['replica']
@@ -20,8 +20,10 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
 from app_run.views import RunViewSet, RunStartAPIView, RunStopAPIView, UserViewSet, AthleteInfoAPIView, \
-    ChallengeViewSet, PositionViewSet
+    ChallengeViewSet, PositionViewSet, PositionBulkCreateAPIView, \
+    PositionStreamUploadAPIView, LeaderboardAPIView, RunExportAPIView, AthleteExportAPIView
 from app_run.views import company_details
+from app_run import async_views
 
 router = DefaultRouter()
 
@@ -35,6 +37,16 @@ urlpatterns = [
     path('api/company_details/', company_details),
     path('api/runs/<int:run_id>/start/', RunStartAPIView.as_view(), name='run-start'),
     path('api/runs/<int:run_id>/stop/', RunStopAPIView.as_view(), name='run-stop'),
+    path('api/runs/<int:run_id>/positions/bulk/', PositionBulkCreateAPIView.as_view(), name='positions-bulk'),
+    path('api/runs/<int:run_id>/positions/stream/', PositionStreamUploadAPIView.as_view(), name='positions-stream'),
+    path('api/runs/<int:run_id>/export.<str:export_format>', RunExportAPIView.as_view(), name='run-export'),
+    path('api/users/<int:user_id>/export.zip', AthleteExportAPIView.as_view(), name='athlete-export'),
     path('api/athlete_info/<int:user_id>/', AthleteInfoAPIView.as_view(), name='athlete-info'),
+    path('api/leaderboards/<str:board>/', LeaderboardAPIView.as_view(), name='leaderboard'),
+    # Асинхронные варианты трекинга для ASGI (app_run.async_views)
+    path('api/async/runs/<int:run_id>/start/', async_views.run_start, name='async-run-start'),
+    path('api/async/runs/<int:run_id>/stop/', async_views.run_stop, name='async-run-stop'),
+    path('api/async/runs/<int:run_id>/positions/', async_views.position_create, name='async-position-create'),
+    path('api/async/runs/<int:run_id>/positions/bulk/', async_views.positions_bulk_create, name='async-positions-bulk'),
     path('', include(router.urls))
     ]